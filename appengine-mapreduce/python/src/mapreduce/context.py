@@ -30,16 +30,26 @@ __all__ = [
            "EntityList",
            "ItemList",
            "MutationPool",
+           "COUNTER_FLUSH_LATENCY_MS",
+           "COUNTER_FLUSH_OVERLAP_MS",
+           "COUNTER_FLUSH_RETRIES",
+           "COUNTER_FLUSH_RPCS",
+           "COUNTER_FLUSH_WAIT_MS",
            "COUNTER_MAPPER_CALLS",
            "COUNTER_MAPPER_WALLTIME_MS",
            "DATASTORE_DEADLINE",
            "MAX_ENTITY_COUNT",
+           "MAX_FLUSH_ATTEMPTS",
            "MAX_POOL_SIZE",
+           "MAX_RPCS_IN_FLIGHT",
            ]
 
+import collections
 import threading
+import time
 
 from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.ext import db
 
 try:
@@ -61,6 +71,13 @@ MAX_ENTITY_COUNT = 500
 # Deadline in seconds for mutation pool datastore operations.
 DATASTORE_DEADLINE = 15
 
+# Maximum number of mutation pool writes in flight while mapping continues.
+# With 1, one batch is written while the next one is filled.
+MAX_RPCS_IN_FLIGHT = 1
+
+# Number of times a mutation pool write is attempted on transient errors.
+MAX_FLUSH_ATTEMPTS = 3
+
 # The name of the counter which counts all mapper calls.
 COUNTER_MAPPER_CALLS = "mapper-calls"
 
@@ -68,6 +85,24 @@ COUNTER_MAPPER_CALLS = "mapper-calls"
 # hundler function, but includes all i/o overhead.
 COUNTER_MAPPER_WALLTIME_MS = "mapper-walltime-ms"
 
+# Mutation pool writes started.
+COUNTER_FLUSH_RPCS = "mapper-flush-rpcs"
+
+# Mutation pool writes attempted again after a transient error.
+COUNTER_FLUSH_RETRIES = "mapper-flush-retries"
+
+# Time from starting mutation pool writes until they were seen to finish.
+COUNTER_FLUSH_LATENCY_MS = "mapper-flush-latency-ms"
+
+# Part of that time the mapper kept working.
+COUNTER_FLUSH_OVERLAP_MS = "mapper-flush-overlap-ms"
+
+# Part of that time the mapper was blocked waiting.
+COUNTER_FLUSH_WAIT_MS = "mapper-flush-wait-ms"
+
+# Errors after which a mutation pool write is attempted again.
+_RETRIABLE_ERRORS = (datastore_errors.Timeout, datastore_errors.InternalError)
+
 
 def _normalize_entity(value):
   """Return an entity from an entity or model instance."""
@@ -134,32 +169,52 @@ EntityList = ItemList
 class MutationPool(object):
   """Mutation pool accumulates datastore changes to perform them in batch.
 
+  Full lists are written asynchronously, so that mapping continues while
+  the write is in flight. Once max_rpcs_in_flight writes are pending,
+  the oldest one is waited for before another is started. flush() starts
+  writing all lists and waits for every pending write. A write failing
+  with a transient error is attempted again, up to max_flush_attempts
+  times in total.
+
   Properties:
     puts: ItemList of entities to put to datastore.
     deletes: ItemList of keys to delete from datastore.
     max_pool_size: maximum single list pool size. List changes will be flushed
       when this size is reached.
+    max_rpcs_in_flight: maximum number of pending writes.
+    max_flush_attempts: maximum number of attempts per write.
   """
 
   def __init__(self,
                max_pool_size=MAX_POOL_SIZE,
                max_entity_count=MAX_ENTITY_COUNT,
-               mapreduce_spec=None):
+               mapreduce_spec=None,
+               max_rpcs_in_flight=MAX_RPCS_IN_FLIGHT,
+               max_flush_attempts=MAX_FLUSH_ATTEMPTS,
+               counters=None):
     """Constructor.
 
     Args:
       max_pool_size: maximum pools size in bytes before flushing it to db.
       max_entity_count: maximum number of entities before flushing it to db.
       mapreduce_spec: An optional instance of MapperSpec.
+      max_rpcs_in_flight: maximum number of writes pending at once.
+      max_flush_attempts: maximum number of attempts per write.
+      counters: An optional Counters instance to report writes to.
     """
     self.max_pool_size = max_pool_size
     self.max_entity_count = max_entity_count
+    self.max_rpcs_in_flight = max_rpcs_in_flight
+    self.max_flush_attempts = max_flush_attempts
     params = mapreduce_spec.params if mapreduce_spec is not None else {}
     self.force_writes = bool(params.get("force_ops_writes", False))
     self.puts = ItemList()
     self.deletes = ItemList()
     self.ndb_puts = ItemList()
     self.ndb_deletes = ItemList()
+    self._counters = counters
+    # Pending writes as (write function, items, rpc, start time, attempts).
+    self._in_flight = collections.deque()
 
   def put(self, entity):
     """Registers entity to put to datastore.
@@ -170,7 +225,8 @@ class MutationPool(object):
     actual_entity = _normalize_entity(entity)
     if actual_entity is None:
       return self.ndb_put(entity)
-    entity_size = len(actual_entity._ToPb().Encode())
+    # ByteSize() is the length of Encode() without building the string.
+    entity_size = actual_entity._ToPb().ByteSize()
     if (self.puts.length >= self.max_entity_count or
         (self.puts.size + entity_size) > self.max_pool_size):
       self.__flush_puts()
@@ -179,7 +235,7 @@ class MutationPool(object):
   def ndb_put(self, entity):
     """Like put(), but for NDB entities."""
     assert ndb is not None and isinstance(entity, ndb.Model)
-    entity_size = len(entity._to_pb().Encode())
+    entity_size = entity._to_pb().ByteSize()
     if (self.ndb_puts.length >= self.max_entity_count or
         (self.ndb_puts.size + entity_size) > self.max_pool_size):
       self.__flush_ndb_puts()
@@ -195,7 +251,7 @@ class MutationPool(object):
     key = _normalize_key(entity)
     if key is None:
       return self.ndb_delete(entity)
-    key_size = len(key._ToPb().Encode())
+    key_size = key._ToPb().ByteSize()
     if (self.deletes.length >= self.max_entity_count or
         (self.deletes.size + key_size) > self.max_pool_size):
       self.__flush_deletes()
@@ -207,44 +263,105 @@ class MutationPool(object):
       key = entity_or_key.key
     else:
       key = entity_or_key
-    key_size = len(key.reference().Encode())
+    key_size = key.reference().ByteSize()
     if (self.ndb_deletes.length >= self.max_entity_count or
         (self.ndb_deletes.size + key_size) > self.max_pool_size):
       self.__flush_ndb_deletes()
     self.ndb_deletes.append(key, key_size)
 
-  # TODO(user): some kind of error handling/retries is needed here.
   def flush(self):
     """Flush(apply) all changed to datastore."""
     self.__flush_puts()
     self.__flush_deletes()
     self.__flush_ndb_puts()
     self.__flush_ndb_deletes()
+    while self._in_flight:
+      self.__wait_oldest()
 
   def __flush_puts(self):
-    """Flush all puts to datastore."""
+    """Start writing all puts to datastore."""
     if self.puts.length:
-      datastore.Put(self.puts.items, config=self.__create_config())
+      self.__start(self.__put_async, self.puts.items)
     self.puts.clear()
 
   def __flush_deletes(self):
-    """Flush all deletes to datastore."""
+    """Start writing all deletes to datastore."""
     if self.deletes.length:
-      datastore.Delete(self.deletes.items, config=self.__create_config())
+      self.__start(self.__delete_async, self.deletes.items)
     self.deletes.clear()
 
   def __flush_ndb_puts(self):
-    """Flush all NDB puts to datastore."""
+    """Start writing all NDB puts to datastore."""
     if self.ndb_puts.length:
-      ndb.put_multi(self.ndb_puts.items, config=self.__create_config())
+      self.__start(self.__ndb_put_async, self.ndb_puts.items)
     self.ndb_puts.clear()
 
   def __flush_ndb_deletes(self):
-    """Flush all deletes to datastore."""
+    """Start writing all NDB deletes to datastore."""
     if self.ndb_deletes.length:
-      ndb.delete_multi(self.ndb_deletes.items, config=self.__create_config())
+      self.__start(self.__ndb_delete_async, self.ndb_deletes.items)
     self.ndb_deletes.clear()
 
+  def __put_async(self, items):
+    return datastore.PutAsync(items, config=self.__create_config())
+
+  def __delete_async(self, items):
+    return datastore.DeleteAsync(items, config=self.__create_config())
+
+  def __ndb_put_async(self, items):
+    futures = ndb.put_multi_async(items, config=self.__create_config())
+    # Make NDB send the RPCs now rather than when we wait for them.
+    futures.append(ndb.get_context().flush())
+    return futures
+
+  def __ndb_delete_async(self, items):
+    futures = ndb.delete_multi_async(items, config=self.__create_config())
+    futures.append(ndb.get_context().flush())
+    return futures
+
+  def __start(self, write, items):
+    """Start writing items, after waiting for a write if too many pend.
+
+    Args:
+      write: one of the __*_async methods.
+      items: list of items to pass to it.
+    """
+    while len(self._in_flight) >= self.max_rpcs_in_flight:
+      self.__wait_oldest()
+    self.__increment(COUNTER_FLUSH_RPCS)
+    self._in_flight.append((write, items, write(items), time.time(), 1))
+
+  def __wait_oldest(self):
+    """Wait for the oldest pending write, retrying it if needed."""
+    write, items, rpc, start_time, attempts = self._in_flight.popleft()
+    wait_time = time.time()
+    while True:
+      try:
+        if isinstance(rpc, list):
+          for future in rpc:
+            future.check_success()
+        else:
+          rpc.get_result()
+        break
+      except _RETRIABLE_ERRORS:
+        if attempts >= self.max_flush_attempts:
+          raise
+        attempts += 1
+        self.__increment(COUNTER_FLUSH_RETRIES)
+        rpc = write(items)
+    end_time = time.time()
+    self.__increment(COUNTER_FLUSH_LATENCY_MS, end_time - start_time)
+    self.__increment(COUNTER_FLUSH_OVERLAP_MS, wait_time - start_time)
+    self.__increment(COUNTER_FLUSH_WAIT_MS, end_time - wait_time)
+
+  def __increment(self, counter_name, seconds=None):
+    """Increment a counter by one, or by a time span in milliseconds."""
+    if self._counters is not None:
+      if seconds is None:
+        self._counters.increment(counter_name)
+      else:
+        self._counters.increment(counter_name, int(seconds * 1000))
+
   def __create_config(self):
     """Creates datastore Config.
 
@@ -255,8 +372,6 @@ class MutationPool(object):
                                   force_writes=self.force_writes)
 
 
-# This doesn't do much yet. In future it will play nicely with checkpoint/error
-# handling system.
 class Counters(object):
   """Regulates access to counters."""
 
@@ -317,11 +432,12 @@ class Context(object):
       # Only in tests
       self.shard_id = None
 
+    self.counters = Counters(shard_state)
     self.mutation_pool = MutationPool(
         max_pool_size=(MAX_POOL_SIZE/(2**self.task_retry_count)),
         max_entity_count=(MAX_ENTITY_COUNT/(2**self.task_retry_count)),
-        mapreduce_spec=mapreduce_spec)
-    self.counters = Counters(shard_state)
+        mapreduce_spec=mapreduce_spec,
+        counters=self.counters if self.shard_state else None)
 
     self._pools = {}
     self.register_pool("mutation_pool", self.mutation_pool)
@@ -54,6 +54,9 @@ _QUOTA_BATCH_SIZE = 20
 # scheduled as soon as current one takes this long.
 _SLICE_DURATION_SEC = 15
 
+# Inputs passed to a batch mapper at once if the reader has no batch size.
+_MAP_BATCH_SIZE = 50
+
 # Delay between consecutive controller callback invocations.
 _CONTROLLER_PERIOD_SEC = 2
 
@@ -196,10 +199,20 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
 
     config = util.create_datastore_write_config(spec)
 
+    # The controller asked this shard to hand part of its input to a
+    # finished shard. Split outside of the transaction, since splitting
+    # may query the datastore.
+    split_readers = None
+    split_requested = (shard_state.active and not retry_shard and
+                       shard_state.split_into is not None)
+    if split_requested:
+      split_readers = self._split_remaining(input_reader)
+    reader, initial_reader = tstate.input_reader, tstate.initial_input_reader
+
     # We don't want shard state to override active state, since that
     # may stuck job execution (see issue 116). Do a transactional
     # verification for status.
-    @db.transactional(retries=5)
+    @db.transactional(retries=5, xg=bool(split_readers))
     def tx():
       fresh_shard_state = db.get(
           model.ShardState.get_key_by_shard_id(shard_id))
@@ -210,7 +223,25 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
         shard_state.active = False
         logging.error("Spurious task execution. Aborting the shard.")
         return
+      split_into = fresh_shard_state.split_into
       fresh_shard_state.copy_from(shard_state)
+      # A request made during this slice is handled in the next one.
+      if split_into != shard_state.split_into:
+        fresh_shard_state.split_into = split_into
+      else:
+        fresh_shard_state.split_into = None
+      if split_requested and not split_readers:
+        # Asking again would only repeat the split queries every poll.
+        fresh_shard_state.split_failed = True
+      tstate.input_reader = reader
+      tstate.initial_input_reader = initial_reader
+      if (split_readers and split_into == shard_state.split_into and
+          self._start_split(split_into, split_readers[1], tstate, config)):
+        # A shard retry can't redo the input split off, so it restarts
+        # from the split instead, keeping the counts of the work before.
+        tstate.input_reader = split_readers[0]
+        tstate.initial_input_reader = split_readers[0]
+        fresh_shard_state.mark_split()
       fresh_shard_state.put(config=config)
       if retry_shard:
         self._schedule_slice(fresh_shard_state, tstate)
@@ -249,22 +280,23 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
     if not quota_consumer or quota_consumer.consume():
       finished_shard = True
 
-      for entity in input_reader:
-        if isinstance(entity, db.Model):
-          shard_state.last_work_item = repr(entity.key())
-        elif ndb and isinstance(entity, ndb.Model):
-          shard_state.last_work_item = repr(entity.key)
-        else:
-          shard_state.last_work_item = repr(entity)[:100]
-
-        if not self.process_data(
-            entity, input_reader, ctx, transient_shard_state):
-          finished_shard = False
-          break
-        elif quota_consumer and not quota_consumer.consume():
-          # not enough quota to keep processing.
-          finished_shard = False
-          break
+      if util.parse_bool(
+          ctx.mapreduce_spec.mapper.params.get("batch_mapper", False)):
+        finished_shard = self.process_batches(
+            input_reader, shard_state, transient_shard_state, quota_consumer,
+            ctx)
+      else:
+        for entity in input_reader:
+          shard_state.last_work_item = self._get_work_item(entity)
+
+          if not self.process_data(
+              entity, input_reader, ctx, transient_shard_state):
+            finished_shard = False
+            break
+          elif quota_consumer and not quota_consumer.consume():
+            # not enough quota to keep processing.
+            finished_shard = False
+            break
 
       # Flush context and its pools.
       operation.counters.Increment(
@@ -280,6 +312,111 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
         shard_state.active = False
         shard_state.result_status = model.ShardState.RESULT_SUCCESS
 
+  @staticmethod
+  def _get_work_item(entity):
+    """Returns a short description of an input for shard_state."""
+    if isinstance(entity, db.Model):
+      return repr(entity.key())
+    elif ndb and isinstance(entity, ndb.Model):
+      return repr(entity.key)
+    else:
+      return repr(entity)[:100]
+
+  def process_batches(self,
+                      input_reader,
+                      shard_state,
+                      transient_shard_state,
+                      quota_consumer,
+                      ctx):
+    """Read inputs and pass them to a batch mapper a list at a time.
+
+    This is used instead of calling process_data() for each input when the
+    "batch_mapper" mapper parameter is true. Lists are as long as the input
+    reader's batch size, but a reader checkpoint passes on a shorter list.
+    Quota is consumed per input as in process_inputs(). The slice duration
+    is only checked after each list.
+
+    Args:
+      input_reader: input reader.
+      shard_state: shard state.
+      transient_shard_state: transient shard state.
+      quota_consumer: quota consumer to limit processing rate.
+      ctx: mapreduce context.
+
+    Returns:
+      True if the input reader is exhausted, False if the scan stopped early.
+    """
+    batch_size = getattr(input_reader, "_batch_size", None) or _MAP_BATCH_SIZE
+    finished_shard = True
+    batch = []
+    for data in input_reader:
+      if data is not input_readers.ALLOW_CHECKPOINT:
+        batch.append(data)
+        if len(batch) < batch_size:
+          if quota_consumer and not quota_consumer.consume():
+            # not enough quota to keep processing.
+            finished_shard = False
+            break
+          continue
+      # The batch is full, or the reader allows a checkpoint here.
+      continue_scan = self.process_batch(
+          batch, input_reader, ctx, transient_shard_state, shard_state)
+      batch = []
+      if not continue_scan:
+        finished_shard = False
+        break
+      elif quota_consumer and not quota_consumer.consume():
+        finished_shard = False
+        break
+    if batch:
+      self.process_batch(
+          batch, input_reader, ctx, transient_shard_state, shard_state)
+    return finished_shard
+
+  def process_batch(self, batch, input_reader, ctx, transient_shard_state,
+                    shard_state):
+    """Process a list of data pieces with a batch mapper.
+
+    The mapper handler is called once with the whole list. If it is a
+    generator, operations it yields are applied in order and all other
+    outputs are passed to the output writer's write_multi() at once.
+
+    Args:
+      batch: a list of data to process, possibly empty.
+      input_reader: input reader.
+      ctx: mapreduce context
+      transient_shard_state: transient shard state.
+      shard_state: shard state.
+
+    Returns:
+      True if scan should be continued, False if scan should be aborted.
+    """
+    if batch:
+      shard_state.last_work_item = self._get_work_item(batch[-1])
+      ctx.counters.increment(context.COUNTER_MAPPER_CALLS, len(batch))
+
+      handler = ctx.mapreduce_spec.mapper.handler
+      result = handler(batch)
+
+      if util.is_generator(handler):
+        outputs = []
+        for output in result:
+          if isinstance(output, operation.Operation):
+            output(ctx)
+          else:
+            outputs.append(output)
+        if outputs:
+          output_writer = transient_shard_state.output_writer
+          if not output_writer:
+            logging.error(
+                "Handler yielded %s, but no output writer is set.", outputs)
+          else:
+            output_writer.write_multi(outputs, ctx)
+
+    if self._time() - self._start_time > _SLICE_DURATION_SEC:
+      return False
+    return True
+
   def process_data(self, data, input_reader, ctx, transient_shard_state):
     """Process a single data piece.
 
@@ -343,7 +480,8 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
 
     # Shard retry
     if type(e) in errors.SHARD_RETRY_ERRORS:
-      shard_retry = shard_state.retries
+      # Restarts to process split off input don't count as retries.
+      shard_retry = shard_state.retries - shard_state.reuses
       if shard_retry < parameters.DEFAULT_SHARD_RETRY_LIMIT:
         if tstate.output_writer and (
             not tstate.output_writer._can_be_retried(tstate)):
@@ -376,6 +514,59 @@ class MapperWorkerCallbackHandler(util.HugeTaskHandler):
     shard_state.result_status = model.ShardState.RESULT_FAILED
     return False
 
+  def _split_remaining(self, input_reader):
+    """Split the input left in input_reader for work stealing.
+
+    Args:
+      input_reader: input reader of this shard.
+
+    Returns:
+      A list of two input readers covering the input left, or None if it
+      can't be split.
+    """
+    if not hasattr(input_reader, "split_remaining"):
+      return None
+    try:
+      return input_reader.split_remaining()
+    # pylint: disable=broad-except
+    except Exception, e:
+      logging.warning("Failed to split remaining input of %s: %s",
+                      input_reader, e)
+      return None
+
+  def _start_split(self, shard_number, input_reader, tstate, config):
+    """Restart a finished shard to process input split off this shard.
+
+    Must be called in a transaction.
+
+    Args:
+      shard_number: number of the finished shard to restart as int.
+      input_reader: input reader with the input split off.
+      tstate: model.TransientShardState of this shard.
+      config: datastore write config.
+
+    Returns:
+      True if the shard was restarted, False if it is not finished.
+    """
+    spec = tstate.mapreduce_spec
+    split_shard_id = model.ShardState.shard_id_from_number(
+        spec.mapreduce_id, shard_number)
+    split_shard_state = db.get(
+        model.ShardState.get_key_by_shard_id(split_shard_id))
+    if (not split_shard_state or split_shard_state.active or
+        split_shard_state.result_status != model.ShardState.RESULT_SUCCESS):
+      return False
+    logging.info("Shard %s hands %s over to shard %s.",
+                 tstate.shard_id, input_reader, split_shard_id)
+    split_shard_state.reset_for_split(str(input_reader))
+    split_shard_state.put(config=config)
+    self._schedule_slice(
+        split_shard_state,
+        model.TransientShardState(
+            tstate.base_path, spec, split_shard_id, 0, input_reader,
+            input_reader, retries=split_shard_state.retries))
+    return True
+
   @staticmethod
   def get_task_name(shard_id, slice_id, retry=0):
     """Compute single worker task name.
@@ -531,14 +722,21 @@ class ControllerCallbackHandler(util.HugeTaskHandler):
           spec, state, self.base_path())
       return
 
+    if self._can_split_shards(spec):
+      self.split_shards(spec, shard_states)
+
+    processing_rate = int(spec.mapper.params.get(
+        "processing_rate") or model._DEFAULT_PROCESSING_RATE_PER_SEC)
+    if util.parse_bool(spec.mapper.params.get("quota_token_bucket", False)):
+      self.refill_quotas(poll_time, processing_rate, active_shards, state)
+    else:
+      self.refill_quotas(poll_time, processing_rate, active_shards)
+
     # We don't need a transaction here, since we change only statistics data,
     # and we don't care if it gets overwritten/slightly inconsistent.
     config = util.create_datastore_write_config(spec)
     state.put(config=config)
 
-    processing_rate = int(spec.mapper.params.get(
-        "processing_rate") or model._DEFAULT_PROCESSING_RATE_PER_SEC)
-    self.refill_quotas(poll_time, processing_rate, active_shards)
     ControllerCallbackHandler.reschedule(
         state, self.base_path(), spec, self.serial_id() + 1)
 
@@ -559,20 +757,103 @@ class ControllerCallbackHandler(util.HugeTaskHandler):
 
     mapreduce_state.set_processed_counts(processed_counts)
 
+  @staticmethod
+  def _can_split_shards(spec):
+    """Returns True if work stealing can be used for the mapreduce.
+
+    Work stealing is turned on with the "work_stealing" mapper parameter.
+    It needs an input reader that implements split_remaining(), and no
+    output writer, since the output of a finished shard can't be reopened.
+
+    Args:
+      spec: mapreduce specification as MapreduceSpec.
+
+    Returns:
+      True if the controller should split shards, False otherwise.
+    """
+    return (util.parse_bool(spec.mapper.params.get("work_stealing", False))
+            and hasattr(spec.mapper.input_reader_class(), "split_remaining")
+            and not spec.mapper.output_writer_class())
+
+  def split_shards(self, spec, shard_states):
+    """Ask active shards to hand part of their input to finished shards.
+
+    Every successfully finished shard that is not spoken for yet is paired
+    with an active shard, which is asked to split its remaining input at the
+    end of its current slice and restart the finished shard with one half
+    of it. Shards whose input couldn't be split before are skipped.
+
+    Input readers don't report how much input they have left, so active
+    shards are tried in order of mapper calls made so far. That is work
+    done, not work left: it favors shards that started early or have cheap
+    input over shards that are actually furthest from done.
+
+    Args:
+      spec: mapreduce specification as MapreduceSpec.
+      shard_states: all shard states, list of ShardState.
+    """
+    active_shards = [s for s in shard_states if s.active]
+    requested = set(s.split_into for s in active_shards)
+    finished_numbers = [
+        s.shard_number for s in shard_states
+        if (s.result_status == model.ShardState.RESULT_SUCCESS and
+            s.shard_number not in requested)]
+    stragglers = [s for s in active_shards
+                  if s.split_into is None and not s.split_failed]
+    stragglers.sort(key=lambda s: s.counters_map.get(
+        context.COUNTER_MAPPER_CALLS), reverse=True)
+    config = util.create_datastore_write_config(spec)
+
+    @db.transactional(retries=5)
+    def tx(shard_id, shard_number):
+      # Don't override anything the shard's worker wrote meanwhile.
+      shard_state = db.get(model.ShardState.get_key_by_shard_id(shard_id))
+      if (shard_state and shard_state.active and
+          shard_state.split_into is None):
+        shard_state.split_into = shard_number
+        shard_state.put(config=config)
+
+    for shard_state, shard_number in zip(stragglers, finished_numbers):
+      tx(shard_state.shard_id, shard_number)
+
   def refill_quotas(self,
                     last_poll_time,
                     processing_rate,
-                    active_shard_states):
+                    active_shard_states,
+                    mapreduce_state=None):
     """Refill quotas for all active shards.
 
+    All shard buckets are refilled with a single memcache call. By default
+    every shard gets the same amount, rounded up.
+
+    If mapreduce_state is given, quota is refilled token bucket style
+    instead (the "quota_token_bucket" mapper parameter): the elapsed time
+    is not truncated to whole seconds, nothing is rounded up, and the
+    fraction of a unit left over is kept in mapreduce_state.quota_carry
+    for the next refill.
+
     Args:
       last_poll_time: Datetime with the last time the job state was updated.
       processing_rate: How many items to process per second overall.
       active_shard_states: All active shard states, list of ShardState.
+      mapreduce_state: Optional MapreduceState to carry fractions over in.
     """
     if not active_shard_states:
       return
     quota_manager = quota.QuotaManager(memcache.Client())
+    shard_ids = [shard_state.shard_id for shard_state in active_shard_states]
+
+    if mapreduce_state is not None:
+      last_poll_time = (time.mktime(last_poll_time.timetuple()) +
+                        last_poll_time.microsecond / 1e6)
+      total_quota_refill = processing_rate * max(
+          0, self._time() - last_poll_time)
+      # Rotate the shards that get the units left after an even split.
+      amounts, mapreduce_state.quota_carry = quota.split_quota(
+          total_quota_refill, shard_ids, mapreduce_state.quota_carry or 0.0,
+          start=self.serial_id())
+      quota_manager.put_multi(amounts)
+      return
 
     current_time = int(self._time())
     last_poll_time = time.mktime(last_poll_time.timetuple())
@@ -583,9 +864,7 @@ class ControllerCallbackHandler(util.HugeTaskHandler):
     if not quota_refill:
       return
 
-    # TODO(user): use batch memcache API to refill quota in one API call.
-    for shard_state in active_shard_states:
-      quota_manager.put(shard_state.shard_id, quota_refill)
+    quota_manager.put_multi(dict.fromkeys(shard_ids, quota_refill))
 
   def serial_id(self):
     """Get serial unique identifier of this task from request.
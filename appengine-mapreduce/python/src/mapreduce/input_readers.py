@@ -43,7 +43,9 @@ __all__ = [
 # pylint: disable-msg=C6409
 
 import base64
+import bisect
 import copy
+import heapq
 import logging
 import random
 import string
@@ -375,6 +377,9 @@ class AbstractDatastoreInputReader(InputReader):
   # __scatter__ oversampling factor
   _OVERSAMPLING_FACTOR = 32
 
+  # Most __scatter__ keys sampled to split a single KeyRange.
+  _MAX_SPLIT_SAMPLES = 10000
+
   # The maximum number of namespaces that will be sharded by datastore key
   # before switching to a strategy where sharding is done lexographically by
   # namespace.
@@ -388,6 +393,7 @@ class AbstractDatastoreInputReader(InputReader):
   NAMESPACE_RANGE_PARAM = "namespace_range"
   CURRENT_KEY_RANGE_PARAM = "current_key_range"
   FILTERS_PARAM = "filters"
+  SHARD_BY_SIZE_PARAM = "shard_by_size"
 
   # TODO(user): Add support for arbitrary queries. It's not possible to
   # support them without cursors since right now you can't even serialize query
@@ -530,6 +536,47 @@ class AbstractDatastoreInputReader(InputReader):
     else:
       return repr(self._ns_range)
 
+  def split_remaining(self):
+    """Splits the input this reader has left between two new readers.
+
+    If more than one KeyRange is left, the second half of them goes to the
+    second reader. A single KeyRange is split using __scatter__ samples.
+    Readers over a NamespaceRange can't be split.
+
+    Returns:
+      A list of two readers that together read exactly what this reader has
+      left, or None if the remaining input can't be split. This reader is not
+      changed.
+    """
+    if self._key_ranges is None:
+      return None
+
+    remaining_ranges = []
+    if self._current_key_range is not None:
+      remaining_ranges.append(copy.deepcopy(self._current_key_range))
+    # self._key_ranges is a stack, so the next KeyRange to process is last.
+    remaining_ranges.extend(
+        copy.deepcopy(k_range) for k_range in reversed(self._key_ranges)
+        if k_range is not None)
+
+    if len(remaining_ranges) == 1:
+      weighted_ranges = self._split_key_range(
+          remaining_ranges[0], self._entity_kind, 2)
+      if len(weighted_ranges) < 2:
+        return None
+      remaining_ranges = [k_range for k_range, _ in weighted_ranges]
+    elif not remaining_ranges:
+      return None
+
+    half = (len(remaining_ranges) + 1) // 2
+    return [self.__class__(self._entity_kind,
+                           key_ranges=key_ranges,
+                           ns_range=None,
+                           batch_size=self._batch_size,
+                           filters=self._filters)
+            for key_ranges in (remaining_ranges[:half],
+                               remaining_ranges[half:])]
+
   @classmethod
   def _choose_split_points(cls, sorted_keys, shard_count):
     """Returns the best split points given a random set of db.Keys."""
@@ -611,24 +658,192 @@ class AbstractDatastoreInputReader(InputReader):
 
     return key_ranges
 
+  @staticmethod
+  def _key_in_range(k_range, key):
+    """Returns True if key is within the ascending KeyRange k_range."""
+    if k_range.key_start is not None:
+      if key < k_range.key_start:
+        return False
+      if key == k_range.key_start and not k_range.include_start:
+        return False
+    if k_range.key_end is not None:
+      if key > k_range.key_end:
+        return False
+      if key == k_range.key_end and not k_range.include_end:
+        return False
+    return True
+
+  @classmethod
+  def _split_key_range(cls, k_range, entity_kind, count):
+    """Split a KeyRange into at most count KeyRanges of similar size.
+
+    Split points are chosen from the __scatter__ sampled keys of the
+    KeyRange's namespace that fall into the KeyRange. Sampled keys are
+    spread over the entities uniformly, so the number of them in each
+    resulting KeyRange is an estimate of its relative size. When a KeyRange
+    covers only part of its namespace, more of the namespace is sampled in
+    proportion, up to _MAX_SPLIT_SAMPLES keys.
+
+    Args:
+      k_range: the ascending key_range.KeyRange to split.
+      entity_kind: entity kind as string.
+      count: maximum number of KeyRanges to split into as int.
+
+    Returns:
+      A list of (key_range.KeyRange, size) tuples in key order, where size is
+      the number of sampled keys in the KeyRange as int. The KeyRanges cover
+      exactly the same keys as k_range.
+    """
+    assert k_range.direction == key_range.KeyRange.ASC
+    ds_query = datastore.Query(kind=cls._get_raw_entity_kind(entity_kind),
+                               namespace=k_range.namespace,
+                               _app=k_range._app,
+                               keys_only=True)
+    ds_query.Order("__scatter__")
+    wanted = count * cls._OVERSAMPLING_FACTOR
+    limit = wanted
+    while True:
+      random_keys = ds_query.Get(limit)
+      sampled_keys = sorted(key for key in random_keys
+                            if cls._key_in_range(k_range, key))
+      if (len(sampled_keys) >= wanted or len(random_keys) < limit or
+          limit >= cls._MAX_SPLIT_SAMPLES):
+        break
+      # Too few samples fell into the KeyRange. Grow the sample by the
+      # KeyRange's estimated share of the namespace, at least doubling it.
+      limit = min(cls._MAX_SPLIT_SAMPLES,
+                  max(2 * limit,
+                      limit * wanted // max(1, len(sampled_keys))))
+
+    if len(sampled_keys) >= count:
+      split_points = cls._choose_split_points(sampled_keys, count)
+    else:
+      split_points = sampled_keys
+
+    starts = [k_range.key_start] + split_points
+    ends = split_points + [k_range.key_end]
+    positions = ([0] +
+                 [bisect.bisect_left(sampled_keys, key)
+                  for key in split_points] +
+                 [len(sampled_keys)])
+    weighted_ranges = []
+    for i in range(len(starts)):
+      weighted_ranges.append((key_range.KeyRange(
+          key_start=starts[i],
+          key_end=ends[i],
+          direction=key_range.KeyRange.ASC,
+          include_start=k_range.include_start if i == 0 else True,
+          include_end=k_range.include_end if i == len(starts) - 1 else False,
+          namespace=k_range.namespace,
+          _app=k_range._app), positions[i + 1] - positions[i]))
+    return weighted_ranges
+
+  @classmethod
+  def _count_scatter_keys(cls, app, namespace, entity_kind):
+    """Returns the number of entities of a namespace with a __scatter__ key.
+
+    A fixed fraction of entities, picked uniformly at random, has a
+    __scatter__ property, so the count is proportional to the number of
+    entities.
+    """
+    ds_query = datastore.Query(kind=cls._get_raw_entity_kind(entity_kind),
+                               namespace=namespace,
+                               _app=app,
+                               keys_only=True)
+    ds_query.Order("__scatter__")
+    return ds_query.Count(limit=None)
+
+  @classmethod
+  def _split_namespaces_by_size(cls, app, namespaces, entity_kind,
+                                shard_count):
+    """Split every namespace into KeyRanges weighted by estimated size.
+
+    Each namespace is split by _split_key_range() into at most shard_count
+    KeyRanges. When a namespace has more __scatter__ keys than are sampled,
+    the samples only decide the split points: the namespace's KeyRanges are
+    scaled up to the namespace's total number of __scatter__ keys, so large
+    namespaces aren't weighed the same as ones that just reach the cap.
+
+    Args:
+      app: app id as string or None.
+      namespaces: list of namespaces as strings.
+      entity_kind: entity kind as string.
+      shard_count: number of shards as int.
+
+    Returns:
+      A list of (key_range.KeyRange, size) tuples, where size is the
+      estimated number of __scatter__ keys in the KeyRange.
+    """
+    weighted_ranges = []
+    for namespace in namespaces:
+      namespace_ranges = cls._split_key_range(
+          key_range.KeyRange(key_start=None,
+                             key_end=None,
+                             direction=key_range.KeyRange.ASC,
+                             include_start=False,
+                             include_end=False,
+                             namespace=namespace,
+                             _app=app),
+          entity_kind,
+          shard_count)
+      sample_count = sum(size for _, size in namespace_ranges)
+      if sample_count >= shard_count * cls._OVERSAMPLING_FACTOR:
+        scale = (cls._count_scatter_keys(app, namespace, entity_kind) /
+                 float(sample_count))
+        namespace_ranges = [(k_range, size * scale)
+                            for k_range, size in namespace_ranges]
+      weighted_ranges.extend(namespace_ranges)
+    return weighted_ranges
+
+  @staticmethod
+  def _pack_key_ranges(weighted_ranges, shard_count):
+    """Assign KeyRanges to shards so that shards get similar total sizes.
+
+    KeyRanges are assigned largest first, each to the shard with the smallest
+    total size so far. Ties go to the shard with the fewest KeyRanges, so
+    that KeyRanges are still spread out evenly when no sizes are known.
+
+    Args:
+      weighted_ranges: a list of (key_range.KeyRange, size) tuples.
+      shard_count: number of shards as int.
+
+    Returns:
+      A list of shard_count lists of KeyRanges. Some lists may be empty.
+    """
+    shard_ranges = [[] for _ in range(shard_count)]
+    shard_heap = [(0, 0, i) for i in range(shard_count)]
+    for k_range, size in sorted(weighted_ranges,
+                                key=lambda weighted_range: -weighted_range[1]):
+      total_size, range_count, i = heapq.heappop(shard_heap)
+      shard_ranges[i].append(k_range)
+      heapq.heappush(shard_heap, (total_size + size, range_count + 1, i))
+    return shard_ranges
+
   @classmethod
   def _split_input_from_params(cls, app, namespaces, entity_kind_name,
                                params, shard_count):
     """Return input reader objects. Helper for split_input."""
-    key_ranges = []  # KeyRanges for all namespaces
-    for namespace in namespaces:
-      key_ranges.extend(
-          cls._split_input_from_namespace(app,
-                                          namespace,
-                                          entity_kind_name,
-                                          shard_count))
-
-    # Divide the KeyRanges into shard_count shards. The KeyRanges for different
-    # namespaces might be very different in size so the assignment of KeyRanges
-    # to shards is done round-robin.
-    shared_ranges = [[] for _ in range(shard_count)]
-    for i, k_range in enumerate(key_ranges):
-      shared_ranges[i % shard_count].append(k_range)
+    if util.parse_bool(params.get(cls.SHARD_BY_SIZE_PARAM, False)):
+      # Split every namespace as finely as the shard count, then bin-pack the
+      # KeyRanges of all namespaces onto shards by their estimated sizes.
+      weighted_ranges = cls._split_namespaces_by_size(
+          app, namespaces, entity_kind_name, shard_count)
+      shared_ranges = cls._pack_key_ranges(weighted_ranges, shard_count)
+    else:
+      key_ranges = []  # KeyRanges for all namespaces
+      for namespace in namespaces:
+        key_ranges.extend(
+            cls._split_input_from_namespace(app,
+                                            namespace,
+                                            entity_kind_name,
+                                            shard_count))
+
+      # Divide the KeyRanges into shard_count shards. The KeyRanges for
+      # different namespaces might be very different in size so the
+      # assignment of KeyRanges to shards is done round-robin.
+      shared_ranges = [[] for _ in range(shard_count)]
+      for i, k_range in enumerate(key_ranges):
+        shared_ranges[i % shard_count].append(k_range)
     batch_size = int(params.get(cls.BATCH_SIZE_PARAM, cls._BATCH_SIZE))
 
     return [cls(entity_kind_name,
@@ -695,7 +910,10 @@ class AbstractDatastoreInputReader(InputReader):
         namespace. If specified then the input reader will only yield values
         in the given namespace. If 'namespace' is not given then values from
         all namespaces will be yielded. May also have 'batch_size' in the params
-        to specify the number of entities to process in each batch.
+        to specify the number of entities to process in each batch. If
+        'shard_by_size' is true, KeyRanges are assigned to shards by their
+        sizes as estimated from __scatter__ keys instead of round-robin,
+        and shards that get no KeyRanges are left out.
 
     Returns:
       A list of InputReader objects. If the query results are empty then the
@@ -1732,6 +1950,13 @@ class ConsistentKeyReader(DatastoreKeyInputReader):
       reader.start_time_us = start_time_us
     return readers
 
+  def split_remaining(self):
+    """Splits the remaining input, keeping start_time_us."""
+    readers = super(ConsistentKeyReader, self).split_remaining()
+    for reader in readers or []:
+      reader.start_time_us = self.start_time_us
+    return readers
+
   def to_json(self):
     """Serializes all the data in this reader into json form.
 
@@ -1985,6 +2210,23 @@ class RecordsReader(InputReader):
           "Must specify '%s' or '%s' parameter for mapper input" %
           (cls.FILES_PARAM, cls.FILE_PARAM))
 
+  def split_remaining(self):
+    """Splits the files this reader has left between two new readers.
+
+    Files can't be split, so the first reader keeps the current file and
+    position and the files left are divided between the two readers.
+
+    Returns:
+      A list of two readers that together read exactly what this reader has
+      left, or None if there is only one file left. This reader is not
+      changed.
+    """
+    if len(self._filenames) < 2:
+      return None
+    half = (len(self._filenames) + 1) // 2
+    return [self.__class__(self._filenames[:half], self._reader.tell()),
+            self.__class__(self._filenames[half:], 0)]
+
   def __str__(self):
     position = 0
     if self._reader:
@@ -13,9 +13,19 @@ pycrc 0.7.1 (http://www.tty1.net/pycrc/). Command line used:
 
 
 
-# TODO(user): We would really benefit from having this as a c extension.
+# If a native crc32c module is importable it is used instead of the
+# pure python code below.
+
+from __future__ import absolute_import
 
 import array
+import itertools
+import struct
+
+try:
+  import crc32c as _native_crc32c
+except ImportError:
+  _native_crc32c = None
 
 CRC_TABLE = (
     0x00000000L, 0xf26b8303L, 0xe13b70f7L, 0x1350f3f4L,
@@ -91,6 +101,74 @@ CRC_INIT = 0
 _MASK = 0xFFFFFFFFL
 
 
+def _make_slicing_tables():
+  """Builds the 8 tables for the slicing-by-8 algorithm.
+
+  Table k maps a byte to its CRC contribution when followed by k zero
+  bytes, so 8 bytes can be folded into the CRC with 8 lookups.
+
+  Returns:
+    tuple of 8 tuples of 256 ints each; the first one equals CRC_TABLE.
+  """
+  tables = [tuple(int(v) for v in CRC_TABLE)]
+  for _ in range(7):
+    prev = tables[-1]
+    tables.append(tuple(
+        (v >> 8) ^ tables[0][v & 0xff] for v in prev))
+  return tuple(tables)
+
+
+_SLICING_TABLES = _make_slicing_tables()
+
+# Number of bytes unpacked into words at a time by the sliced loop.
+_CHUNK_SIZE = 64 * 1024
+
+
+def _to_bytes(data):
+  """Converts data accepted by crc_update to a string."""
+  if isinstance(data, str):
+    return data
+  if isinstance(data, array.array) and data.itemsize == 1:
+    return data.tostring()
+  if isinstance(data, buffer):
+    return str(data)
+  return array.array("B", data).tostring()
+
+
+def _crc_update_sliced(crc, data):
+  """Updates a non-finalized CRC with a string, 8 bytes per step."""
+  t0, t1, t2, t3, t4, t5, t6, t7 = _SLICING_TABLES
+  crc = int(crc ^ _MASK)
+  length = len(data)
+  end = length - length % 8
+  pos = 0
+  while pos < end:
+    chunk_end = min(end, pos + _CHUNK_SIZE)
+    words = iter(struct.unpack_from(
+        "<%dI" % ((chunk_end - pos) // 4), data, pos))
+    for lo, hi in itertools.izip(words, words):
+      lo ^= crc
+      crc = (t7[lo & 0xff] ^ t6[(lo >> 8) & 0xff] ^
+             t5[(lo >> 16) & 0xff] ^ t4[lo >> 24] ^
+             t3[hi & 0xff] ^ t2[(hi >> 8) & 0xff] ^
+             t1[(hi >> 16) & 0xff] ^ t0[hi >> 24])
+    pos = chunk_end
+  for b in data[end:]:
+    crc = t0[(crc ^ ord(b)) & 0xff] ^ (crc >> 8)
+  return long(crc ^ _MASK)
+
+
+def _crc_update_native(crc, data):
+  """Updates a CRC using the native crc32c module."""
+  return long(_native_crc32c.crc32c(data, crc))
+
+
+if _native_crc32c is not None and hasattr(_native_crc32c, "crc32c"):
+  _crc_update = _crc_update_native
+else:
+  _crc_update = _crc_update_sliced
+
+
 def crc_update(crc, data):
   """Update CRC-32C checksum with data.
 
@@ -101,17 +179,7 @@ def crc_update(crc, data):
   Returns:
     32-bit updated CRC-32C as long.
   """
-  # Convert data to byte array if needed
-  if type(data) != array.array or data.itemsize != 1:
-    buf = array.array("B", data)
-  else:
-    buf = data
-
-  crc = crc ^ _MASK
-  for b in buf:
-    table_index = (crc ^ b) & 0xff
-    crc = (CRC_TABLE[table_index] ^ (crc >> 8)) & _MASK
-  return crc ^ _MASK
+  return _crc_update(crc & _MASK, _to_bytes(data))
 
 
 def crc_finalize(crc):
@@ -539,6 +539,8 @@ class MapreduceState(db.Model):
     start_time: When the job started.
     writer_state: Json property to be used by writer to store its state.
       This is filled when single output per job. Will be dprecated.
+    quota_carry: fraction of a quota unit carried over between refills
+      when the "quota_token_bucket" mapper parameter is set.
   """
 
   RESULT_SUCCESS = "success"
@@ -554,6 +556,7 @@ class MapreduceState(db.Model):
   counters_map = JsonProperty(CountersMap, default=CountersMap(), indexed=False)
   app_id = db.StringProperty(required=False, indexed=True)
   writer_state = JsonProperty(dict, indexed=False)
+  quota_carry = db.FloatProperty(default=0.0, indexed=False)
 
   # For UI purposes only.
   chart_url = db.TextProperty(default="")
@@ -764,6 +767,16 @@ class ShardState(db.Model):
     last_work_item: A string description of the last work item processed.
     writer_state: writer state for this shard. This is filled when output
       per input.
+    split_into: shard number of a finished shard that this shard is asked
+      to hand part of its remaining input to, or None.
+    reuses: how many times this shard was restarted to process input split
+      off other shards. Included in retries.
+    split_counters: counters as of the last split that changed this shard's
+      input. A shard retry restarts from that split, so it resets
+      counters_map to these instead of clearing it.
+    split_failed: True if this shard was asked to split and its remaining
+      input couldn't be split. The controller doesn't ask it again until
+      its input changes.
   """
 
   RESULT_SUCCESS = "success"
@@ -778,6 +791,11 @@ class ShardState(db.Model):
   result_status = db.StringProperty(choices=_RESULTS, indexed=False)
   retries = db.IntegerProperty(default=0, indexed=False)
   writer_state = JsonProperty(dict, indexed=False)
+  split_into = db.IntegerProperty(indexed=False)
+  reuses = db.IntegerProperty(default=0, indexed=False)
+  split_counters = JsonProperty(CountersMap, default=CountersMap(),
+                                indexed=False)
+  split_failed = db.BooleanProperty(default=False, indexed=False)
 
   # For UI purposes only.
   mapreduce_id = db.StringProperty(required=True)
@@ -791,7 +809,35 @@ class ShardState(db.Model):
     self.last_work_item = ""
     self.active = True
     self.result_status = None
+    self.split_failed = False
     self.counters_map = CountersMap()
+    self.counters_map.add_map(self.split_counters)
+
+  def mark_split(self):
+    """Keep the current counters for retries that restart from a split.
+
+    Called when a split changes the input this shard starts from.
+    """
+    self.split_counters = CountersMap()
+    self.split_counters.add_map(self.counters_map)
+
+  def reset_for_split(self, shard_description):
+    """Reset finished self to process input split off another shard.
+
+    Counters are kept, since they still count the work done before.
+
+    Args:
+      shard_description: description of the input split off as string.
+    """
+    self.retries += 1
+    self.reuses += 1
+    self.last_work_item = ""
+    self.active = True
+    self.result_status = None
+    self.split_into = None
+    self.split_failed = False
+    self.shard_description = shard_description
+    self.mark_split()
 
   def copy_from(self, other_state):
     """Copy data from another shard state entity to self."""
@@ -151,6 +151,19 @@ class OutputWriter(model.JsonMixin):
     raise NotImplementedError("write() not implemented in %s" %
                               self.__class__)
 
+  def write_multi(self, data_list, ctx):
+    """Write a list of data.
+
+    Used for the outputs of batch mappers. Writers may override this to
+    write more efficiently than one write() call per item.
+
+    Args:
+      data_list: list of data yielded from handler.
+      ctx: an instance of context.Context.
+    """
+    for data in data_list:
+      self.write(data, ctx)
+
   def finalize(self, ctx, shard_state):
     """Finalize writer shard-level state.
 
@@ -18,6 +18,7 @@
 
 
 
+import math
 
 # Memcache namespace to use.
 _QUOTA_NAMESPACE = "quota"
@@ -57,6 +58,18 @@ class QuotaManager(object):
     self.memcache_client.incr(bucket, delta=amount,
                               initial_value=_OFFSET, namespace=_QUOTA_NAMESPACE)
 
+  def put_multi(self, amounts):
+    """Put amounts into several quota buckets with a single memcache call.
+
+    Args:
+      amounts: dict mapping quota bucket names to amounts as int.
+    """
+    amounts = dict((bucket, amount) for bucket, amount in amounts.iteritems()
+                   if amount)
+    if amounts:
+      self.memcache_client.offset_multi(amounts, initial_value=_OFFSET,
+                                        namespace=_QUOTA_NAMESPACE)
+
   def consume(self, bucket, amount, consume_some=False):
     """Consume amount from quota bucket.
 
@@ -110,6 +123,37 @@ class QuotaManager(object):
                              namespace=_QUOTA_NAMESPACE)
 
 
+def split_quota(amount, buckets, carry=0.0, start=0):
+  """Split a possibly fractional amount of quota between buckets.
+
+  This is the refill step of a token bucket: only whole units are handed
+  out and the fraction is carried over to the next refill, so that low
+  rates are neither rounded up nor down to nothing. Units that do not
+  divide evenly go to one bucket each, beginning at index start, so
+  that varying start lets every bucket get its turn.
+
+  Args:
+    amount: amount of quota to split as int or float.
+    buckets: list of quota bucket names.
+    carry: fraction left over from the previous split.
+    start: index of the first bucket to get an extra unit.
+
+  Returns:
+    A tuple of a dict mapping buckets to amounts as int and the fraction
+    to carry over as float.
+  """
+  total = amount + carry
+  whole = int(math.floor(total))
+  count = len(buckets)
+  share, extra = divmod(whole, count)
+  amounts = {}
+  for i, bucket in enumerate(buckets):
+    amounts[bucket] = share
+    if (i - start) % count < extra:
+      amounts[bucket] += 1
+  return amounts, total - whole
+
+
 class QuotaConsumer(object):
   """Quota consumer wrapper for efficient quota consuming/reclaiming.
 
@@ -25,9 +25,9 @@ __all__ = [
     "ShufflePipeline",
     ]
 
-import gc
 import heapq
 import logging
+import operator
 import os
 import time
 
@@ -70,13 +70,16 @@ class _OutputFile(db.Model):
     return db.Key.from_path(cls.kind(), job_id)
 
 
-def _compare_keys(key_record1, key_record2):
-  """Compare two (key, records) protos by key."""
-  return cmp(key_record1[0], key_record2[0])
+# Sort key of (key, record) pairs.
+_get_key = operator.itemgetter(0)
 
 
 class _BatchRecordsReader(input_readers.RecordsReader):
-  """Records reader that reads in big batches."""
+  """Records reader that reads in big batches.
+
+  Each batch becomes one sorted run, so BATCH_SIZE bounds both the memory
+  used by the sort and the size of the runs merged by _MergingReader.
+  """
 
   BATCH_SIZE = 1024*1024 * 3
 
@@ -86,15 +89,13 @@ class _BatchRecordsReader(input_readers.RecordsReader):
     for record in input_readers.RecordsReader.__iter__(self):
       records.append(record)
       size += len(record)
-      if size > self.BATCH_SIZE:
+      if size >= self.BATCH_SIZE:
         yield records
         size = 0
         records = []
-        gc.collect()
     if records:
       yield records
       records = []
-      gc.collect()
 
 
 def _sort_records_map(records):
@@ -108,17 +109,18 @@ def _sort_records_map(records):
     records: list of records which are serialized KeyValue protos.
   """
   ctx = context.get()
-  l = len(records)
-  key_records = [None] * l
 
   logging.debug("Parsing")
-  for i in range(l):
-    proto = file_service_pb.KeyValue()
-    proto.ParseFromString(records[i])
-    key_records[i] = (proto.key(), records[i])
+  # ParseFromString() clears the proto first, so a single one is reused.
+  proto = file_service_pb.KeyValue()
+  key_records = []
+  for record in records:
+    proto.ParseFromString(record)
+    key_records.append((proto.key(), record))
+  proto.Clear()
 
   logging.debug("Sorting")
-  key_records.sort(cmp=_compare_keys)
+  key_records.sort(key=_get_key)
 
   logging.debug("Writing")
   blob_file_name = (ctx.mapreduce_spec.name + "-" +
@@ -215,6 +217,10 @@ class _MergingReader(input_readers.InputReader):
   max_values_size parameters are not specified, then there will be a single key.
   Otherwise multiple (key, values) pairs for the same key will be created,
   according to restrictions.
+
+  Only one record per file is held in the merge heap, and each file is read
+  through a buffer of read_ahead bytes. The buffers are shrunk when there are
+  many files, so memory stays flat however many runs a shard merges.
   """
 
   expand_parameters = True
@@ -222,11 +228,21 @@ class _MergingReader(input_readers.InputReader):
   FILES_PARAM = "files"
   MAX_VALUES_COUNT_PARAM = "max_values_count"
   MAX_VALUES_SIZE_PARAM = "max_values_size"
+  READ_AHEAD_PARAM = "read_ahead"
+
+  # Default read-ahead buffer size per file in bytes.
+  _DEFAULT_READ_AHEAD = 512 * 1024
+  # Smallest read-ahead buffer size per file in bytes.
+  _MIN_READ_AHEAD = 32 * 1024
+  # Maximum total size of all read-ahead buffers in bytes, unless it would
+  # require buffers smaller than _MIN_READ_AHEAD.
+  _MAX_READ_AHEAD_TOTAL = 32 * 1024 * 1024
 
   def __init__(self,
                offsets,
                max_values_count,
-               max_values_size):
+               max_values_size,
+               read_ahead=_DEFAULT_READ_AHEAD):
     """Constructor.
 
     Args:
@@ -234,10 +250,17 @@ class _MergingReader(input_readers.InputReader):
       max_values_count: maximum number of values to yield for a single value at
         a time. Ignored if -1.
       max_values_size: maximum total size of yielded values.  Ignored if -1
+      read_ahead: read-ahead buffer size for each input file in bytes.
     """
     self._offsets = offsets
     self._max_values_count = max_values_count
     self._max_values_size = max_values_size
+    self._read_ahead = read_ahead
+
+  def _get_buffer_size(self, file_count):
+    """Returns the per-file read-ahead buffer size for file_count files."""
+    budget = self._MAX_READ_AHEAD_TOTAL // max(file_count, 1)
+    return min(self._read_ahead, max(budget, self._MIN_READ_AHEAD))
 
   def __iter__(self):
     """Iterate over records in input files.
@@ -257,12 +280,17 @@ class _MergingReader(input_readers.InputReader):
     readers = []
 
     # Initialize heap
+    buffer_size = self._get_buffer_size(len(filenames))
     for (i, filename) in enumerate(filenames):
       offset = self._offsets[i]
-      reader = records.RecordsReader(files.BufferedFile(filename))
+      reader = records.RecordsReader(
+          files.BufferedFile(filename, buffer_size=buffer_size))
       reader.seek(offset)
       readers.append((None, None, i, reader))
 
+    # ParseFromString() clears the proto first, so a single one is reused.
+    proto = file_service_pb.KeyValue()
+
     # Read records from heap and merge values with the same key.
 
     # current_result is yielded and consumed buy _merge_map.
@@ -308,14 +336,13 @@ class _MergingReader(input_readers.InputReader):
         start_time = time.time()
         binary_record = reader.read()
         # update counters
-        if context.get():
+        if ctx:
           operation.counters.Increment(
               input_readers.COUNTER_IO_READ_BYTES,
-              len(binary_record))(context.get())
+              len(binary_record))(ctx)
           operation.counters.Increment(
               input_readers.COUNTER_IO_READ_MSEC,
-              int((time.time() - start_time) * 1000))(context.get())
-        proto = file_service_pb.KeyValue()
+              int((time.time() - start_time) * 1000))(ctx)
         proto.ParseFromString(binary_record)
         # Put read data back into heap.
         heapq.heapreplace(readers,
@@ -332,13 +359,15 @@ class _MergingReader(input_readers.InputReader):
     """Restore reader from json state."""
     return cls(json["offsets"],
                json["max_values_count"],
-               json["max_values_size"])
+               json["max_values_size"],
+               json.get("read_ahead", cls._DEFAULT_READ_AHEAD))
 
   def to_json(self):
     """Serialize reader state to json."""
     return {"offsets": self._offsets,
             "max_values_count": self._max_values_count,
-            "max_values_size": self._max_values_size}
+            "max_values_size": self._max_values_size,
+            "read_ahead": self._read_ahead}
 
   @classmethod
   def split_input(cls, mapper_spec):
@@ -346,7 +375,10 @@ class _MergingReader(input_readers.InputReader):
     filelists = mapper_spec.params[cls.FILES_PARAM]
     max_values_count = mapper_spec.params.get(cls.MAX_VALUES_COUNT_PARAM, -1)
     max_values_size = mapper_spec.params.get(cls.MAX_VALUES_SIZE_PARAM, -1)
-    return [cls([0] * len(files), max_values_count, max_values_size)
+    read_ahead = int(mapper_spec.params.get(cls.READ_AHEAD_PARAM,
+                                            cls._DEFAULT_READ_AHEAD))
+    return [cls([0] * len(files), max_values_count, max_values_size,
+                read_ahead)
             for files in filelists]
 
   @classmethod
@@ -357,6 +389,14 @@ class _MergingReader(input_readers.InputReader):
     params = mapper_spec.params
     if not cls.FILES_PARAM in params:
       raise errors.BadReaderParamsError("Missing files parameter.")
+    if cls.READ_AHEAD_PARAM in params:
+      try:
+        read_ahead = int(params[cls.READ_AHEAD_PARAM])
+        if read_ahead < 1:
+          raise errors.BadReaderParamsError(
+              "Bad read ahead size: %s" % read_ahead)
+      except ValueError, e:
+        raise errors.BadReaderParamsError("Bad read ahead size: %s" % e)
 
 
 class _HashingBlobstoreOutputWriter(output_writers.BlobstoreOutputWriterBase):
@@ -23,6 +23,7 @@ import unittest
 
 import unittest
 from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.ext import db
 from mapreduce import context
 from testlib import testutil
@@ -50,6 +51,30 @@ def new_datastore_entity(key_name=None):
   return datastore.Entity('TestEntity', name=key_name)
 
 
+class FakeRpc(object):
+  """Stands in for the RPC returned by datastore.PutAsync/DeleteAsync."""
+
+  def __init__(self, log=None, error=None):
+    self.log = log
+    self.error = error
+
+  def get_result(self):
+    if self.log is not None:
+      self.log.append(self)
+    if self.error is not None:
+      raise self.error
+
+
+class FakeCounters(object):
+  """Records counter increments like context.Counters."""
+
+  def __init__(self):
+    self.counters = {}
+
+  def increment(self, counter_name, delta=1):
+    self.counters[counter_name] = self.counters.get(counter_name, 0) + delta
+
+
 class ItemListTest(unittest.TestCase):
   """Tests for context.ItemList class."""
 
@@ -93,19 +118,19 @@ class MutationPoolTest(testutil.HandlerTestBase):
     super(MutationPoolTest, self).setUp()
     self.pool = context.MutationPool()
 
-  def record_put(self, entities, force_writes=False):
-    datastore.Put(
+  def record_put(self, entities, force_writes=False, rpc=None):
+    datastore.PutAsync(
         entities,
         config=testutil.MatchesDatastoreConfig(
             deadline=context.DATASTORE_DEADLINE,
-            force_writes=force_writes))
+            force_writes=force_writes)).AndReturn(rpc or FakeRpc())
 
-  def record_delete(self, entities, force_writes=False):
-    datastore.Delete(
+  def record_delete(self, entities, force_writes=False, rpc=None):
+    datastore.DeleteAsync(
         entities,
         config=testutil.MatchesDatastoreConfig(
             deadline=context.DATASTORE_DEADLINE,
-            force_writes=force_writes))
+            force_writes=force_writes)).AndReturn(rpc or FakeRpc())
 
   def testPoolWithForceWrites(self):
     class MapreduceSpec:
@@ -113,8 +138,8 @@ class MutationPoolTest(testutil.HandlerTestBase):
         self.params = {'force_ops_writes':True}
     pool = context.MutationPool(mapreduce_spec=MapreduceSpec())
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Put', use_mock_anything=True)
-    m.StubOutWithMock(datastore, 'Delete', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'PutAsync', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'DeleteAsync', use_mock_anything=True)
     e1 = TestEntity()
     e2 = TestEntity(key_name='key2')
     self.record_put([e1._populate_internal_entity()], True)
@@ -210,7 +235,7 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.pool = context.MutationPool(1000)
 
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Put', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'PutAsync', use_mock_anything=True)
 
     e1 = TestEntity()
     e2 = TestEntity(tag=' ' * 1000)
@@ -236,7 +261,7 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.pool = context.MutationPool(max_entity_count=max_entity_count)
 
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Put', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'PutAsync', use_mock_anything=True)
 
     entities = []
     for i in range(max_entity_count + 50):
@@ -263,7 +288,7 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.pool = context.MutationPool(500)
 
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Delete', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'DeleteAsync', use_mock_anything=True)
 
     e1 = TestEntity(key_name='goingaway')
     e2 = TestEntity(key_name='x' * 500)
@@ -289,7 +314,7 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.pool = context.MutationPool() # default size is MAX_ENTITY_COUNT
 
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Delete', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'DeleteAsync', use_mock_anything=True)
 
     entities = []
     for i in range(max_entity_count + 50):
@@ -315,8 +340,8 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.pool = context.MutationPool(1000)
 
     m = mox.Mox()
-    m.StubOutWithMock(datastore, 'Delete', use_mock_anything=True)
-    m.StubOutWithMock(datastore, 'Put', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'DeleteAsync', use_mock_anything=True)
+    m.StubOutWithMock(datastore, 'PutAsync', use_mock_anything=True)
 
     e1 = TestEntity()
     e2 = TestEntity(key_name='flushme')
@@ -364,6 +389,77 @@ class MutationPoolTest(testutil.HandlerTestBase):
     self.assertEquals(len(self.pool.ndb_puts.items), 0)
     self.assertEquals(len(self.pool.ndb_deletes.items), 0)
 
+  def testWritesInFlight(self):
+    """Test that full lists are written while the next ones are filled."""
+    counters = FakeCounters()
+    self.pool = context.MutationPool(max_entity_count=1,
+                                     max_rpcs_in_flight=2,
+                                     counters=counters)
+
+    m = mox.Mox()
+    m.StubOutWithMock(datastore, 'PutAsync', use_mock_anything=True)
+
+    entities = [TestEntity() for _ in range(4)]
+    waited = []
+    rpcs = [FakeRpc(waited) for _ in entities]
+
+    # Record Calls
+    for e, rpc in zip(entities, rpcs):
+      self.record_put([e._populate_internal_entity()], rpc=rpc)
+
+    m.ReplayAll()
+    try:  # test, verify
+      self.pool.put(entities[0])
+      self.pool.put(entities[1])
+      self.pool.put(entities[2])
+      # Two writes are in flight and none has been waited for.
+      self.assertEquals([], waited)
+      self.pool.put(entities[3])
+      # The third write had to wait for the first.
+      self.assertEquals(rpcs[:1], waited)
+      self.pool.flush()
+      self.assertEquals(rpcs, waited)
+
+      m.VerifyAll()
+    finally:
+      m.UnsetStubs()
+    self.assertEquals(4, counters.counters[context.COUNTER_FLUSH_RPCS])
+    for name in (context.COUNTER_FLUSH_LATENCY_MS,
+                 context.COUNTER_FLUSH_OVERLAP_MS,
+                 context.COUNTER_FLUSH_WAIT_MS):
+      self.assertTrue(name in counters.counters)
+
+  def testWriteRetries(self):
+    """Test that a write is attempted again after a transient error."""
+    counters = FakeCounters()
+    self.pool = context.MutationPool(max_flush_attempts=2, counters=counters)
+
+    m = mox.Mox()
+    m.StubOutWithMock(datastore, 'DeleteAsync', use_mock_anything=True)
+
+    e1 = TestEntity(key_name='retryme')
+    e2 = TestEntity(key_name='giveup')
+
+    timeout = FakeRpc(error=datastore_errors.Timeout())
+
+    # Record Calls
+    self.record_delete([e1.key()], rpc=timeout)
+    self.record_delete([e1.key()])
+    self.record_delete([e2.key()], rpc=timeout)
+    self.record_delete([e2.key()], rpc=timeout)
+
+    m.ReplayAll()
+    try:  # test, verify
+      self.pool.delete(e1)
+      self.pool.flush()
+      self.pool.delete(e2)
+      self.assertRaises(datastore_errors.Timeout, self.pool.flush)
+
+      m.VerifyAll()
+    finally:
+      m.UnsetStubs()
+    self.assertEquals(2, counters.counters[context.COUNTER_FLUSH_RETRIES])
+
 
 class CountersTest(unittest.TestCase):
   """Test for context.Counters class."""
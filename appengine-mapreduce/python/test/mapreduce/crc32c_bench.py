@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for crc32c checksumming throughput.
+
+Usage: PYTHONPATH=src python test/mapreduce/crc32c_bench.py [sizes in MB]
+"""
+
+
+
+import os
+import sys
+import time
+
+from mapreduce.lib.files import crc32c
+
+
+def slow_crc(data):
+  """Byte at a time implementation, as crc32c used to do it."""
+  crc = crc32c.CRC_INIT ^ crc32c._MASK
+  table = crc32c.CRC_TABLE
+  for b in data:
+    crc = (table[(crc ^ ord(b)) & 0xff] ^ (crc >> 8)) & crc32c._MASK
+  return crc32c.crc_finalize(crc ^ crc32c._MASK)
+
+
+def sliced_crc(data):
+  """The pure python slicing-by-8 implementation."""
+  return crc32c.crc_finalize(
+      crc32c._crc_update_sliced(crc32c.CRC_INIT, data))
+
+
+def bench(name, func, data):
+  """Runs func over data and prints the throughput in MB/s."""
+  start = time.time()
+  result = func(data)
+  elapsed = time.time() - start
+  mb = len(data) / float(1 << 20)
+  print "%-8s %4d MB: %8.2f MB/s (%.2f s, crc 0x%08x)" % (
+      name, mb, mb / elapsed, elapsed, result)
+  return result
+
+
+def main():
+  sizes = [int(arg) for arg in sys.argv[1:]] or [1, 64]
+  print "native crc32c module: %s" % (crc32c._native_crc32c is not None)
+  for size in sizes:
+    data = os.urandom(size << 20)
+    expected = bench("sliced", sliced_crc, data)
+    if crc32c._crc_update is not crc32c._crc_update_sliced:
+      assert expected == bench("native", crc32c.crc, data)
+    if size <= 1:  # The old implementation is too slow for large buffers.
+      assert expected == bench("bytewise", slow_crc, data)
+
+
+if __name__ == "__main__":
+  main()
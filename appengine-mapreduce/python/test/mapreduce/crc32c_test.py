@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+
+import array
+import unittest
+
+from mapreduce.lib.files import crc32c
+
+
+def slow_crc_update(crc, data):
+  """Byte at a time reference implementation."""
+  crc ^= crc32c._MASK
+  for b in array.array("B", data):
+    crc = (crc32c.CRC_TABLE[(crc ^ b) & 0xff] ^ (crc >> 8)) & crc32c._MASK
+  return crc ^ crc32c._MASK
+
+
+class Crc32cTest(unittest.TestCase):
+  """Tests for crc32c module."""
+
+  def testKnownValues(self):
+    self.assertEquals(0, crc32c.crc(""))
+    self.assertEquals(0xe3069283, crc32c.crc("123456789"))
+    self.assertEquals(0x8a9136aa, crc32c.crc("\x00" * 32))
+    self.assertEquals(0x62a8ab43, crc32c.crc("\xff" * 32))
+
+  def testSlicedMatchesReference(self):
+    data = "".join(chr((i * 131 + 7) % 256) for i in range(1000))
+    for length in range(20) + [63, 64, 65, 999]:
+      for crc in (0, 0x12345678, 0xffffffff):
+        self.assertEquals(
+            slow_crc_update(crc, data[:length]),
+            crc32c._crc_update_sliced(crc, data[:length]))
+
+  def testLargerThanChunk(self):
+    data = "".join(chr(i % 251) for i in range(crc32c._CHUNK_SIZE + 13))
+    self.assertEquals(slow_crc_update(0, data), crc32c.crc(data))
+
+  def testIncrementalUpdate(self):
+    data = "Here is some data to checksum in pieces"
+    crc = crc32c.CRC_INIT
+    for i in range(0, len(data), 5):
+      crc = crc32c.crc_update(crc, data[i:i + 5])
+    self.assertEquals(crc32c.crc(data), crc32c.crc_finalize(crc))
+
+  def testInputTypes(self):
+    data = "123456789"
+    expected = crc32c.crc(data)
+    self.assertEquals(expected, crc32c.crc(array.array("B", data)))
+    self.assertEquals(expected, crc32c.crc([ord(c) for c in data]))
+    self.assertEquals(expected, crc32c.crc(buffer(data)))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -223,6 +223,38 @@ def test_handler_yield_keys(entity):
   yield entity.key()
 
 
+class TestBatchHandler(object):
+  """Test batch mapper which records the sizes of the batches it gets.
+
+  Properties:
+    batch_sizes: lengths of all processed batches.
+    delay: advances mock time by this delay on every call.
+  """
+
+  batch_sizes = []
+  delay = 0
+
+  def process(self, entities):
+    """Yields an operation and the key of every entity, and a counter."""
+    TestBatchHandler.batch_sizes.append(len(entities))
+    MockTime.advance_time(TestBatchHandler.delay)
+    for entity in entities:
+      yield TestOperation(entity)
+      yield entity.key()
+    yield operation.counters.Increment("batch-entities", len(entities))
+
+  @staticmethod
+  def reset():
+    """Clear batch_sizes & reset delay to 0."""
+    TestBatchHandler.batch_sizes = []
+    TestBatchHandler.delay = 0
+
+
+def test_batch_handler_return_entities(entities):
+  """Test batch mapper which is not a generator but returns its input."""
+  return entities
+
+
 class InputReader(input_readers.DatastoreInputReader):
   """Test input reader which records number of yields."""
 
@@ -966,13 +998,16 @@ class MapperWorkerCallbackHandlerTest(MapreduceHandlerTestBase):
            mapper_handler_spec=MAPPER_HANDLER_SPEC,
            mapper_parameters=None,
            hooks_class_name=None,
-           output_writer_spec=None):
+           output_writer_spec=None,
+           batch_size=None):
     """Init everything needed for testing worker callbacks.
 
     Args:
       mapper_handler_spec: handler specification to use in test.
       mapper_params: mapper specification to use in test.
       hooks_class_name: fully qualified name of the hooks class to use in test.
+      output_writer_spec: output writer specification to use in test.
+      batch_size: optional batch size for the input reader.
     """
     InputReader.reset()
     self.handler = handlers.MapperWorkerCallbackHandler()
@@ -995,6 +1030,10 @@ class MapperWorkerCallbackHandlerTest(MapreduceHandlerTestBase):
         self.mapreduce_id, self.shard_number)
     self.shard_id = self.shard_state.shard_id
 
+    reader_kwargs = {}
+    if batch_size is not None:
+      reader_kwargs["batch_size"] = batch_size
+
     output_writer = None
     if self.mapreduce_spec.mapper.output_writer_class():
       output_writer = self.mapreduce_spec.mapper.output_writer_class()()
@@ -1004,8 +1043,8 @@ class MapperWorkerCallbackHandlerTest(MapreduceHandlerTestBase):
         self.mapreduce_spec,
         self.shard_id,
         self.slice_id,
-        InputReader(ENTITY_KIND, [key_range.KeyRange()]),
-        InputReader(ENTITY_KIND, [key_range.KeyRange()]),
+        InputReader(ENTITY_KIND, [key_range.KeyRange()], **reader_kwargs),
+        InputReader(ENTITY_KIND, [key_range.KeyRange()], **reader_kwargs),
         output_writer=output_writer
         )
 
@@ -1151,6 +1190,119 @@ class MapperWorkerCallbackHandlerTest(MapreduceHandlerTestBase):
     self.assertEquals(1, len(tasks))
     self.verify_shard_task(tasks[0], self.shard_id, self.slice_id + 1)
 
+  def testWorkStealing(self):
+    """Test that shard hands part of its input over to a finished shard."""
+    for _ in range(4):
+      TestEntity().put()
+
+    reader = InputReader(ENTITY_KIND, [
+        key_range.KeyRange(key_end=self.key(3), include_end=False),
+        key_range.KeyRange(key_start=self.key(3))])
+    self.transient_state.input_reader = reader
+    self.transient_state.initial_input_reader = reader
+    worker_params = self.transient_state.to_dict()
+    for param_name in worker_params:
+      self.handler.request.set(param_name, worker_params[param_name])
+
+    split_shard_state = self.create_shard_state(self.mapreduce_id, 2)
+    split_shard_state.active = False
+    split_shard_state.result_status = model.ShardState.RESULT_SUCCESS
+    split_shard_state.put()
+    self.shard_state.split_into = 2
+    self.shard_state.put()
+
+    TestHandler.delay = handlers._SLICE_DURATION_SEC + 10
+    self.handler.post()
+
+    self.assertEquals([str(self.key(1))], TestHandler.processed_keys)
+    shard_state = model.ShardState.get_by_shard_id(self.shard_id)
+    self.verify_shard_state(shard_state, processed=1)
+    self.assertEquals(None, shard_state.split_into)
+
+    split_shard_state = model.ShardState.get_by_shard_id(
+        split_shard_state.shard_id)
+    self.verify_shard_state(split_shard_state)
+    self.assertEquals(1, split_shard_state.retries)
+    self.assertEquals(1, split_shard_state.reuses)
+
+    # Each shard continues with one of the two KeyRanges.
+    tasks = self.taskqueue.GetTasks("default")
+    self.assertEquals(2, len(tasks))
+    payloads = dict((payload["shard_id"], payload) for payload in
+                    map(test_support.decode_task_payload, tasks))
+    self.assertEquals(str(self.slice_id + 1),
+                      payloads[self.shard_id]["slice_id"])
+    self.assertEquals("0", payloads[split_shard_state.shard_id]["slice_id"])
+    self.assertEquals("1", payloads[split_shard_state.shard_id]["retries"])
+    for payload in payloads.values():
+      reader_state = simplejson.loads(payload["input_reader_state"])
+      self.assertEquals(1, len(reader_state["key_range"]))
+
+  def testWorkStealingSplitFails(self):
+    """Test that a shard that can't split records it and goes on."""
+    for _ in range(4):
+      TestEntity().put()
+
+    split_shard_state = self.create_shard_state(self.mapreduce_id, 2)
+    split_shard_state.active = False
+    split_shard_state.result_status = model.ShardState.RESULT_SUCCESS
+    split_shard_state.put()
+    self.shard_state.split_into = 2
+    self.shard_state.put()
+
+    self.handler._split_remaining = lambda input_reader: None
+    TestHandler.delay = handlers._SLICE_DURATION_SEC + 10
+    self.handler.post()
+
+    shard_state = model.ShardState.get_by_shard_id(self.shard_id)
+    self.verify_shard_state(shard_state, processed=1)
+    self.assertEquals(None, shard_state.split_into)
+    self.assertTrue(shard_state.split_failed)
+
+    split_shard_state = model.ShardState.get_by_shard_id(
+        split_shard_state.shard_id)
+    self.assertFalse(split_shard_state.active)
+    self.assertEquals(0, split_shard_state.reuses)
+    self.assertEquals(1, len(self.taskqueue.GetTasks("default")))
+
+  def testShardRetryAfterWorkStealing(self):
+    """Test that a shard retry after a split keeps the counts before it."""
+    for _ in range(4):
+      TestEntity().put()
+
+    reader = InputReader(ENTITY_KIND, [
+        key_range.KeyRange(key_end=self.key(3), include_end=False),
+        key_range.KeyRange(key_start=self.key(3))])
+    self.transient_state.input_reader = reader
+    self.transient_state.initial_input_reader = reader
+    worker_params = self.transient_state.to_dict()
+    for param_name in worker_params:
+      self.handler.request.set(param_name, worker_params[param_name])
+
+    split_shard_state = self.create_shard_state(self.mapreduce_id, 2)
+    split_shard_state.active = False
+    split_shard_state.result_status = model.ShardState.RESULT_SUCCESS
+    split_shard_state.counters_map.increment(COUNTER_MAPPER_CALLS, 5)
+    split_shard_state.put()
+    self.shard_state.split_into = 2
+    self.shard_state.put()
+
+    TestHandler.delay = handlers._SLICE_DURATION_SEC + 10
+    self.handler.post()
+
+    # Both shards restart from the split, so a retry keeps what each of
+    # them had done before it.
+    shard_state = model.ShardState.get_by_shard_id(self.shard_id)
+    shard_state.counters_map.increment(COUNTER_MAPPER_CALLS, 1)
+    shard_state.reset_for_retry()
+    self.verify_shard_state(shard_state, processed=1)
+
+    split_shard_state = model.ShardState.get_by_shard_id(
+        split_shard_state.shard_id)
+    split_shard_state.counters_map.increment(COUNTER_MAPPER_CALLS, 1)
+    split_shard_state.reset_for_retry()
+    self.verify_shard_state(split_shard_state, processed=5)
+
   def testLongProcessDataWithAllowCheckpoint(self):
     """Tests that process_data works with input_readers.ALLOW_CHECKPOINT."""
     self.handler._start_time = 0
@@ -1567,6 +1719,84 @@ class MapperWorkerCallbackHandlerTest(MapreduceHandlerTestBase):
          "finalize-1",
          ], TestOutputWriter.events)
 
+  def testBatchMapper(self):
+    """Test passing inputs to the handler a batch at a time."""
+    TestBatchHandler.reset()
+    TestOperation.reset()
+    self.init(__name__ + ".TestBatchHandler.process",
+              mapper_parameters={"batch_mapper": True},
+              output_writer_spec=__name__ + ".TestOutputWriter",
+              batch_size=2)
+    keys = [TestEntity().put() for _ in range(5)]
+
+    self.handler.post()
+
+    self.assertEquals([2, 2, 1], TestBatchHandler.batch_sizes)
+    self.assertEquals([str(key) for key in keys],
+                      TestOperation.processed_keys)
+    self.assertEquals(
+        ["write-" + str(key) for key in keys] + ["finalize-1"],
+        TestOutputWriter.events)
+    shard_state = model.ShardState.get_by_shard_id(self.shard_id)
+    self.verify_shard_state(
+        shard_state, active=False, processed=5,
+        result_status=model.ShardState.RESULT_SUCCESS)
+    self.assertEquals(5, shard_state.counters_map.get("batch-entities"))
+    self.assertEquals(repr(keys[-1]), shard_state.last_work_item)
+    # quota should be reclaimed correctly
+    self.assertEquals(self.initial_quota - len(keys),
+                      self.quota_manager.get(self.shard_id))
+
+  def testBatchMapperFalseString(self):
+    """Test that a "false" batch_mapper parameter maps one entity at a time."""
+    self.init(__name__ + ".TestHandler",
+              mapper_parameters={"batch_mapper": "false"})
+    keys = [TestEntity().put() for _ in range(3)]
+
+    self.handler.post()
+
+    self.assertEquals([str(key) for key in keys], TestHandler.processed_keys)
+
+  def testBatchMapperNotGenerator(self):
+    """Test that results of a batch mapper which is no generator are ignored."""
+    self.init(__name__ + ".test_batch_handler_return_entities",
+              mapper_parameters={"batch_mapper": True},
+              output_writer_spec=__name__ + ".TestOutputWriter",
+              batch_size=2)
+    for _ in range(3):
+      TestEntity().put()
+
+    self.handler.post()
+
+    self.assertEquals(["finalize-1"], TestOutputWriter.events)
+    self.verify_shard_state(
+        model.ShardState.get_by_shard_id(self.shard_id),
+        active=False, processed=3,
+        result_status=model.ShardState.RESULT_SUCCESS)
+
+  def testBatchMapperSliceDuration(self):
+    """Test that the slice duration is checked after each batch."""
+    TestBatchHandler.reset()
+    TestBatchHandler.delay = handlers._SLICE_DURATION_SEC + 10
+    self.init(__name__ + ".TestBatchHandler.process",
+              mapper_parameters={"batch_mapper": True},
+              output_writer_spec=__name__ + ".TestOutputWriter",
+              batch_size=2)
+    for _ in range(5):
+      TestEntity().put()
+
+    self.handler.post()
+
+    # only the first batch should be processed
+    self.assertEquals([2], TestBatchHandler.batch_sizes)
+    self.verify_shard_state(
+        model.ShardState.get_by_shard_id(self.shard_id),
+        processed=2)
+    self.assertEquals(self.initial_quota - 2,
+                      self.quota_manager.get(self.shard_id))
+    tasks = self.taskqueue.GetTasks("default")
+    self.assertEquals(1, len(tasks))
+
 
 class ControllerCallbackHandlerTest(MapreduceHandlerTestBase):
   """Test handlers.ControllerCallbackHandler."""
@@ -1905,6 +2135,123 @@ class ControllerCallbackHandlerTest(MapreduceHandlerTestBase):
     for shard_state in shard_states:
       self.assertEquals(333334, self.quota_manager.get(shard_state.shard_id))
 
+  def testWorkStealing(self):
+    """Test that finished shards are paired with busiest active shards."""
+    spec = self.mapreduce_state.mapreduce_spec
+    spec.mapper.params["work_stealing"] = True
+    self.handler.request.set("mapreduce_spec", spec.to_json_str())
+
+    for i in range(3):
+      shard_state = self.create_shard_state(self.mapreduce_id, i)
+      if i == 0:
+        shard_state.active = False
+        shard_state.result_status = model.ShardState.RESULT_SUCCESS
+      elif i == 2:
+        shard_state.counters_map.increment(COUNTER_MAPPER_CALLS, 10)
+      shard_state.put()
+
+    self.handler.post()
+
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    shard_states = model.ShardState.find_by_mapreduce_state(mapreduce_state)
+    self.assertEquals([None, None, 0], [s.split_into for s in shard_states])
+
+    # The finished shard is spoken for until the split happens.
+    MockTime.advance_time(1)
+    self.handler.request.set("serial_id", "1235")
+    self.handler.post()
+
+    shard_states = model.ShardState.find_by_mapreduce_state(mapreduce_state)
+    self.assertEquals([None, None, 0], [s.split_into for s in shard_states])
+
+  def testWorkStealingSkipsFailedSplits(self):
+    """Test that shards that couldn't split aren't asked again."""
+    spec = self.mapreduce_state.mapreduce_spec
+    spec.mapper.params["work_stealing"] = True
+    self.handler.request.set("mapreduce_spec", spec.to_json_str())
+
+    for i in range(3):
+      shard_state = self.create_shard_state(self.mapreduce_id, i)
+      if i == 0:
+        shard_state.active = False
+        shard_state.result_status = model.ShardState.RESULT_SUCCESS
+      elif i == 2:
+        shard_state.counters_map.increment(COUNTER_MAPPER_CALLS, 10)
+        shard_state.split_failed = True
+      shard_state.put()
+
+    self.handler.post()
+
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    shard_states = model.ShardState.find_by_mapreduce_state(mapreduce_state)
+    self.assertEquals([None, 0, None], [s.split_into for s in shard_states])
+
+  def testQuotaRefillTokenBucket(self):
+    """Test that token bucket refill carries fractions of quota over."""
+    spec = self.mapreduce_state.mapreduce_spec
+    spec.mapper.params["processing_rate"] = 3
+    spec.mapper.params["quota_token_bucket"] = True
+    self.handler.request.set("mapreduce_spec", spec.to_json_str())
+
+    shard_states = []
+    for i in range(3):
+      shard_state = self.create_shard_state(self.mapreduce_id, i)
+      shard_states.append(shard_state)
+      shard_state.put()
+
+    MockTime.advance_time(int(MockTime.time()) + 1 - MockTime.time())
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    mapreduce_state.mapreduce_spec = spec
+    mapreduce_state.last_poll_time = \
+        datetime.datetime.utcfromtimestamp(MockTime.time())
+    mapreduce_state.put()
+
+    # Half a second at 3 entities/sec: one unit now, half a unit carried.
+    MockTime.advance_time(0.5)
+    self.handler.post()
+    self.assertEquals(1, sum(self.quota_manager.get(s.shard_id)
+                             for s in shard_states))
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    self.assertEquals(0.5, mapreduce_state.quota_carry)
+
+    # Another half second: the carry makes up two more units, which go
+    # to the shards that got nothing last time.
+    MockTime.advance_time(0.5)
+    self.handler.request.set("serial_id", "1235")
+    self.handler.post()
+    self.assertEquals([1, 1, 1], sorted(self.quota_manager.get(s.shard_id)
+                                        for s in shard_states))
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    self.assertEquals(0.0, mapreduce_state.quota_carry)
+
+  def testQuotaRefillTokenBucketFalseString(self):
+    """Test that a "false" quota_token_bucket parameter keeps plain refills."""
+    spec = self.mapreduce_state.mapreduce_spec
+    spec.mapper.params["processing_rate"] = 3
+    spec.mapper.params["quota_token_bucket"] = "false"
+    self.handler.request.set("mapreduce_spec", spec.to_json_str())
+
+    shard_states = []
+    for i in range(3):
+      shard_state = self.create_shard_state(self.mapreduce_id, i)
+      shard_states.append(shard_state)
+      shard_state.put()
+
+    MockTime.advance_time(int(MockTime.time()) + 1 - MockTime.time())
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    mapreduce_state.mapreduce_spec = spec
+    mapreduce_state.last_poll_time = \
+        datetime.datetime.utcfromtimestamp(MockTime.time())
+    mapreduce_state.put()
+
+    # Plain refills only count whole seconds, so half a second adds nothing.
+    MockTime.advance_time(0.5)
+    self.handler.post()
+    self.assertEquals(0, sum(self.quota_manager.get(s.shard_id)
+                             for s in shard_states))
+    mapreduce_state = model.MapreduceState.get_by_key_name(self.mapreduce_id)
+    self.assertEquals(0.0, mapreduce_state.quota_carry)
+
   def testQuotaIsSplitOnlyBetweenActiveShards(self):
     """Test that quota is split only between active shards."""
     active_shard_states = []
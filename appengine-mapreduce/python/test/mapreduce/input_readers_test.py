@@ -629,6 +629,173 @@ class DatastoreInputReaderTest(unittest.TestCase):
              namespace_range.NamespaceRange("n", "z" * 100)]),
         set(self.split_into_namespace_ranges(2)))
 
+  def testPackKeyRanges(self):
+    """Tests AbstractDatastoreInputReader._pack_key_ranges."""
+    self.assertEquals(
+        [["a"], ["c", "b"], ["d"]],
+        input_readers.AbstractDatastoreInputReader._pack_key_ranges(
+            [("a", 10), ("b", 1), ("c", 5), ("d", 5)], 3))
+
+    # Without sizes KeyRanges are spread out evenly.
+    self.assertEquals(
+        [["a", "d"], ["b"], ["c"]],
+        input_readers.AbstractDatastoreInputReader._pack_key_ranges(
+            [("a", 0), ("b", 0), ("c", 0), ("d", 0)], 3))
+
+  def testSplitKeyRange(self):
+    """Split KeyRanges should cover exactly the original KeyRange."""
+    for _ in range(0, 100):
+      TestEntity().put()
+
+    k_range = key_range.KeyRange(key_start=key(20),
+                                 key_end=key(80),
+                                 direction="ASC",
+                                 include_start=False,
+                                 include_end=True,
+                                 namespace="")
+    weighted_ranges = (
+        input_readers.DatastoreInputReader._split_key_range(
+            k_range, ENTITY_KIND, 4))
+    self.assertTrue(1 < len(weighted_ranges) <= 4)
+    self.assertEquals(key(20), weighted_ranges[0][0].key_start)
+    self.assertFalse(weighted_ranges[0][0].include_start)
+    self.assertEquals(key(80), weighted_ranges[-1][0].key_end)
+    self.assertTrue(weighted_ranges[-1][0].include_end)
+
+    keys = []
+    for k_range, _ in weighted_ranges:
+      reader = input_readers.DatastoreKeyInputReader(
+          TestEntity.kind(), key_ranges=[k_range], ns_range=None,
+          batch_size=50)
+      keys.extend(reader)
+    self.assertEquals([key(i) for i in range(21, 81)], keys)
+
+  def testSplitNarrowKeyRange(self):
+    """A KeyRange with few of the first samples in it still gets split."""
+    for _ in range(0, 100):
+      TestEntity().put()
+
+    k_range = key_range.KeyRange(key_start=key(30),
+                                 key_end=key(60),
+                                 direction="ASC",
+                                 include_start=True,
+                                 include_end=False,
+                                 namespace="")
+    reader_class = input_readers.DatastoreInputReader
+    # Only 2 keys of the whole namespace are sampled at first.
+    reader_class._OVERSAMPLING_FACTOR = 1
+    try:
+      weighted_ranges = reader_class._split_key_range(
+          k_range, ENTITY_KIND, 2)
+    finally:
+      del reader_class._OVERSAMPLING_FACTOR
+
+    self.assertEquals(2, len(weighted_ranges))
+    keys = []
+    for k_range, _ in weighted_ranges:
+      reader = input_readers.DatastoreKeyInputReader(
+          TestEntity.kind(), key_ranges=[k_range], ns_range=None,
+          batch_size=50)
+      keys.extend(reader)
+    self.assertEquals([key(i) for i in range(30, 60)], keys)
+
+  def testSplitBySize(self):
+    """Shards split by size should cover every entity exactly once."""
+    for _ in range(0, 100):
+      TestEntity().put()
+
+    namespace_manager.set_namespace("google")
+    for _ in range(0, 10):
+      TestEntity().put()
+    namespace_manager.set_namespace(None)
+
+    mapper_spec = model.MapperSpec(
+        "FooHandler",
+        "mapreduce.input_readers.DatastoreKeyInputReader",
+        {"entity_kind": TestEntity.kind(),
+         "shard_by_size": "true"},
+        4)
+    readers = input_readers.DatastoreKeyInputReader.split_input(mapper_spec)
+    self.assertTrue(len(readers) <= 4)
+
+    keys = []
+    for reader in readers:
+      keys.extend(reader)
+    self.assertEquals(
+        sorted([key(i) for i in range(1, 101)] +
+               [key(i, namespace="google") for i in range(101, 111)]),
+        sorted(keys))
+
+  def testSplitNamespacesBySize(self):
+    """Namespaces over the sample cap are weighed by their real sizes."""
+    for _ in range(0, 100):
+      TestEntity().put()
+
+    namespace_manager.set_namespace("google")
+    for _ in range(0, 10):
+      TestEntity().put()
+    namespace_manager.set_namespace(None)
+
+    reader_class = input_readers.DatastoreKeyInputReader
+    # Both namespaces have more __scatter__ keys than the 2 sampled.
+    reader_class._OVERSAMPLING_FACTOR = 1
+    try:
+      weighted_ranges = reader_class._split_namespaces_by_size(
+          None, ["", "google"], TestEntity.kind(), 2)
+    finally:
+      del reader_class._OVERSAMPLING_FACTOR
+
+    sizes = {}
+    for k_range, size in weighted_ranges:
+      sizes[k_range.namespace] = sizes.get(k_range.namespace, 0) + size
+    for namespace in ("", "google"):
+      self.assertAlmostEqual(
+          reader_class._count_scatter_keys(
+              None, namespace, TestEntity.kind()),
+          sizes[namespace])
+    self.assertTrue(sizes[""] > 2 * sizes["google"])
+
+  def testSplitRemaining(self):
+    """Test split_remaining with several KeyRanges left."""
+    kranges = [key_range.KeyRange(key_start=key(i),
+                                  key_end=key(i + 10),
+                                  direction="ASC",
+                                  include_start=True,
+                                  include_end=False)
+               for i in (1, 11, 21)]
+    reader = input_readers.DatastoreInputReader(
+        ENTITY_KIND, key_ranges=kranges, ns_range=None, batch_size=50)
+    readers = reader.split_remaining()
+    self.assertEquals([kranges[:2], kranges[2:]],
+                      [list(reversed(r._key_ranges)) for r in readers])
+    self.assertEquals(kranges, list(reversed(reader._key_ranges)))
+
+    # Readers over a NamespaceRange can't be split.
+    reader = input_readers.DatastoreInputReader(
+        ENTITY_KIND, key_ranges=None,
+        ns_range=namespace_range.NamespaceRange(), batch_size=50)
+    self.assertEquals(None, reader.split_remaining())
+
+  def testSplitRemainingSingleKeyRange(self):
+    """Test split_remaining with a single KeyRange left."""
+    expected_entities = []
+    for _ in range(0, 100):
+      entity = TestEntity()
+      entity.put()
+      expected_entities.append(entity)
+
+    reader = input_readers.DatastoreInputReader(
+        ENTITY_KIND, key_ranges=[key_range.KeyRange(namespace="")],
+        ns_range=None, batch_size=50)
+    readers = reader.split_remaining()
+    self.assertEquals(2, len(readers))
+
+    entities = []
+    for reader in readers:
+      entities.extend(reader)
+    self.assertEquals([entity.to_xml() for entity in expected_entities],
+                      [entity.to_xml() for entity in entities])
+
   def testGeneratorWithKeyRanges(self):
     """Test DatastoreInputReader as generator using KeyRanges."""
     expected_entities = []
@@ -2043,6 +2210,23 @@ class RecordsReaderTest(testutil.HandlerTestBase):
     self.assertEquals({"filenames": ["test"], "position": 200},
                       reader.to_json())
 
+  def testSplitRemaining(self):
+    """Test split_remaining implementation."""
+    reader = input_readers.RecordsReader.from_json(
+        {"filenames": ["test0", "test1", "test2"], "position": 200})
+    self.assertEquals(
+        [{"filenames": ["test0", "test1"], "position": 200},
+         {"filenames": ["test2"], "position": 0}],
+        [r.to_json() for r in reader.split_remaining()])
+    self.assertEquals(
+        {"filenames": ["test0", "test1", "test2"], "position": 200},
+        reader.to_json())
+
+    # A single file can't be split.
+    reader = input_readers.RecordsReader.from_json(
+        {"filenames": ["test0"], "position": 200})
+    self.assertEquals(None, reader.split_remaining())
+
   def testIter(self):
     """Test __iter__ implementation."""
     # Prepare the file.
@@ -54,6 +54,14 @@ class QuotaManagerTest(QuotaTestCase):
     self.quota_manager.put("foo", 13)
     self.assertEquals(113, self.quota_manager.get("foo"))
 
+  def testPutMulti(self):
+    """Test put_multi method."""
+    self.quota_manager.put("foo", 100)
+    self.quota_manager.put_multi({"foo": 13, "bar": 7, "baz": 0})
+    self.assertEquals(113, self.quota_manager.get("foo"))
+    self.assertEquals(7, self.quota_manager.get("bar"))
+    self.assertEquals(0, self.quota_manager.get("baz"))
+
   def testConsumeSuccess(self):
     """Test consume method when there's lot's of quota."""
     self.quota_manager.set("foo", 130)
@@ -92,6 +100,30 @@ class QuotaManagerTest(QuotaTestCase):
     self.assertEquals(0, self.quota_manager.get("foo"))
 
 
+class SplitQuotaTest(unittest.TestCase):
+  """Tests for split_quota function."""
+
+  def testEvenSplit(self):
+    """Test splitting an amount that divides evenly."""
+    self.assertEquals(({"a": 2, "b": 2}, 0.0),
+                      quota.split_quota(4, ["a", "b"]))
+
+  def testCarry(self):
+    """Test that fractions are carried over rather than rounded."""
+    amounts, carry = quota.split_quota(2.5, ["a", "b", "c"])
+    self.assertEquals({"a": 1, "b": 1, "c": 0}, amounts)
+    self.assertEquals(0.5, carry)
+
+    amounts, carry = quota.split_quota(0.5, ["a", "b", "c"], carry)
+    self.assertEquals({"a": 1, "b": 0, "c": 0}, amounts)
+    self.assertEquals(0.0, carry)
+
+  def testStart(self):
+    """Test that extra units start at the given bucket and wrap around."""
+    amounts, _ = quota.split_quota(5, ["a", "b", "c"], start=2)
+    self.assertEquals({"a": 2, "b": 1, "c": 2}, amounts)
+
+
 class QuotaConsumerTest(QuotaTestCase):
   """Tests for QuotaConsumer class."""
 
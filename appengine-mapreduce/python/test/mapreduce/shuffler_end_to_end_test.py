@@ -71,6 +71,61 @@ class SortFileEndToEndTest(testutil.HandlerTestBase):
 
     self.assertEquals(input_data, output_data)
 
+  def testSortFileMultipleRuns(self):
+    """Test sorting a file into several sorted runs and merging them."""
+    input_file = files.blobstore.create()
+
+    input_data = [
+        (str(i), "_" + str(i)) for i in range(100)]
+
+    with files.open(input_file, "a") as f:
+      with records.RecordsWriter(f) as w:
+        for (k, v) in input_data:
+          proto = file_service_pb.KeyValue()
+          proto.set_key(k)
+          proto.set_value(v)
+          w.write(proto.Encode())
+    files.finalize(input_file)
+    input_file = files.blobstore.get_file_name(
+        files.blobstore.get_blob_key(input_file))
+
+    prev_batch_size = shuffler._BatchRecordsReader.BATCH_SIZE
+    try:
+      shuffler._BatchRecordsReader.BATCH_SIZE = 200
+      p = shuffler._SortChunksPipeline("testjob", [input_file])
+      p.start()
+      test_support.execute_until_empty(self.taskqueue)
+      p = shuffler._SortChunksPipeline.from_id(p.pipeline_id)
+    finally:
+      shuffler._BatchRecordsReader.BATCH_SIZE = prev_batch_size
+
+    output_files = p.outputs.default.value[0]
+    self.assertTrue(len(output_files) > 1)
+    all_data = []
+    for output_file in output_files:
+      output_data = []
+      with files.open(output_file, "r") as f:
+        for binary_record in records.RecordsReader(f):
+          proto = file_service_pb.KeyValue()
+          proto.ParseFromString(binary_record)
+          output_data.append((proto.key(), proto.value()))
+      self.assertEquals(sorted(output_data), output_data)
+      all_data.extend(output_data)
+
+    input_data.sort()
+    self.assertEquals(input_data, sorted(all_data))
+
+    p = TestMergePipeline(output_files)
+    p.start()
+    test_support.execute_until_empty(self.taskqueue)
+    p = TestMergePipeline.from_id(p.pipeline_id)
+
+    output_file = p.outputs.default.value[0]
+    with files.open(output_file, "r") as f:
+      output_data = list(records.RecordsReader(f))
+    self.assertEquals(
+        [str((k, [v], False)) for (k, v) in input_data], output_data)
+
 
 def test_handler_yield_str(key, value, partial):
   """Test handler that yields parameters converted to string."""
@@ -95,6 +95,38 @@ class ShuffleServicePipelineTest(testutil.HandlerTestBase):
     self.assertTrue(p.was_aborted)
 
 
+class MergingReaderTest(unittest.TestCase):
+  """Tests for _MergingReader."""
+
+  def testToFromJson(self):
+    reader = shuffler._MergingReader([0, 10], 5, -1, read_ahead=1024)
+    json = reader.to_json()
+    self.assertEquals({"offsets": [0, 10],
+                       "max_values_count": 5,
+                       "max_values_size": -1,
+                       "read_ahead": 1024},
+                      json)
+    self.assertEquals(json, shuffler._MergingReader.from_json(json).to_json())
+
+    # State serialized before read_ahead existed.
+    del json["read_ahead"]
+    reader = shuffler._MergingReader.from_json(json)
+    self.assertEquals(shuffler._MergingReader._DEFAULT_READ_AHEAD,
+                      reader.to_json()["read_ahead"])
+
+  def testBufferSize(self):
+    reader = shuffler._MergingReader([], -1, -1)
+    self.assertEquals(shuffler._MergingReader._DEFAULT_READ_AHEAD,
+                      reader._get_buffer_size(1))
+    total = shuffler._MergingReader._MAX_READ_AHEAD_TOTAL
+    self.assertEquals(total // 256, reader._get_buffer_size(256))
+    self.assertEquals(shuffler._MergingReader._MIN_READ_AHEAD,
+                      reader._get_buffer_size(100000))
+
+    reader = shuffler._MergingReader([], -1, -1, read_ahead=100)
+    self.assertEquals(100, reader._get_buffer_size(100000))
+
+
 if __name__ == "__main__":
   unittest.main()
 
@@ -160,6 +160,7 @@ class ParseBoolTest(unittest.TestCase):
     self.assertEquals(False, util.parse_bool(0))
     self.assertEquals(True, util.parse_bool("on"))
     self.assertEquals(False, util.parse_bool("off"))
+    self.assertEquals(False, util.parse_bool(u"false"))
 
 
 class CreateConfigTest(unittest.TestCase):
@@ -1,9 +1,14 @@
-"""Benchmark for task creation and execution."""
+"""Benchmark for task creation and execution.
+
+Run this using 'make x CUSTOM=bench FLAGS=15' for the Fibonacci scenario,
+or 'make x CUSTOM=bench FLAGS="sleep 50000"' for many sleeping tasklets.
+"""
 
 import cProfile
 import os
 import pstats
 import sys
+import time
 
 from ndb import eventloop
 from ndb import tasklets
@@ -28,6 +33,20 @@ def fibonacci(n):
   raise tasklets.Return(a + b)
 
 
+@tasklets.tasklet
+def sleeper(i):
+  """Sleep a while, to exercise the event loop's timer queue.
+
+  The delays are scattered so timers are not queued in time order, and
+  every fourth tasklet sleeps for zero seconds.
+  """
+  if i % 4:
+    yield tasklets.sleep((i * 7919 % 1000) * 0.0002)  # Up to 0.2 seconds.
+  else:
+    yield tasklets.sleep(0)
+  raise tasklets.Return(i)
+
+
 def bench(n):
   """Top-level benchmark function."""
   futs = []
@@ -39,17 +58,65 @@ def bench(n):
     fut.check_success()
 
 
+def bench_sleep(n):
+  """Benchmark n concurrently sleeping tasklets."""
+  futs = [sleeper(i) for i in xrange(n)]
+  eventloop.run()
+  for fut in futs:
+    fut.check_success()
+
+
+TRACING_LEVELS = [
+  ('debug', tasklets.TRACE_DEBUG),
+  ('production', tasklets.TRACE_PRODUCTION),
+]
+
+
+def compare_tracing(func, n):
+  """Time func(n) (unprofiled) under each tasklet tracing level."""
+  save_level = tasklets.get_tracing_level()
+  times = {}
+  try:
+    for name, level in TRACING_LEVELS:
+      tasklets.set_tracing_level(level)
+      t0 = time.time()
+      globals()[func](n)
+      t1 = time.time()
+      times[name] = t1 - t0
+      print '%s(%d), %s tracing: %.3f seconds' % (func, n, name, t1 - t0)
+  finally:
+    tasklets.set_tracing_level(save_level)
+  print 'production tracing speedup: %.2fx' % (
+    times['debug'] / max(times['production'], 1e-6))
+
+
+SCENARIOS = {
+  'fibonacci': ('bench', 15),  # Much larger and it takes forever.
+  'sleep': ('bench_sleep', 50000),
+}
+
+
 def main():
   utils.tweak_logging()  # Interpret -v and -q flags.
-  n = 15  # Much larger and it takes forever.
+  scenario = 'fibonacci'
+  n = None
   for arg in sys.argv[1:]:
+    if arg in SCENARIOS:
+      scenario = arg
+      continue
     try:
       n = int(arg)
-      break
     except Exception:
       pass
+  func, default_n = SCENARIOS[scenario]
+  if n is None:
+    n = default_n
+  compare_tracing(func, n)
+  t0 = time.time()
   prof = cProfile.Profile()
-  prof = prof.runctx('bench(%d)' % n, globals(), locals())
+  prof = prof.runctx('%s(%d)' % (func, n), globals(), locals())
+  t1 = time.time()
+  print '%s(%d): %.3f seconds (profiled)' % (func, n, t1 - t0)
   stats = pstats.Stats(prof)
   stats.strip_dirs()
   stats.sort_stats('time')  # 'time', 'cumulative' or 'calls'
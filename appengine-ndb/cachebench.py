@@ -0,0 +1,104 @@
+"""Benchmark for the Context cache backends: plain dict vs. LruCache.
+
+Run this using 'make x CUSTOM=cachebench FLAGS=100000'.
+"""
+
+import os
+import sys
+import time
+
+from google.appengine.ext import testbed
+
+from ndb import context
+from ndb import model
+from ndb import tasklets
+from ndb import utils
+
+# Hack: replace os.environ with a plain dict.  This is to make the
+# benchmark more similar to the production environment, where
+# os.environ is also a plain dict.  In the environment where we run
+# the benchmark, however, it is a UserDict instance, which makes the
+# benchmark run slower -- but we don't want to measure this since it
+# doesn't apply to production.
+os.environ = dict(os.environ)
+
+
+class Foo(model.Model):
+  name = model.StringProperty()
+  body = model.TextProperty()
+
+
+def make_entities(n):
+  return [Foo(id=i + 1, name='foo%d' % i, body='x' * 200) for i in xrange(n)]
+
+
+def bench_backend(cache, ents):
+  """Fill the cache, then look up every key the way Context.get() does."""
+  for ent in ents:
+    cache[ent.key] = ent
+  for ent in ents:
+    key = ent.key
+    if key in cache:
+      cache[key]
+
+
+def bench_get(cache, ents):
+  """Call Context.get() for every key with only the in-context cache on."""
+  ctx = context.Context(config=context.ContextOptions(use_memcache=False,
+                                                      use_datastore=False))
+  tasklets.set_context(ctx)
+  ctx.set_cache_backend(cache)
+  for ent in ents:
+    cache[ent.key] = ent
+  for ent in ents:
+    ctx.get(ent.key).get_result()
+
+
+def timeit(func, cache, ents):
+  t0 = time.time()
+  func(cache, ents)
+  t1 = time.time()
+  return t1 - t0
+
+
+def main():
+  utils.tweak_logging()  # Interpret -v and -q flags.
+
+  tb = testbed.Testbed()
+  tb.activate()
+  tb.init_datastore_v3_stub()
+  tb.init_memcache_stub()
+
+  n = 100000
+  for arg in sys.argv[1:]:
+    try:
+      n = int(arg)
+      break
+    except Exception:
+      pass
+
+  ents = make_entities(n)
+  backends = [
+    ('dict', lambda: {}),
+    ('LruCache(unbounded)', lambda: context.LruCache()),
+    ('LruCache(max_entries=%d)' % (n // 10),
+     lambda: context.LruCache(max_entries=n // 10)),
+    ('LruCache(max_bytes=1MB)', lambda: context.LruCache(max_bytes=1 << 20)),
+  ]
+  for func in bench_backend, bench_get:
+    print '%s, %d keys:' % (func.__name__, n)
+    for name, make_cache in backends:
+      cache = make_cache()
+      secs = timeit(func, cache, ents)
+      extra = ''
+      if isinstance(cache, context.LruCache):
+        extra = (' %(entries)d entries, %(hits)d hits, %(misses)d misses, '
+                 '%(evictions)d evictions' % cache.stats())
+      print '  %-28s %.3f sec (%.2f usec/key)%s' % (
+        name, secs, secs * 1e6 / n, extra)
+
+  tb.deactivate()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,84 @@
+"""Benchmark for Model._from_pb(): deserialization plan vs. generic path.
+
+Run this using 'make x CUSTOM=decodebench FLAGS=10000'.
+"""
+
+import os
+import sys
+import time
+
+from google.appengine.ext import testbed
+
+from ndb import utils
+utils.DEBUG = False
+
+from ndb import model
+
+# Hack: replace os.environ with a plain dict.  This is to make the
+# benchmark more similar to the production environment, where
+# os.environ is also a plain dict.  In the environment where we run
+# the benchmark, however, it is a UserDict instance, which makes the
+# benchmark run slower -- but we don't want to measure this since it
+# doesn't apply to production.
+os.environ = dict(os.environ)
+
+
+class Post(model.Model):
+  nickname = model.StringProperty()
+  user_id = model.StringProperty()
+  body = model.TextProperty()
+  sequence = model.IntegerProperty()
+  archived = model.BooleanProperty()
+  score = model.FloatProperty()
+
+
+def make_pbs(n):
+  return [Post(id=i + 1, nickname='nick%d' % i, user_id='user%d' % i,
+               body=u'Here is my message %d \u1234' % i * 5, sequence=i,
+               archived=False, score=i * 0.5)._to_pb()
+          for i in xrange(n)]
+
+
+def bench(pbs):
+  from_pb = Post._from_pb
+  for pb in pbs:
+    from_pb(pb)
+
+
+def timeit(func, pbs):
+  t0 = time.time()
+  func(pbs)
+  t1 = time.time()
+  return t1 - t0
+
+
+def main():
+  utils.tweak_logging()  # Interpret -v and -q flags.
+
+  tb = testbed.Testbed()
+  tb.activate()
+  tb.init_datastore_v3_stub()
+  tb.init_memcache_stub()
+
+  n = 10000
+  for arg in sys.argv[1:]:
+    try:
+      n = int(arg)
+      break
+    except Exception:
+      pass
+
+  pbs = make_pbs(n)
+  plan = Post._deserialization_plan
+  print 'Post._from_pb(), %d entities:' % n
+  for name, use_plan in ('generic', False), ('plan', True):
+    Post._deserialization_plan = plan if use_plan else None
+    secs = timeit(bench, pbs)
+    print '  %-8s %.3f sec (%.2f usec/entity)' % (name, secs, secs * 1e6 / n)
+  Post._deserialization_plan = plan
+
+  tb.deactivate()
+
+
+if __name__ == '__main__':
+  main()
@@ -41,6 +41,15 @@ def bench3(n):
     key.Key('Hopla', 'lala', parent=p)
 
 
+def bench4(n):
+  """Benchmark Key ordering and urlsafe()."""
+  keys = [key.Key('Foo', 42, 'Bar', i % 100) for i in xrange(100)]
+  for _ in xrange(n // 100):
+    sorted(keys)
+    for k in keys:
+      k.urlsafe()
+
+
 def bench(n):
   """Toplevel benchmark function."""
   return bench3(n)
@@ -61,6 +70,10 @@ def main():
   stats.strip_dirs()
   stats.sort_stats('time')  # 'time', 'cumulative' or 'calls'
   stats.print_stats(20)  # Arg: how many to print (optional)
+  k = key.Key('Foo', 42, 'Bar', 1, 'Hopla', 'lala')
+  print 'Key object size: %d bytes (plus %d for its pairs)' % (
+    sys.getsizeof(k),
+    sys.getsizeof(k.pairs()) + sum(map(sys.getsizeof, k.pairs())))
   # Uncomment (and tweak) the following calls for more details.
   # stats.print_callees(10)
   # stats.print_callers(10)
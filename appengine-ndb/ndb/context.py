@@ -1,7 +1,11 @@
 """Context class."""
 
+import collections
 import logging
 import sys
+import threading
+import time
+import zlib
 
 from .google_imports import datastore  # For taskqueue coordination
 from .google_imports import datastore_errors
@@ -20,12 +24,24 @@ from . import eventloop
 from . import utils
 
 __all__ = ['Context', 'ContextOptions', 'TransactionOptions', 'AutoBatcher',
-           'EVENTUAL_CONSISTENCY',
+           'LruCache', 'MemcacheCodec', 'SharedCache', 'get_shared_cache',
+           'set_shared_cache', 'EVENTUAL_CONSISTENCY',
            ]
 
 _LOCK_TIME = 32  # Time to lock out memcache.add() after datastore updates.
 _LOCKED = 0  # Special value to store in memcache indicating locked value.
 
+# The phases of Context.get_multi(), in order; see get_multi_stats().
+_GET_MULTI_PHASES = ('memcache_get', 'memcache_lock', 'datastore',
+                     'memcache_cas')
+
+# Values written by a MemcacheCodec start with this tag and a version
+# byte.  A serialized EntityProto never starts with a zero byte.
+_CODEC_TAG = '\0'
+_CODEC_VERSION = '\x01'
+_CODEC_COMPRESSED = 1  # Flag: the payload is zlib-compressed.
+_CODEC_CHUNKED = 2  # Flag: the payload is stored under chunk keys.
+
 
 # Constant for read_policy.
 EVENTUAL_CONSISTENCY = datastore_rpc.Configuration.EVENTUAL_CONSISTENCY
@@ -69,6 +85,20 @@ class ContextOptions(datastore_rpc.Configuration):
         'max_memcache_items should be an integer (%r)' % (value,))
     return value
 
+  @datastore_rpc.ConfigOption
+  def max_batch_age(value):
+    if not isinstance(value, (int, long, float)) or value < 0:
+      raise datastore_errors.BadArgumentError(
+        'max_batch_age should be a non-negative number (%r)' % (value,))
+    return value
+
+  @datastore_rpc.ConfigOption
+  def max_batches_in_flight(value):
+    if not isinstance(value, (int, long)) or value < 1:
+      raise datastore_errors.BadArgumentError(
+        'max_batches_in_flight should be a positive integer (%r)' % (value,))
+    return value
+
 
 class TransactionOptions(ContextOptions, datastore_rpc.TransactionOptions):
   """Support both context options and transaction options."""
@@ -109,22 +139,60 @@ def _make_ctx_options(ctx_options, config_cls=ContextOptions):
 
 class AutoBatcher(object):
 
-  def __init__(self, todo_tasklet, limit):
+  def __init__(self, todo_tasklet, limit, max_age=None, max_in_flight=None):
     # todo_tasklet is a tasklet to be called with list of (future, arg) pairs
     self._todo_tasklet = todo_tasklet
     self._limit = limit  # No more than this many per callback
-    self._queues = {}  # Map options to lists of (future, arg) tuples
+    self._max_age = max_age  # Seconds a queue may wait for more items
+    self._max_in_flight = max_in_flight  # Max concurrently running tasklets
+    # Map options to lists of (future, arg) tuples, oldest queue first.
+    self._queues = collections.OrderedDict()
+    self._created = {}  # Map options to the time their queue was created
     self._running = []  # Currently running tasklets
+    self._waiting = collections.deque()  # (options, todo) held back by cap
     self._cache = {}  # Cache of in-flight todo_tasklet futures
+    # Statistics; see stats().
+    self._histogram = {}  # Map power-of-2 size bound to number of batches
+    self._flushes = dict.fromkeys(('full', 'age', 'idle'), 0)
+    self._peak_in_flight = 0
+    self._held_back = 0
 
   def __repr__(self):
     return '%s(%s)' % (self.__class__.__name__, self._todo_tasklet.__name__)
 
+  def stats(self):
+    """Return a dict of statistics about the batches run so far.
+
+    'histogram' maps each power of 2 to the number of batches whose
+    size was at most that and more than half of it.  'full', 'age' and
+    'idle' count the batches by why they were started: reaching the
+    limit, reaching max_age, or the event loop going idle.
+    """
+    result = dict(self._flushes)
+    result['histogram'] = dict(self._histogram)
+    result['batches'] = sum(self._histogram.itervalues())
+    result['peak_in_flight'] = self._peak_in_flight
+    result['held_back'] = self._held_back
+    return result
+
   def run_queue(self, options, todo):
+    bound = 1
+    while bound < len(todo):
+      bound <<= 1
+    self._histogram[bound] = self._histogram.get(bound, 0) + 1
+    if (self._max_in_flight is not None and
+        len(self._running) >= self._max_in_flight):
+      self._held_back += 1
+      self._waiting.append((options, todo))
+    else:
+      self._start(options, todo)
+
+  def _start(self, options, todo):
     utils.logging_debug('AutoBatcher(%s): %d items',
                         self._todo_tasklet.__name__, len(todo))
     fut = self._todo_tasklet(todo, options)
     self._running.append(fut)
+    self._peak_in_flight = max(self._peak_in_flight, len(self._running))
     # Add a callback when we're done.
     fut.add_callback(self._finished_callback, fut)
 
@@ -133,8 +201,31 @@ class AutoBatcher(object):
       return None
     return True
 
+  def _pop_queue(self, options=None, oldest=False):
+    if oldest:
+      options, todo = self._queues.popitem(last=False)
+    else:
+      todo = self._queues.pop(options)
+    del self._created[options]
+    return options, todo
+
+  def _flush_aged(self):
+    # Idle callbacks run before timers, so the queues' age is checked
+    # whenever an item is added instead of by a timer.
+    deadline = time.time() - self._max_age
+    while self._queues:
+      options = next(iter(self._queues))  # The oldest queue.
+      if self._created[options] > deadline:
+        break
+      options, todo = self._pop_queue(options)
+      self._flushes['age'] += 1
+      self.run_queue(options, todo)
+
   def add(self, arg, options=None):
-    fut = tasklets.Future('%s.add(%s, %s)' % (self, arg, options))
+    if tasklets.get_tracing_level() == tasklets.TRACE_DEBUG:
+      fut = tasklets.Future('%s.add(%s, %s)' % (self, arg, options))
+    else:
+      fut = tasklets.Future()
     todo = self._queues.get(options)
     if todo is None:
       utils.logging_debug('AutoBatcher(%s): creating new queue for %r',
@@ -142,10 +233,14 @@ class AutoBatcher(object):
       if not self._queues:
         eventloop.add_idle(self._on_idle)
       todo = self._queues[options] = []
+      self._created[options] = time.time()
     todo.append((fut, arg))
     if len(todo) >= self._limit:
-      del self._queues[options]
+      self._pop_queue(options)
+      self._flushes['full'] += 1
       self.run_queue(options, todo)
+    if self._max_age is not None:
+      self._flush_aged()
     return fut
 
   def add_once(self, arg, options=None):
@@ -161,12 +256,15 @@ class AutoBatcher(object):
     queues = self._queues
     if not queues:
       return False
-    options, todo = queues.popitem()  # TODO: Should this use FIFO ordering?
+    options, todo = self._pop_queue(oldest=True)
+    self._flushes['idle'] += 1
     self.run_queue(options, todo)
     return True
 
   def _finished_callback(self, fut):
     self._running.remove(fut)
+    if self._waiting:
+      self._start(*self._waiting.popleft())
     fut.check_success()
 
   @tasklets.tasklet
@@ -176,6 +274,425 @@ class AutoBatcher(object):
         yield self._running  # A list of Futures
 
 
+# Indexes into the links of LruCache's doubly-linked list.
+_PREV, _NEXT, _KEY, _VALUE, _SIZE = range(5)
+
+
+class LruCache(object):
+  """A bounded in-context cache with least-recently-used eviction.
+
+  This can replace the plain dict used for the Context cache (see
+  Context.set_cache_backend()).  It is bounded by entry count and/or by
+  the approximate serialized size of the cached entities, and counts
+  hits, misses and evictions.  A hit is counted by each successful
+  lookup; a miss by each failed 'in' test or lookup.
+  """
+
+  def __init__(self, max_entries=None, max_bytes=None):
+    """Constructor.
+
+    Args:
+      max_entries: Optional maximum number of cached keys.
+      max_bytes: Optional maximum total of the entities' serialized sizes.
+        Sizes are only computed when this is set.
+    """
+    self._max_entries = max_entries
+    self._max_bytes = max_bytes
+    self._links = {}  # Map keys to links in the list below.
+    # Circular doubly-linked list, least recently used first.
+    self._root = root = []
+    root[:] = [root, root, None, None, 0]
+    self._bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __repr__(self):
+    return '%s(max_entries=%r, max_bytes=%r)' % (
+      self.__class__.__name__, self._max_entries, self._max_bytes)
+
+  def __len__(self):
+    return len(self._links)
+
+  def __iter__(self):
+    root = self._root
+    link = root[_NEXT]
+    while link is not root:
+      yield link[_KEY]
+      link = link[_NEXT]
+
+  def keys(self):
+    return list(self)
+
+  def iteritems(self):
+    root = self._root
+    link = root[_NEXT]
+    while link is not root:
+      yield link[_KEY], link[_VALUE]
+      link = link[_NEXT]
+
+  def items(self):
+    return list(self.iteritems())
+
+  def __eq__(self, other):
+    if isinstance(other, LruCache):
+      other = dict(other.iteritems())
+    return dict(self.iteritems()) == other
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __contains__(self, key):
+    if key in self._links:
+      return True
+    self.misses += 1
+    return False
+
+  def __getitem__(self, key):
+    link = self._links.get(key)
+    if link is None:
+      self.misses += 1
+      raise KeyError(key)
+    self.hits += 1
+    self._move_to_end(link)
+    return link[_VALUE]
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def __setitem__(self, key, value):
+    size = 0
+    if self._max_bytes is not None:
+      size = self._sizeof(value)
+    link = self._links.get(key)
+    if link is None:
+      root = self._root
+      last = root[_PREV]
+      link = [last, root, key, value, size]
+      last[_NEXT] = root[_PREV] = self._links[key] = link
+    else:
+      self._bytes -= link[_SIZE]
+      link[_VALUE] = value
+      link[_SIZE] = size
+      self._move_to_end(link)
+    self._bytes += size
+    self._evict()
+
+  def __delitem__(self, key):
+    link = self._links.pop(key)
+    self._unlink(link)
+    self._bytes -= link[_SIZE]
+
+  def update(self, other):
+    if isinstance(other, (dict, LruCache)):
+      other = other.iteritems()
+    for key, value in other:
+      self[key] = value
+
+  def clear(self):
+    root = self._root
+    root[:] = [root, root, None, None, 0]
+    self._links.clear()
+    self._bytes = 0
+
+  def stats(self):
+    """Return a dict of the cache's counters and current size."""
+    return {'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._links),
+            'bytes': self._bytes,
+            }
+
+  def _sizeof(self, value):
+    if value is None:
+      return 0
+    return value._to_pb(allow_partial=True).ByteSize()
+
+  def _unlink(self, link):
+    prev, next = link[_PREV], link[_NEXT]
+    prev[_NEXT] = next
+    next[_PREV] = prev
+
+  def _move_to_end(self, link):
+    root = self._root
+    if root[_PREV] is link:
+      return
+    self._unlink(link)
+    last = root[_PREV]
+    link[_PREV] = last
+    link[_NEXT] = root
+    last[_NEXT] = root[_PREV] = link
+
+  def _evict(self):
+    # Never evict the most recently used entry, even if it is too large
+    # all by itself.
+    links = self._links
+    root = self._root
+    while len(links) > 1 and (
+        (self._max_entries is not None and len(links) > self._max_entries) or
+        (self._max_bytes is not None and self._bytes > self._max_bytes)):
+      link = root[_NEXT]
+      del links[link[_KEY]]
+      self._unlink(link)
+      self._bytes -= link[_SIZE]
+      self.evictions += 1
+
+
+class MemcacheCodec(object):
+  """Encoding of the entities a Context stores in memcache.
+
+  Serialized entities of at least compress_threshold bytes are
+  compressed, if that makes them smaller.  A result larger than
+  chunk_size bytes is split across chunk keys derived from the entity's
+  memcache key, which are read back with a single get_multi() call.
+  Small entities are stored as plain serialized EntityProtos, so
+  values written with and without a codec can be read either way.
+
+  A codec is selected per key by the memcache codec policy; see
+  Context.set_memcache_codec_policy().  It counts the bytes it encodes
+  and stores; see stats().
+  """
+
+  def __init__(self, compress_threshold=1024,
+               chunk_size=memcache.MAX_VALUE_SIZE - 1024, level=6):
+    if chunk_size <= 0:
+      raise ValueError('chunk_size must be positive; received %r' %
+                       chunk_size)
+    self._compress_threshold = compress_threshold
+    self._chunk_size = chunk_size
+    self._level = level
+    self.values = 0
+    self.compressed = 0
+    self.chunked = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+
+  def stats(self):
+    """Return a dict of the codec's counters."""
+    return {'values': self.values,
+            'compressed': self.compressed,
+            'chunked': self.chunked,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            }
+
+  def encode(self, mkey, pbs):
+    """Encode a serialized entity to be stored under a memcache key.
+
+    Args:
+      mkey: The memcache key (a string).
+      pbs: The serialized EntityProto (a string).
+
+    Returns:
+      A tuple (value, chunks), where value is to be stored under mkey
+      and chunks is a dict {memcache key: value}, possibly empty, that
+      must be stored (in the same namespace) before value.
+    """
+    flags = 0
+    payload = pbs
+    if len(pbs) >= self._compress_threshold:
+      data = zlib.compress(pbs, self._level)
+      if len(data) < len(pbs):
+        flags |= _CODEC_COMPRESSED
+        payload = data
+        self.compressed += 1
+    chunks = {}
+    if len(payload) > self._chunk_size:
+      flags |= _CODEC_CHUNKED
+      # Name the chunks after their contents, so that a reader never
+      # combines chunks from different versions of the entity.
+      ident = '%08x' % (zlib.crc32(payload) & 0xffffffff)
+      size = self._chunk_size
+      for i in xrange(0, len(payload), size):
+        chunks[_chunk_key(mkey, ident, len(chunks))] = payload[i:i + size]
+      payload = '%s:%d' % (ident, len(chunks))
+      self.chunked += 1
+    if flags:
+      value = _CODEC_TAG + _CODEC_VERSION + chr(flags) + payload
+    else:
+      value = pbs
+    self.values += 1
+    self.bytes_in += len(pbs)
+    self.bytes_out += len(value) + sum(map(len, chunks.itervalues()))
+    return value, chunks
+
+  @staticmethod
+  def chunk_keys(mkey, value):
+    """Return the list of chunk keys needed to decode a value.
+
+    This is empty unless the value was split into chunks.
+    """
+    if (not isinstance(value, str) or not value.startswith(_CODEC_TAG) or
+        value[1:2] != _CODEC_VERSION or len(value) < 3 or
+        not ord(value[2]) & _CODEC_CHUNKED):
+      return []
+    try:
+      ident, count = value[3:].split(':')
+      count = int(count)
+    except ValueError:
+      return []
+    return [_chunk_key(mkey, ident, i) for i in xrange(count)]
+
+  @classmethod
+  def decode(cls, mkey, value, chunks=None):
+    """Decode a value read from memcache into a serialized entity.
+
+    Args:
+      mkey: The memcache key (a string).
+      value: The value read from memcache.
+      chunks: Optional dict {memcache key: value} containing the chunks
+        named by chunk_keys().
+
+    Returns:
+      The serialized EntityProto, or None if a chunk is missing.
+
+    Raises:
+      ValueError if the value is corrupt.
+    """
+    if not value.startswith(_CODEC_TAG):
+      return value
+    if value[1:2] != _CODEC_VERSION or len(value) < 3:
+      raise ValueError('Unknown memcache value encoding')
+    flags = ord(value[2])
+    payload = value[3:]
+    if flags & _CODEC_CHUNKED:
+      keys = cls.chunk_keys(mkey, value)
+      if not keys:
+        raise ValueError('Bad chunk list in memcache value')
+      parts = []
+      for chunk_key in keys:
+        part = (chunks or {}).get(chunk_key)
+        if part is None:
+          return None  # Evicted, or not written yet.
+        parts.append(part)
+      payload = ''.join(parts)
+    if flags & _CODEC_COMPRESSED:
+      try:
+        payload = zlib.decompress(payload)
+      except zlib.error, err:
+        raise ValueError(str(err))
+    return payload
+
+
+def _chunk_key(mkey, ident, index):
+  """Internal helper to return the memcache key of a chunk."""
+  return '%s:%s:%d' % (mkey, ident, index)
+
+
+class _SerializedLruCache(LruCache):
+  """An LruCache of (expiration time, serialized entity) tuples."""
+
+  def _sizeof(self, value):
+    return len(value[1])
+
+
+class SharedCache(object):
+  """A process-wide entity cache, shared by all Contexts and threads.
+
+  This sits between the Context cache and memcache, for kinds whose
+  entities never change or may be a little stale; which kinds, and for
+  how long, is decided by the shared cache policy (see
+  Context.set_shared_cache_policy()).  It is only used once installed
+  with set_shared_cache().
+
+  Entities are stored serialized, so each Context gets its own copy,
+  and evicted least-recently-used first once their total size exceeds
+  max_bytes.  Misses (nonexistent entities) are not cached.  All
+  methods are thread-safe.
+  """
+
+  def __init__(self, max_bytes=16 << 20):
+    self._lock = threading.Lock()
+    self._lru = _SerializedLruCache(max_bytes=max_bytes)
+    self.hits = 0
+    self.misses = 0
+    self.expirations = 0
+
+  def __repr__(self):
+    return '%s(max_bytes=%r)' % (self.__class__.__name__,
+                                 self._lru._max_bytes)
+
+  def __len__(self):
+    return len(self._lru)
+
+  def get(self, key):
+    """Return the serialized entity cached for a key, or None."""
+    with self._lock:
+      item = self._lru.get(key)
+      if item is not None:
+        expires, pbs = item
+        if not expires or expires > time.time():
+          self.hits += 1
+          return pbs
+        del self._lru[key]
+        self.expirations += 1
+      self.misses += 1
+      return None
+
+  def set(self, key, pbs, timeout=0):
+    """Cache a serialized entity for a key.
+
+    Args:
+      key: Key instance.
+      pbs: The serialized entity (a string).
+      timeout: Optional number of seconds after which the entry
+        expires; 0 (the default) means never.
+    """
+    expires = 0
+    if timeout:
+      expires = time.time() + timeout
+    with self._lock:
+      self._lru[key] = (expires, pbs)
+
+  def discard(self, key):
+    """Remove a key from the cache, if it is there."""
+    with self._lock:
+      if key in self._lru:
+        del self._lru[key]
+
+  def clear(self):
+    with self._lock:
+      self._lru.clear()
+
+  def stats(self):
+    """Return a dict of the cache's counters, hit rate and current size."""
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {'hits': self.hits,
+              'misses': self.misses,
+              'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+              'expirations': self.expirations,
+              'evictions': self._lru.evictions,
+              'entries': len(self._lru),
+              'bytes': self._lru._bytes,
+              }
+
+
+_shared_cache = None  # The SharedCache installed by set_shared_cache().
+
+
+def get_shared_cache():
+  """Return the process-wide SharedCache, or None if none is installed."""
+  return _shared_cache
+
+
+def set_shared_cache(cache):
+  """Install a SharedCache for all Contexts in this process.
+
+  Args:
+    cache: A SharedCache instance, or None to stop using it.
+  """
+  global _shared_cache
+  if cache is not None and not isinstance(cache, SharedCache):
+    raise TypeError('cache must be a SharedCache; received %r' % cache)
+  _shared_cache = cache
+
+
 class Context(object):
 
   def __init__(self, conn=None, auto_batcher_class=AutoBatcher, config=None,
@@ -198,22 +715,38 @@ class Context(object):
     max_delete = (datastore_rpc.Configuration.max_delete_keys(config,
                                                               conn.config) or
                   datastore_rpc.Connection.MAX_DELETE_KEYS)
+    # The optional age and in-flight limits apply to all auto-batchers;
+    # they are only passed on when set.
+    batcher_options = {}
+    max_age = ContextOptions.max_batch_age(config, conn.config)
+    if max_age is not None:
+      batcher_options['max_age'] = max_age
+    max_in_flight = ContextOptions.max_batches_in_flight(config, conn.config)
+    if max_in_flight is not None:
+      batcher_options['max_in_flight'] = max_in_flight
     # Create the get/put/delete auto-batchers.
-    self._get_batcher = auto_batcher_class(self._get_tasklet, max_get)
-    self._put_batcher = auto_batcher_class(self._put_tasklet, max_put)
-    self._delete_batcher = auto_batcher_class(self._delete_tasklet, max_delete)
+    self._get_batcher = auto_batcher_class(self._get_tasklet, max_get,
+                                           **batcher_options)
+    self._put_batcher = auto_batcher_class(self._put_tasklet, max_put,
+                                           **batcher_options)
+    self._delete_batcher = auto_batcher_class(self._delete_tasklet, max_delete,
+                                              **batcher_options)
     # We only have a single limit for memcache (default 1000).
     max_memcache = (ContextOptions.max_memcache_items(config, conn.config) or
                     datastore_rpc.Connection.MAX_GET_KEYS)
     # Create the memcache auto-batchers.
     self._memcache_get_batcher = auto_batcher_class(self._memcache_get_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_set_batcher = auto_batcher_class(self._memcache_set_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_del_batcher = auto_batcher_class(self._memcache_del_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_off_batcher = auto_batcher_class(self._memcache_off_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     # Create a list of batchers for flush().
     self._batchers = [self._get_batcher,
                       self._put_batcher,
@@ -225,6 +758,10 @@ class Context(object):
                       ]
     self._cache = {}
     self._memcache = memcache.Client()
+    self._get_multi_stats = dict.fromkeys(
+      ('calls', 'keys', 'cache_hits', 'shared_cache_hits', 'memcache_hits'),
+      0)
+    self._get_multi_stats.update(dict.fromkeys(_GET_MULTI_PHASES, 0.0))
     self._on_commit_queue = []
 
   # NOTE: The default memcache prefix is altered if an incompatible change is
@@ -548,6 +1085,146 @@ class Context(object):
     """Return the current policy function for memcache timeout (expiration)."""
     return self._memcache_timeout_policy
 
+  @staticmethod
+  def default_shared_cache_policy(key):
+    """Default shared cache policy.
+
+    This defers to _shared_cache_timeout on the Model class.
+
+    Args:
+      key: Key instance.
+
+    Returns:
+      None if the key should not be cached in the SharedCache; 0 if
+      its entity never changes, so it may be cached until evicted;
+      otherwise the number of seconds it may be cached.
+    """
+    timeout = None
+    if key is not None and isinstance(key, model.Key):
+      modelclass = model.Model._kind_map.get(key.kind())
+      if modelclass is not None:
+        policy = getattr(modelclass, '_shared_cache_timeout', None)
+        if policy is not None:
+          if isinstance(policy, (int, long)):
+            timeout = policy
+          else:
+            timeout = policy(key)
+    return timeout
+
+  _shared_cache_policy = default_shared_cache_policy
+
+  def set_shared_cache_policy(self, func):
+    """Set the policy function for the process-wide SharedCache.
+
+    Args:
+      func: A function that accepts a key instance as argument and returns
+        None (don't use the SharedCache), 0 (cache until evicted) or a
+        number of seconds to cache the entity.  May be None.
+    """
+    if func is None:
+      func = self.default_shared_cache_policy
+    elif isinstance(func, (int, long)):
+      func = lambda unused_key, timeout=func: timeout
+    self._shared_cache_policy = func
+
+  def get_shared_cache_policy(self):
+    """Return the current policy function for the SharedCache."""
+    return self._shared_cache_policy
+
+  def _get_shared_cache_timeout(self, key, options=None):
+    """Return the SharedCache timeout for this key, or None not to use it.
+
+    The SharedCache is never used in a transaction, or if the context
+    cache is disabled for this key by the options or the cache policy.
+    """
+    if (_shared_cache is None or
+        isinstance(self._conn, datastore_rpc.TransactionalConnection) or
+        not self._use_cache(key, options)):
+      return None
+    return self._shared_cache_policy(key)
+
+  def _get_from_shared_cache(self, key):
+    """Internal helper to look up an entity in the SharedCache."""
+    cache = _shared_cache
+    if cache is None:
+      return None
+    pbs = cache.get(key)
+    if pbs is None:
+      return None
+    cls = model.Model._kind_map.get(key.kind())
+    if cls is None:
+      raise TypeError('Cannot find model class for kind %s' % key.kind())
+    pb = entity_pb.EntityProto()
+    pb.MergePartialFromString(pbs)
+    entity = cls._from_pb(pb)
+    entity._key = key
+    return entity
+
+  def _add_to_shared_cache(self, key, entity, timeout):
+    """Internal helper to store an entity in the SharedCache."""
+    cache = _shared_cache
+    if cache is not None:
+      # Don't serialize the key since it's already the cache key.
+      pbs = entity._to_pb(set_key=False).SerializePartialToString()
+      cache.set(key, pbs, timeout)
+
+  @staticmethod
+  def default_memcache_codec_policy(key):
+    """Default memcache codec policy.
+
+    This defers to _memcache_codec on the Model class.
+
+    Args:
+      key: Key instance.
+
+    Returns:
+      A MemcacheCodec instance, or None.
+    """
+    codec = None
+    if key is not None and isinstance(key, model.Key):
+      modelclass = model.Model._kind_map.get(key.kind())
+      if modelclass is not None:
+        policy = getattr(modelclass, '_memcache_codec', None)
+        if policy is not None:
+          if isinstance(policy, MemcacheCodec):
+            codec = policy
+          else:
+            codec = policy(key)
+    return codec
+
+  _memcache_codec_policy = default_memcache_codec_policy
+
+  def set_memcache_codec_policy(self, func):
+    """Set the policy function for encoding entities in memcache.
+
+    Args:
+      func: A function that accepts a key instance as argument and returns
+        a MemcacheCodec instance, or None to store plain serialized
+        entities.  May be None.
+    """
+    if func is None:
+      func = self.default_memcache_codec_policy
+    elif isinstance(func, MemcacheCodec):
+      func = lambda unused_key, codec=func: codec
+    self._memcache_codec_policy = func
+
+  def get_memcache_codec_policy(self):
+    """Return the current policy function for encoding entities in memcache."""
+    return self._memcache_codec_policy
+
+  def _encode_for_memcache(self, key, mkey, entity):
+    """Internal helper to encode an entity for memcache.
+
+    Returns:
+      A tuple (value, chunks) like MemcacheCodec.encode().
+    """
+    # Don't serialize the key since it's already the memcache key.
+    pbs = entity._to_pb(set_key=False).SerializePartialToString()
+    codec = self._memcache_codec_policy(key)
+    if codec is None:
+      return pbs, {}
+    return codec.encode(mkey, pbs)
+
   def _get_memcache_timeout(self, key, options=None):
     """Return the memcache timeout (expiration) for this key."""
     timeout = ContextOptions.memcache_timeout(options)
@@ -590,6 +1267,13 @@ class Context(object):
           # See issue 13.  http://goo.gl/jxjOP
           raise tasklets.Return(entity)
 
+    shared_timeout = self._get_shared_cache_timeout(key, options)
+    if shared_timeout is not None:
+      entity = self._get_from_shared_cache(key)
+      if entity is not None:
+        self._cache[key] = entity  # The SharedCache implies use_cache.
+        raise tasklets.Return(entity)
+
     use_datastore = self._use_datastore(key, options)
     if (use_datastore and
         isinstance(self._conn, datastore_rpc.TransactionalConnection)):
@@ -603,24 +1287,20 @@ class Context(object):
       mvalue = yield self.memcache_get(mkey, for_cas=use_datastore,
                                        namespace=ns, use_cache=True)
       if mvalue not in (_LOCKED, None):
-        cls = model.Model._kind_map.get(key.kind())
-        if cls is None:
-          raise TypeError('Cannot find model class for kind %s' % key.kind())
-        pb = entity_pb.EntityProto()
-
-        try:
-          pb.MergePartialFromString(mvalue)
-        except ProtocolBuffer.ProtocolBufferDecodeError:
-          logging.warning('Corrupt memcache entry found '
-                          'with key %s and namespace %s' % (mkey, ns))
-          mvalue = None
+        chunks = None
+        chunk_keys = MemcacheCodec.chunk_keys(mkey, mvalue)
+        if chunk_keys:
+          chunks = yield self._memcache_multi('get_multi_async', chunk_keys,
+                                              namespace=ns)
+        entity = self._entity_from_memcache(key, mkey, mvalue, chunks)
+        if entity is None:
+          mvalue = None  # Corrupt entry; treat it as a miss.
         else:
-          entity = cls._from_pb(pb)
-          # Store the key on the entity since it wasn't written to memcache.
-          entity._key = key
           if use_cache:
             # Update in-memory cache.
             self._cache[key] = entity
+          if shared_timeout is not None:
+            self._add_to_shared_cache(key, entity, shared_timeout)
           raise tasklets.Return(entity)
 
       if mvalue is None and use_datastore:
@@ -640,14 +1320,18 @@ class Context(object):
 
     if entity is not None:
       if use_memcache and mvalue != _LOCKED:
-        # Don't serialize the key since it's already the memcache key.
-        pbs = entity._to_pb(set_key=False).SerializePartialToString()
+        value, chunks = self._encode_for_memcache(key, mkey, entity)
         timeout = self._get_memcache_timeout(key, options)
+        if chunks:
+          yield self._memcache_multi('set_multi_async', chunks, time=timeout,
+                                     namespace=ns)
         # Don't use fire-and-forget -- for users who forget
         # @ndb.toplevel, it's too painful to diagnose why their simple
         # code using a single synchronous call doesn't seem to use
         # memcache.  See issue 105.  http://goo.gl/JQZxp
-        yield self.memcache_cas(mkey, pbs, time=timeout, namespace=ns)
+        yield self.memcache_cas(mkey, value, time=timeout, namespace=ns)
+      if shared_timeout is not None:
+        self._add_to_shared_cache(key, entity, shared_timeout)
 
     if use_cache:
       # Cache hit or miss.  NOTE: In this case it is okay to cache a
@@ -656,6 +1340,226 @@ class Context(object):
 
     raise tasklets.Return(entity)
 
+  def _entity_from_memcache(self, key, mkey, mvalue, chunks=None):
+    """Internal helper to decode an entity found in memcache.
+
+    Returns None if one of its chunks is missing, or (after logging a
+    warning) if the value is corrupt.
+    """
+    cls = model.Model._kind_map.get(key.kind())
+    if cls is None:
+      raise TypeError('Cannot find model class for kind %s' % key.kind())
+    pb = entity_pb.EntityProto()
+    try:
+      pbs = MemcacheCodec.decode(mkey, mvalue, chunks)
+      if pbs is None:
+        return None
+      pb.MergePartialFromString(pbs)
+    except (ValueError, ProtocolBuffer.ProtocolBufferDecodeError):
+      logging.warning('Corrupt memcache entry found '
+                      'with key %s and namespace %s' % (mkey, key.namespace()))
+      return None
+    entity = cls._from_pb(pb)
+    # Store the key on the entity since it wasn't written to memcache.
+    entity._key = key
+    return entity
+
+  @tasklets.tasklet
+  def get_multi(self, keys, **ctx_options):
+    """Return a list of Model instances given a sequence of keys.
+
+    This follows the same policies as get(), but handles all keys at
+    once instead of running a get() per key: for each namespace there
+    is at most one memcache get, one memcache add of locks for the
+    misses, one datastore get (during which the CAS ids of the locks
+    are fetched) and one memcache cas writing the entities back.  The
+    time spent in each phase is added to get_multi_stats().
+
+    Args:
+      keys: A sequence of Key instances.
+      **ctx_options: Context options.
+
+    Returns:
+      A list containing a Model instance, or None if the entity doesn't
+      exist, for each key.
+    """
+    options = _make_ctx_options(ctx_options)
+    stats = self._get_multi_stats
+    stats['calls'] += 1
+    stats['keys'] += len(keys)
+    results = {}  # {key: entity or None}
+    todo = {}  # {key: (use_cache, use_memcache, use_datastore)}
+    shared = {}  # {key: SharedCache timeout}
+    for key in keys:
+      if key in results or key in todo:
+        continue
+      use_cache = self._use_cache(key, options)
+      if use_cache and key in self._cache:
+        entity = self._cache[key]  # May be None, meaning "doesn't exist".
+        if entity is None or entity._key == key:
+          stats['cache_hits'] += 1
+          results[key] = entity
+          continue
+      shared_timeout = self._get_shared_cache_timeout(key, options)
+      if shared_timeout is not None:
+        entity = self._get_from_shared_cache(key)
+        if entity is not None:
+          stats['shared_cache_hits'] += 1
+          results[key] = entity
+          self._cache[key] = entity  # See get().
+          continue
+        shared[key] = shared_timeout
+      use_datastore = self._use_datastore(key, options)
+      if (use_datastore and
+          isinstance(self._conn, datastore_rpc.TransactionalConnection)):
+        use_memcache = False
+      else:
+        use_memcache = self._use_memcache(key, options)
+      todo[key] = (use_cache, use_memcache, use_datastore)
+
+    # Phase 1: look up all keys in memcache.
+    mkeys = {}  # {namespace: {memcache key: key}}
+    for key, (unused_cache, use_memcache, unused_ds) in todo.iteritems():
+      if use_memcache:
+        mkey = self._memcache_prefix + key.urlsafe()
+        mkeys.setdefault(key.namespace(), {})[mkey] = key
+    misses = {}  # {namespace: {memcache key: key}}
+    if mkeys:
+      t0 = time.time()
+      namespaces = mkeys.keys()
+      mvalues = yield [self._memcache_multi('get_multi_async',
+                                            mkeys[ns].keys(), namespace=ns)
+                       for ns in namespaces]
+      # Fetch the chunks of all values that were split up at once.
+      chunk_keys = {}  # {namespace: [chunk key, ...]}
+      for ns, mvals in zip(namespaces, mvalues):
+        for mkey, mvalue in mvals.iteritems():
+          value_chunk_keys = MemcacheCodec.chunk_keys(mkey, mvalue)
+          if value_chunk_keys:
+            chunk_keys.setdefault(ns, []).extend(value_chunk_keys)
+      chunks = {}  # {namespace: {chunk key: chunk}}
+      if chunk_keys:
+        chunk_namespaces = chunk_keys.keys()
+        chunk_values = yield [self._memcache_multi('get_multi_async',
+                                                   chunk_keys[ns],
+                                                   namespace=ns)
+                              for ns in chunk_namespaces]
+        chunks = dict(zip(chunk_namespaces, chunk_values))
+      stats['memcache_get'] += time.time() - t0
+      for ns, mvals in zip(namespaces, mvalues):
+        for mkey, key in mkeys[ns].iteritems():
+          mvalue = mvals.get(mkey)
+          if mvalue == _LOCKED:
+            continue
+          if mvalue is not None:
+            entity = self._entity_from_memcache(key, mkey, mvalue,
+                                                chunks.get(ns))
+            if entity is not None:
+              stats['memcache_hits'] += 1
+              results[key] = entity
+              if todo[key][0]:
+                self._cache[key] = entity
+              if key in shared:
+                self._add_to_shared_cache(key, entity, shared[key])
+              continue
+          if todo[key][2]:
+            misses.setdefault(ns, {})[mkey] = key
+
+    # Phase 2: lock the misses, unless another get or put already did.
+    locked = {}  # {namespace: {memcache key: key}}
+    if misses:
+      t0 = time.time()
+      namespaces = misses.keys()
+      statuses = yield [self._memcache_multi('add_multi_async',
+                                             dict.fromkeys(misses[ns],
+                                                           _LOCKED),
+                                             time=_LOCK_TIME, namespace=ns)
+                        for ns in namespaces]
+      stats['memcache_lock'] += time.time() - t0
+      for ns, status in zip(namespaces, statuses):
+        for mkey, key in misses[ns].iteritems():
+          if status.get(mkey) == memcache.MemcacheSetResponse.STORED:
+            locked.setdefault(ns, {})[mkey] = key
+
+    # Phase 3: read the remaining keys from the datastore.
+    ds_keys = [key for key, (unused_cache, unused_mc, use_datastore)
+               in todo.iteritems()
+               if use_datastore and key not in results]
+    if not ds_keys:
+      raise tasklets.Return([results.get(key) for key in keys])
+    t0 = time.time()
+    namespaces = locked.keys()
+    futures = [self._datastore_get(ds_keys, options)]
+    futures.extend(self._memcache_multi('get_multi_async', locked[ns].keys(),
+                                        for_cas=True, namespace=ns)
+                   for ns in namespaces)
+    replies = yield futures
+    stats['datastore'] += time.time() - t0
+    for key, entity in zip(ds_keys, replies[0]):
+      results[key] = entity
+      if todo[key][0]:
+        # NOTE: In this case it is okay to cache a miss; the datastore
+        # is the ultimate authority.
+        self._cache[key] = entity
+      if entity is not None and key in shared:
+        self._add_to_shared_cache(key, entity, shared[key])
+
+    # Phase 4: write back the entities whose lock is still ours.
+    mapping = {}  # {(namespace, timeout): {memcache key: value}}
+    chunks = {}  # {(namespace, timeout): {chunk key: chunk}}
+    for ns, lock_values in zip(namespaces, replies[1:]):
+      for mkey, key in locked[ns].iteritems():
+        entity = results[key]
+        if entity is None or lock_values.get(mkey) != _LOCKED:
+          continue
+        value, value_chunks = self._encode_for_memcache(key, mkey, entity)
+        timeout = self._get_memcache_timeout(key, options)
+        mapping.setdefault((ns, timeout), {})[mkey] = value
+        if value_chunks:
+          chunks.setdefault((ns, timeout), {}).update(value_chunks)
+    if mapping:
+      t0 = time.time()
+      if chunks:
+        # The chunks must be there before the values referring to them.
+        yield [self._memcache_multi('set_multi_async', values, time=timeout,
+                                    namespace=ns)
+               for (ns, timeout), values in chunks.iteritems()]
+      yield [self._memcache_multi('cas_multi_async', values, time=timeout,
+                                  namespace=ns)
+             for (ns, timeout), values in mapping.iteritems()]
+      stats['memcache_cas'] += time.time() - t0
+
+    raise tasklets.Return([results.get(key) for key in keys])
+
+  @tasklets.tasklet
+  def _memcache_multi(self, methodname, *args, **kwds):
+    """Internal helper to wait for a memcache *_multi_async() call.
+
+    On a network error the result is an empty dict.
+    """
+    result = yield getattr(self._memcache, methodname)(*args, **kwds)
+    raise tasklets.Return(result or {})
+
+  @tasklets.tasklet
+  def _datastore_get(self, keys, options):
+    """Internal helper to wait for a datastore get of a list of keys.
+
+    The keys go through the get batcher, so that they are merged with
+    concurrent get() and get_multi() calls.
+    """
+    entities = yield [self._get_batcher.add(key, options) for key in keys]
+    raise tasklets.Return(entities)
+
+  def get_multi_stats(self):
+    """Return a dict of get_multi() counters and per-phase totals.
+
+    The counters are 'calls', 'keys', 'cache_hits', 'shared_cache_hits'
+    and 'memcache_hits'; the phases ('memcache_get', 'memcache_lock',
+    'datastore' and 'memcache_cas') give the total seconds spent
+    waiting for them.
+    """
+    return dict(self._get_multi_stats)
+
   @tasklets.tasklet
   def put(self, entity, **ctx_options):
     options = _make_ctx_options(ctx_options)
@@ -669,6 +1573,10 @@ class Context(object):
     use_memcache = None
 
     if entity._has_complete_key():
+      if _shared_cache is not None:
+        # This only affects this process; other processes rely on the
+        # policy's timeout.
+        _shared_cache.discard(key)
       use_memcache = self._use_memcache(key, options)
       if use_memcache:
         # Wait for memcache operations before starting datastore RPCs.
@@ -678,9 +1586,12 @@ class Context(object):
           yield self.memcache_set(mkey, _LOCKED, time=_LOCK_TIME,
                                   namespace=ns, use_cache=True)
         else:
-          pbs = entity._to_pb(set_key=False).SerializePartialToString()
+          value, chunks = self._encode_for_memcache(key, mkey, entity)
           timeout = self._get_memcache_timeout(key, options)
-          yield self.memcache_set(mkey, pbs, time=timeout, namespace=ns)
+          if chunks:
+            yield self._memcache_multi('set_multi_async', chunks,
+                                       time=timeout, namespace=ns)
+          yield self.memcache_set(mkey, value, time=timeout, namespace=ns)
 
     if use_datastore:
       key = yield self._put_batcher.add(entity, options)
@@ -707,6 +1618,8 @@ class Context(object):
   @tasklets.tasklet
   def delete(self, key, **ctx_options):
     options = _make_ctx_options(ctx_options)
+    if _shared_cache is not None:
+      _shared_cache.discard(key)  # See put().
     if self._use_memcache(key, options):
       mkey = self._memcache_prefix + key.urlsafe()
       ns = key.namespace()
@@ -941,6 +1854,26 @@ class Context(object):
     """
     self._cache.clear()
 
+  def get_cache_backend(self):
+    """Return the mapping used for the in-memory cache."""
+    return self._cache
+
+  def set_cache_backend(self, cache):
+    """Set the mapping used for the in-memory cache.
+
+    Entries already in the current cache are copied into the new one.
+    The cache policy decides what gets cached as before; the backend
+    only decides how long it stays there.
+
+    Args:
+      cache: A dict-like object such as an LruCache instance, or None to
+        go back to a plain dict.
+    """
+    if cache is None:
+      cache = {}
+    cache.update(self._cache)
+    self._cache = cache
+
   @tasklets.tasklet
   def _clear_memcache(self, keys):
     keys = set(key for key in keys if self._use_memcache(key))
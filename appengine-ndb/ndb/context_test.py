@@ -131,6 +131,80 @@ class ContextTests(test_utils.NDBTest):
     self.assertEqual(name, '_delete_tasklet')
     self.assertEqual(len(todo), 3)
 
+  def testAutoBatcher_FifoAndStats(self):
+    log = []
+    @tasklets.tasklet
+    def todo_tasklet(todo, options):
+      log.append((options, [arg for unused_fut, arg in todo]))
+      yield tasklets.sleep(0)
+      for fut, arg in todo:
+        fut.set_result(arg)
+    batcher = context.AutoBatcher(todo_tasklet, 3)
+    futs = [batcher.add(arg, options)
+            for arg, options in [(1, 'b'), (2, 'a'), (3, 'b'), (4, 'c'),
+                                 (5, 'a'), (6, 'a')]]
+    batcher.flush().check_success()
+    self.assertEqual([fut.get_result() for fut in futs], [1, 2, 3, 4, 5, 6])
+    # The full queue goes first; the others in order of creation.
+    self.assertEqual(log, [('a', [2, 5, 6]), ('b', [1, 3]), ('c', [4])])
+    stats = batcher.stats()
+    self.assertEqual(stats['histogram'], {1: 1, 2: 1, 4: 1})
+    self.assertEqual(stats['batches'], 3)
+    self.assertEqual(stats['full'], 1)
+    self.assertEqual(stats['idle'], 2)
+    self.assertEqual(stats['age'], 0)
+
+  def testAutoBatcher_MaxInFlight(self):
+    log = []
+    @tasklets.tasklet
+    def todo_tasklet(todo, options):
+      log.append(len(batcher._running))
+      yield tasklets.sleep(0)
+      for fut, arg in todo:
+        fut.set_result(arg)
+    batcher = context.AutoBatcher(todo_tasklet, 2, max_in_flight=1)
+    futs = [batcher.add(i, i % 3) for i in range(6)]
+    batcher.flush().check_success()
+    self.assertEqual([fut.get_result() for fut in futs], range(6))
+    self.assertEqual(log, [0, 0, 0])
+    stats = batcher.stats()
+    self.assertEqual(stats['peak_in_flight'], 1)
+    self.assertEqual(stats['held_back'], 2)
+
+  def testAutoBatcher_MaxAge(self):
+    @tasklets.tasklet
+    def todo_tasklet(todo, options):
+      for fut, arg in todo:
+        fut.set_result(arg)
+    batcher = context.AutoBatcher(todo_tasklet, 1000, max_age=0.01)
+    futs = []
+    done = []
+    def add(i):
+      # Each add comes from a pending call, so the loop never goes idle.
+      if i:
+        time.sleep(0.02)  # Let the previous queue age.
+      futs.append(batcher.add(i, i % 2))
+      if i < 3:
+        eventloop.queue_call(None, add, i + 1)
+      else:
+        done.append(time.time())
+    eventloop.queue_call(None, add, 0)
+    eventloop.run()
+    # The loop does not sleep on leftover timers after the work is done.
+    self.assertTrue(time.time() - done[0] < 0.01)
+    self.assertFalse(eventloop.get_event_loop().queue)
+    self.assertEqual([fut.get_result() for fut in futs], range(4))
+    # Each queue but the last was flushed by age while the loop was busy.
+    self.assertEqual(batcher.stats()['age'], 3)
+    self.assertEqual(batcher.stats()['idle'], 1)
+    config = context.ContextOptions(max_batch_age=0.01,
+                                    max_batches_in_flight=2)
+    ctx = context.Context(config=config)
+    self.assertEqual(ctx._get_batcher._max_age, 0.01)
+    self.assertEqual(ctx._memcache_set_batcher._max_in_flight, 2)
+    self.assertRaises(datastore_errors.BadArgumentError,
+                      context.ContextOptions, max_batches_in_flight=0)
+
   def testContext_AutoBatcher_Limit(self):
     # Check that the default limit is taken from the connection.
     self.assertEqual(self.ctx._get_batcher._limit,
@@ -259,6 +333,57 @@ class ContextTests(test_utils.NDBTest):
     self.ctx.set_memcache_policy(False)
     foo().check_success()
 
+  def testContext_LruCacheBackend(self):
+    ctx = self.ctx
+    ctx.set_memcache_policy(False)
+    key1 = model.Key(flat=('Foo', 1))
+    ctx.put(model.Expando(key=key1, foo=1)).get_result()
+    cache = context.LruCache(max_entries=2)
+    ctx.set_cache_backend(cache)
+    self.assertTrue(ctx.get_cache_backend() is cache)
+    self.assertEqual(cache.keys(), [key1])  # Existing entries were copied.
+
+    key2 = model.Key(flat=('Foo', 2))
+    key3 = model.Key(flat=('Foo', 3))
+    ctx.put(model.Expando(key=key2, foo=2)).get_result()
+    ent1 = ctx.get(key1).get_result()  # Hit; key1 is now most recent.
+    self.assertEqual(ent1.foo, 1)
+    ctx.put(model.Expando(key=key3, foo=3)).get_result()  # Evicts key2.
+    self.assertEqual(cache.keys(), [key1, key3])
+    self.assertEqual(cache.stats()['hits'], 1)
+    self.assertEqual(cache.stats()['evictions'], 1)
+
+    # An evicted entity is fetched again and re-cached.
+    ent2 = ctx.get(key2).get_result()
+    self.assertEqual(ent2.foo, 2)
+    self.assertEqual(cache.keys(), [key3, key2])
+    self.assertEqual(cache.stats()['misses'], 1)
+
+    # The cache policy still decides what is cached.
+    ctx.set_cache_policy(False)
+    ctx.get(key1).get_result()
+    self.assertFalse(key1 in cache)
+
+    ctx.set_cache_backend(None)
+    self.assertEqual(sorted(ctx._cache), [key2, key3])  # Whitebox.
+
+  def testContext_LruCacheMaxBytes(self):
+    cache = context.LruCache(max_bytes=1000)
+    ents = [model.Expando(key=model.Key('Foo', i), data='x' * 250)
+            for i in xrange(1, 6)]
+    for ent in ents:
+      cache[ent.key] = ent
+    self.assertTrue(cache.stats()['bytes'] <= 1000)
+    self.assertEqual(cache.keys(), [ent.key for ent in ents[-3:]])
+    self.assertEqual(cache.stats()['evictions'], 2)
+    cache[ents[-1].key] = None  # A cached miss takes no space.
+    self.assertEqual(len(cache), 3)
+    del cache[ents[-1].key]
+    self.assertEqual(cache.keys(), [ent.key for ent in ents[2:4]])
+    cache.clear()
+    self.assertEqual(cache, {})
+    self.assertEqual(cache.stats()['bytes'], 0)
+
   def testContext_CachePolicyDisabledLater(self):
     # If the cache is disabled after an entity is stored in the cache,
     # further get() attempts *must not* return the result stored in cache.
@@ -428,6 +553,193 @@ class ContextTests(test_utils.NDBTest):
          })
     foo().check_success()
 
+  def testContext_GetMulti(self):
+    class Foo(model.Model):
+      foo = model.IntegerProperty()
+      bar = model.StringProperty()
+    @tasklets.tasklet
+    def foo():
+      key1 = model.Key(Foo, 1)
+      key2 = model.Key(Foo, 2)
+      key3 = model.Key(Foo, 3)
+      ent1 = Foo(key=key1, foo=42, bar='hello')
+      ent2 = Foo(key=key2, foo=1, bar='world')
+      self.ctx.set_memcache_policy(False)  # Disable writing _LOCKED
+      yield self.ctx.put(ent1), self.ctx.put(ent2)
+      self.ctx.set_memcache_policy(True)
+      # Read from the datastore and write to memcache.
+      ents = yield self.ctx.get_multi([key1, key2, key3, key1],
+                                      use_cache=False)
+      self.assertEqual(ents, [ent1, ent2, None, ent1])
+      # Every phase ran, so each was timed.
+      stats = self.ctx.get_multi_stats()
+      for phase in context._GET_MULTI_PHASES:
+        self.assertTrue(isinstance(stats[phase], float), phase)
+        self.assertTrue(stats[phase] >= 1.0, phase)
+      keys = [key1.urlsafe(), key2.urlsafe(), key3.urlsafe()]
+      results = memcache.get_multi(keys, key_prefix=self.ctx._memcache_prefix)
+      self.assertEqual(
+        results,
+        {key1.urlsafe(): ent1._to_pb(set_key=False).SerializePartialToString(),
+         key2.urlsafe(): ent2._to_pb(set_key=False).SerializePartialToString(),
+         key3.urlsafe(): context._LOCKED,
+         })
+      # Read from memcache, except the missing key which is still locked.
+      ents = yield self.ctx.get_multi([key1, key2, key3], use_cache=False)
+      self.assertEqual(ents, [ent1, ent2, None])
+      stats = self.ctx.get_multi_stats()
+      self.assertEqual(stats['calls'], 2)
+      self.assertEqual(stats['keys'], 7)
+      self.assertEqual(stats['cache_hits'], 0)
+      self.assertEqual(stats['memcache_hits'], 2)
+      # Only memcache is read when every key is a memcache hit.
+      ents = yield self.ctx.get_multi([key1, key2], use_cache=False)
+      self.assertEqual(ents, [ent1, ent2])
+      after = self.ctx.get_multi_stats()
+      self.assertTrue(after['memcache_get'] > stats['memcache_get'])
+      for phase in 'memcache_lock', 'datastore', 'memcache_cas':
+        self.assertEqual(after[phase], stats[phase], phase)
+    class FakeTime(object):
+      # A clock that advances one second every time it is read, so that
+      # every phase that runs takes at least a second.
+      now = 0.0
+      def time(self):
+        self.now += 1.0
+        return self.now
+    self.assertEqual(self.ctx.get_multi_stats()['datastore'], 0.0)
+    orig_time = context.time
+    context.time = FakeTime()
+    try:
+      foo().check_success()
+    finally:
+      context.time = orig_time
+
+  def testContext_MemcacheCodec(self):
+    codec = context.MemcacheCodec(compress_threshold=100, chunk_size=1000)
+    class Post(model.Model):
+      _memcache_codec = codec
+      body = model.TextProperty()
+      blob = model.BlobProperty()
+    random.seed(42)
+    noise = ''.join(chr(random.randrange(256)) for _ in xrange(2500))
+    key1 = model.Key(Post, 1)
+    key2 = model.Key(Post, 2)
+    ent1 = Post(key=key1, body=u'hello ' * 100)
+    ent2 = Post(key=key2, blob=noise)
+    @tasklets.tasklet
+    def foo():
+      self.ctx.set_memcache_policy(False)  # Disable writing _LOCKED
+      yield self.ctx.put(ent1), self.ctx.put(ent2)
+      self.ctx.set_memcache_policy(True)
+      # Write to memcache.
+      yield (self.ctx.get(key1, use_cache=False),
+             self.ctx.get(key2, use_cache=False))
+      eventloop.run()  # Let other tasklet complete.
+      # The first entity is compressed, the second split into chunks.
+      mkey1 = self.ctx._memcache_prefix + key1.urlsafe()
+      mkey2 = self.ctx._memcache_prefix + key2.urlsafe()
+      mvalue1 = memcache.get(mkey1)
+      mvalue2 = memcache.get(mkey2)
+      self.assertEqual(mvalue1[:3], '\0\x01\x01')
+      self.assertEqual(mvalue2[:3], '\0\x01\x02')
+      chunk_keys = context.MemcacheCodec.chunk_keys(mkey2, mvalue2)
+      self.assertEqual(len(chunk_keys), 3)
+      stats = codec.stats()
+      self.assertEqual(
+        (stats['values'], stats['compressed'], stats['chunked']), (2, 1, 1))
+      self.assertTrue(stats['bytes_saved'] > 0)
+      # Read back from memcache, one at a time and together.
+      got1, got2 = yield (self.ctx.get(key1, use_cache=False),
+                          self.ctx.get(key2, use_cache=False))
+      self.assertEqual((got1, got2), (ent1, ent2))
+      ents = yield self.ctx.get_multi([key1, key2], use_cache=False)
+      self.assertEqual(ents, [ent1, ent2])
+      self.assertEqual(self.ctx.get_multi_stats()['memcache_hits'], 2)
+      # A missing chunk turns the value into a miss.
+      memcache.delete(chunk_keys[1])
+      ent = yield self.ctx.get(key2, use_cache=False)
+      self.assertEqual(ent, ent2)
+    foo().check_success()
+
+  def testContext_GetMultiTwice(self):
+    # Reading the same keys again, now from memcache, returns one
+    # entity per key, also when a value is split into chunks.
+    codec = context.MemcacheCodec(compress_threshold=100, chunk_size=1000)
+    class Post(model.Model):
+      _memcache_codec = codec
+      blob = model.BlobProperty()
+    random.seed(42)
+    noise = ''.join(chr(random.randrange(256)) for _ in xrange(2500))
+    key1 = model.Key(Post, 1)
+    key2 = model.Key(Post, 2)
+    key3 = model.Key(Post, 3)
+    ent1 = Post(key=key1, blob='small')
+    ent2 = Post(key=key2, blob=noise)
+    self.ctx.set_memcache_policy(False)  # Disable writing _LOCKED
+    model.put_multi([ent1, ent2])
+    self.ctx.set_memcache_policy(True)
+    keys = [key1, key2, key3, key1]
+    for _ in xrange(2):
+      self.assertEqual(model.get_multi(keys, use_cache=False),
+                       [ent1, ent2, None, ent1])
+      eventloop.run()  # Let the memcache writes complete.
+    self.assertEqual(self.ctx.get_multi_stats()['memcache_hits'], 2)
+
+  def testContext_SharedCache(self):
+    class Post(model.Model):
+      _shared_cache_timeout = 0  # Immutable.
+      body = model.TextProperty()
+    class Shard(model.Model):
+      pass
+    shared = context.SharedCache()
+    context.set_shared_cache(shared)
+    try:
+      self.assertTrue(context.get_shared_cache() is shared)
+      ent = Post(id=1, body=u'hello')
+      key = ent.put()
+      shard_key = Shard(id=1).put()
+      self.ctx.clear_cache()
+      # The first get fills the shared cache...
+      self.assertEqual(key.get(), ent)
+      self.assertEqual(shard_key.get(), Shard(id=1))
+      self.assertEqual(len(shared), 1)
+      # ...so that another context gets its own copy from it.
+      ctx2 = context.Context(conn=model.make_connection())
+      tasklets.set_context(ctx2)
+      ctx2.set_memcache_policy(False)
+      ctx2.set_datastore_policy(False)
+      ent2 = key.get()
+      self.assertEqual(ent2, ent)
+      self.assertFalse(ent2 is ent)
+      self.assertEqual(shard_key.get(), None)
+      ctx2.clear_cache()
+      [ent3] = ctx2.get_multi([key]).get_result()
+      self.assertEqual(ent3, ent)
+      self.assertEqual(ctx2.get_multi_stats()['shared_cache_hits'], 1)
+      stats = shared.stats()
+      self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+      self.assertEqual(stats['hit_rate'], 2.0 / 3)
+      # Writing in this process drops the cached copy.
+      key.delete()
+      self.assertEqual(len(shared), 0)
+      # Policies may enable the cache for other kinds, with a timeout.
+      tasklets.set_context(self.ctx)
+      self.ctx.set_shared_cache_policy(lambda key: 60)
+      self.ctx.clear_cache()
+      shard_key.get()
+      self.assertEqual(len(shared), 1)
+      # But it is not used when the context cache is turned off,
+      # by the options or by the cache policy.
+      shared.clear()
+      self.ctx.clear_cache()
+      shard_key.get(use_cache=False)
+      self.assertEqual(len(shared), 0)
+      self.ctx.set_cache_policy(False)
+      shard_key.get()
+      self.assertEqual(len(shared), 0)
+    finally:
+      context.set_shared_cache(None)
+
   def testContext_MemcachePolicy(self):
     badkeys = []
     def tracking_add_async(*args, **kwds):
@@ -11,6 +11,8 @@ The API here is inspired by Monocle.
 """
 
 import collections
+import heapq
+import itertools
 import logging
 import os
 import time
@@ -41,15 +43,20 @@ class EventLoop(object):
     self.current = collections.deque()  # FIFO list of (callback, args, kwds)
     self.idlers = collections.deque()  # Cyclic list of (callback, args, kwds)
     self.inactive = 0  # How many idlers in a row were no-ops
-    self.queue = []  # Sorted list of (time, callback, args, kwds)
+    self.queue = []  # Heap of (time, seqno, callback, args, kwds)
+    self.ready = collections.deque()  # Zero-delay events, same format
     self.rpcs = {}  # Map of rpc -> (callback, args, kwds)
+    # Sequence numbers break ties between equal times, keeping FIFO order.
+    self.counter = itertools.count()
 
   def clear(self):
     """Remove all pending events without running any."""
-    while self.current or self.idlers or self.queue or self.rpcs:
+    while (self.current or self.idlers or self.queue or self.ready or
+           self.rpcs):
       current = self.current
       idlers = self.idlers
       queue = self.queue
+      ready = self.ready
       rpcs = self.rpcs
       _logging_debug('Clearing stale EventLoop instance...')
       if current:
@@ -58,35 +65,18 @@ class EventLoop(object):
         _logging_debug('  idlers = %s', idlers)
       if queue:
         _logging_debug('  queue = %s', queue)
+      if ready:
+        _logging_debug('  ready = %s', ready)
       if rpcs:
         _logging_debug('  rpcs = %s', rpcs)
       self.__init__()
       current.clear()
       idlers.clear()
       queue[:] = []
+      ready.clear()
       rpcs.clear()
       _logging_debug('Cleared')
 
-  def insort_event_right(self, event, lo=0, hi=None):
-    """Insert event in queue, and keep it sorted assuming queue is sorted.
-
-    If event is already in queue, insert it to the right of the rightmost
-    event (to keep FIFO order).
-
-    Optional args lo (default 0) and hi (default len(a)) bound the
-    slice of a to be searched.
-    """
-
-    if lo < 0:
-        raise ValueError('lo must be non-negative')
-    if hi is None:
-        hi = len(self.queue)
-    while lo < hi:
-        mid = (lo + hi) // 2
-        if event[0] < self.queue[mid][0]: hi = mid
-        else: lo = mid + 1
-    self.queue.insert(lo, event)
-
   def queue_call(self, delay, callback, *args, **kwds):
     """Schedule a function call at a specific time in the future."""
     if delay is None:
@@ -97,7 +87,13 @@ class EventLoop(object):
     else:
       # Times over a billion seconds are assumed to be absolute.
       when = delay
-    self.insort_event_right((when, callback, args, kwds))
+    event = (when, self.counter.next(), callback, args, kwds)
+    if delay == 0:
+      # Due now, after everything queued before it; skip the heap.
+      # Negative delays go to the heap so they keep their place.
+      self.ready.append(event)
+    else:
+      heapq.heappush(self.queue, event)
 
   def queue_rpc(self, rpc, callback=None, *args, **kwds):
     """Schedule an RPC with an optional callback.
@@ -183,11 +179,21 @@ class EventLoop(object):
     if self.run_idle():
       return 0
     delay = None
-    if self.queue:
-      delay = self.queue[0][0] - time.time()
+    queue = self.queue
+    ready = self.ready
+    if ready or queue:
+      # The earlier of the two heads runs first; the sequence numbers
+      # make sure the callbacks themselves are never compared.
+      if ready and (not queue or ready[0] < queue[0]):
+        event = ready.popleft()
+        delay = 0
+      else:
+        delay = queue[0][0] - time.time()
+        if delay <= 0:
+          event = heapq.heappop(queue)
       if delay <= 0:
         self.inactive = 0
-        _, callback, args, kwds = self.queue.pop(0)
+        _, _, callback, args, kwds = event
         _logging_debug('event: %s', callback.__name__)
         callback(*args, **kwds)
         # TODO: What if it raises an exception?
@@ -31,7 +31,8 @@ class EventLoopTests(test_utils.NDBTest):
     eventloop.queue_call(2, g, 100, 'abc')
     t_after = time.time()
     self.assertEqual(len(self.ev.queue), 3)
-    [(t1, f1, a1, k1), (t2, f2, a2, k2), (t3, f3, a3, k3)] = self.ev.queue
+    [(t1, _, f1, a1, k1), (t2, _, f2, a2, k2),
+     (t3, _, f3, a3, k3)] = sorted(self.ev.queue)
     self.assertTrue(t1 < t2)
     self.assertTrue(t2 < t3)
     self.assertTrue(abs(t1 - (t_before + 1)) <= t_after - t_before)
@@ -60,11 +61,12 @@ class EventLoopTests(test_utils.NDBTest):
     eventloop.queue_call(0, foo, 0)
 
     self.assertEqual(len(self.ev.current), 2)
-    self.assertEqual(len(self.ev.queue), 1)
+    self.assertEqual(len(self.ev.ready), 1)
+    self.assertEqual(len(self.ev.queue), 0)
     [(_f1, a1, _k1), (_f2, a2, _k2)] = self.ev.current
     self.assertEqual(a1, (2,))  # first event should have arg = 2
     self.assertEqual(a2, (1,))  # second event should have arg = 1
-    (_t, _f, a, _k) = self.ev.queue[0]
+    (_t, _s, _f, a, _k) = self.ev.ready[0]
     self.assertEqual(a, (0,))  # third event should have arg = 0
 
     eventloop.run()
@@ -80,6 +82,39 @@ class EventLoopTests(test_utils.NDBTest):
     eventloop.run()
     self.assertEqual(record, ['hello', 42])
 
+  def testFifoOrderForEqualTimes(self):
+    order = []
+    def foo(arg): order.append(arg)
+
+    when = time.time() + 0.05  # An absolute time.
+    for i in range(5):
+      eventloop.queue_call(when, foo, i)
+    eventloop.queue_call(0.01, foo, 'early')
+    eventloop.queue_call(when + 0.01, foo, 'late')
+    eventloop.queue_call(0, foo, 'now')
+    eventloop.run()
+    self.assertEqual(order, ['now', 'early', 0, 1, 2, 3, 4, 'late'])
+
+  def testReadyEventsInterleaveWithDueTimers(self):
+    order = []
+    def foo(arg): order.append(arg)
+
+    past = time.time() - 1  # Absolute times in the past go to the heap.
+    eventloop.queue_call(0, foo, 'ready1')
+    eventloop.queue_call(past, foo, 'past')
+    eventloop.queue_call(0, foo, 'ready2')
+    eventloop.run()
+    self.assertEqual(order, ['past', 'ready1', 'ready2'])
+
+  def testNegativeDelayRunsBeforeZeroDelay(self):
+    order = []
+    def foo(arg): order.append(arg)
+
+    eventloop.queue_call(0, foo, 'zero')
+    eventloop.queue_call(-5, foo, 'negative')
+    eventloop.run()
+    self.assertEqual(order, ['negative', 'zero'])
+
   def testRunWithRpcs(self):
     record = []
     def foo(arg):
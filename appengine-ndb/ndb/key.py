@@ -188,7 +188,10 @@ class Key(object):
   Subclassing Key is best avoided; it would be hard to get right.
   """
 
-  __slots__ = ['__reference', '__pairs', '__app', '__namespace']
+  # __hash and __urlsafe cache the values of hash() and urlsafe(); they
+  # are None until computed.
+  __slots__ = ['__reference', '__pairs', '__app', '__namespace', '__hash',
+               '__urlsafe']
 
   def __new__(cls, *_args, **kwargs):
     """Constructor.  See the class docstring for arguments."""
@@ -213,13 +216,16 @@ class Key(object):
       self.__pairs = None
       self.__app = None
       self.__namespace = None
+      self.__hash = None
     elif 'pairs' in kwargs or 'flat' in kwargs:
       self.__reference = None
       (self.__pairs,
        self.__app,
        self.__namespace) = self._parse_from_args(**kwargs)
+      self.__hash = hash(self.__pairs)
     else:
       raise TypeError('Key() cannot create a Key instance without arguments.')
+    self.__urlsafe = None
     return self
 
   @staticmethod
@@ -254,6 +260,8 @@ class Key(object):
       if not isinstance(kind, str):
           raise TypeError('Key kind must be a string or Model class; '
                           'received %r' % kind)
+      if type(kind) is str:
+        kind = intern(kind)  # There are few kinds but many keys.
       if not id:
         id = None
       pairs[i] = (kind, id)
@@ -316,15 +324,20 @@ class Key(object):
     # doesn't need to return a unique value -- it only needs to ensure
     # that the hashes of equal keys are equal, not the other way
     # around.
-    return hash(tuple(self.pairs()))
+    h = self.__hash
+    if h is None:
+      self.__hash = h = hash(self.pairs())
+    return h
 
   def __eq__(self, other):
     """Equality comparison operation."""
-    # This does not use __tuple() because it is usually enough to
-    # compare pairs(), and we're performance-conscious here.
+    # It is usually enough to compare pairs(), and we're
+    # performance-conscious here.
     if not isinstance(other, Key):
       return NotImplemented
-    return (tuple(self.pairs()) == tuple(other.pairs()) and
+    if self is other:
+      return True
+    return (self.pairs() == other.pairs() and
             self.app() == other.app() and
             self.namespace() == other.namespace())
 
@@ -334,33 +347,39 @@ class Key(object):
       return NotImplemented
     return not self.__eq__(other)
 
-  def __tuple(self):
-    """Helper to return an orderable tuple."""
-    return (self.app(), self.namespace(), self.pairs())
+  def __compare(self, other):
+    """Helper to compare by app, namespace and pairs, like cmp()."""
+    # This avoids building tuples just to compare them.
+    result = cmp(self.app(), other.app())
+    if not result:
+      result = cmp(self.namespace(), other.namespace())
+      if not result:
+        result = cmp(self.pairs(), other.pairs())
+    return result
 
   def __lt__(self, other):
     """Less than ordering."""
     if not isinstance(other, Key):
       return NotImplemented
-    return self.__tuple() < other.__tuple()
+    return self.__compare(other) < 0
 
   def __le__(self, other):
     """Less than or equal ordering."""
     if not isinstance(other, Key):
       return NotImplemented
-    return self.__tuple() <= other.__tuple()
+    return self.__compare(other) <= 0
 
   def __gt__(self, other):
     """Greater than ordering."""
     if not isinstance(other, Key):
       return NotImplemented
-    return self.__tuple() > other.__tuple()
+    return self.__compare(other) > 0
 
   def __ge__(self, other):
     """Greater than or equal ordering."""
     if not isinstance(other, Key):
       return NotImplemented
-    return self.__tuple() >= other.__tuple()
+    return self.__compare(other) >= 0
 
   def __getstate__(self):
     """Private API used for pickling."""
@@ -378,9 +397,11 @@ class Key(object):
       raise TypeError('Key accepts a dict of keyword arguments as state; '
                       'received %r' % kwargs)
     self.__reference = None
-    self.__pairs = kwargs['pairs']
+    self.__pairs = tuple(kwargs['pairs'])
     self.__app = kwargs['app']
     self.__namespace = kwargs['namespace']
+    self.__hash = hash(self.__pairs)
+    self.__urlsafe = None
 
   def __getnewargs__(self):
     """Private API used for pickling."""
@@ -469,7 +490,7 @@ class Key(object):
           id_or_name = elem.name()
         if not id_or_name:
           id_or_name = None
-        tup = (kind, id_or_name)
+        tup = (intern(kind), id_or_name)
         pairs.append(tup)
       self.__pairs = pairs = tuple(pairs)
     return pairs
@@ -517,9 +538,13 @@ class Key(object):
     the strings used to represent Keys in GQL and in the App Engine
     Admin Console.
     """
-    # This is 3-4x faster than urlsafe_b64decode()
-    urlsafe = base64.b64encode(self.reference().Encode())
-    return urlsafe.rstrip('=').replace('+', '-').replace('/', '_')
+    urlsafe = self.__urlsafe
+    if urlsafe is None:
+      # This is 3-4x faster than urlsafe_b64decode()
+      urlsafe = base64.b64encode(self.reference().Encode())
+      urlsafe = urlsafe.rstrip('=').replace('+', '-').replace('/', '_')
+      self.__urlsafe = urlsafe
+    return urlsafe
 
   # Datastore API using the default context.
   # These use local import since otherwise they'd be recursive imports.
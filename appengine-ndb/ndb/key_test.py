@@ -217,6 +217,23 @@ class KeyTests(test_utils.NDBTest):
     pairs = [(flat[i], flat[i + 1]) for i in xrange(0, len(flat), 2)]
     k = key.Key(flat=flat)
     self.assertEqual(hash(k), hash(tuple(pairs)))
+    # The hash is the same for a Key decoded from a Reference.
+    kk = key.Key(reference=k.reference())
+    self.assertEqual(hash(kk), hash(k))
+    self.assertEqual(kk, k)
+
+  def testCachedUrlsafe(self):
+    k = key.Key('Kind', 1, 'Subkind', 'foobar')
+    urlsafe = k.urlsafe()
+    self.assertTrue(k.urlsafe() is urlsafe)
+    self.assertEqual(key.Key(urlsafe=urlsafe), k)
+
+  def testInternedKind(self):
+    a = key.Key(''.join(['Ki', 'nd']), 1)
+    b = key.Key(u'Kind', 2)
+    self.assertTrue(a.kind() is b.kind())
+    c = key.Key(reference=a.reference())
+    self.assertTrue(c.pairs()[0][0] is a.kind())
 
   def testOrdering(self):
     a = key.Key(app='app2', namespace='ns2', flat=('kind1', 1))
@@ -1296,6 +1296,32 @@ class Property(ModelAttribute):
       value = val
     self._store_value(entity, value)
 
+  def _get_serializer(self):
+    """Return a function serializing this property, for _to_pb().
+
+    This is called by _fix_up_properties() to build the serialization
+    plan of the Model subclass.  The function is called with (entity,
+    pb) arguments.  The default is self._serialize; unrepeated simple
+    scalar properties get a specialized function instead.
+    """
+    if (self._repeated or
+        self.__class__ not in _SCALAR_PROPERTY_CLASSES or
+        getattr(self, '_compressed', False)):
+      return self._serialize
+    return _make_scalar_serializer(self)
+
+  def _get_deserializer(self):
+    """Return a function deserializing this property, for _from_pb().
+
+    This is the counterpart of _get_serializer().  The function is
+    called with (entity, p) arguments.  The default is
+    self._deserialize; unrepeated simple scalar properties get a
+    specialized function instead.
+    """
+    if self._repeated or self.__class__ not in _SCALAR_PROPERTY_CLASSES:
+      return self._deserialize
+    return _make_scalar_deserializer(self)
+
   def _prepare_for_put(self, entity):
     pass
 
@@ -1309,6 +1335,56 @@ class Property(ModelAttribute):
     return self._get_value(entity)
 
 
+def _make_scalar_serializer(prop):
+  """Internal helper to serialize an unrepeated scalar property.
+
+  This does the same as Property._serialize(), but only handles a
+  single value and looks up the property's attributes only once.
+  """
+  name = prop._name
+  default = prop._default
+  indexed = prop._indexed
+  call_to_base_type = prop._call_to_base_type
+  db_set_value = prop._db_set_value
+
+  def serialize(entity, pb):
+    values = entity._values
+    value = values.get(name, default)
+    if value is not None and not isinstance(value, _BaseValue):
+      # Store the base value back, as _get_base_value() does.
+      value = values[name] = _BaseValue(call_to_base_type(value))
+    if indexed:
+      p = pb.add_property()
+    else:
+      p = pb.add_raw_property()
+    p.set_name(name)
+    p.set_multiple(False)
+    v = p.mutable_value()
+    if value is not None:
+      db_set_value(v, p, value.b_val)
+
+  return serialize
+
+
+def _make_scalar_deserializer(prop):
+  """Internal helper to deserialize an unrepeated scalar property.
+
+  This does the same as Property._deserialize() for a single value.
+  Only the base value is stored; as usual, the user value (e.g. the
+  unicode of a TextProperty) is computed when it is first read.
+  """
+  name = prop._name
+  db_get_value = prop._db_get_value
+
+  def deserialize(entity, p):
+    val = db_get_value(p.value(), p)
+    if val is not None:
+      val = _BaseValue(val)
+    entity._values[name] = val
+
+  return deserialize
+
+
 def _validate_key(value, entity=None):
   if not isinstance(value, Key):
     # TODO: BadKeyError.
@@ -1569,6 +1645,12 @@ class StringProperty(TextProperty):
   _indexed = True
 
 
+# Property classes (not subclasses) that get a specialized serializer.
+_SCALAR_PROPERTY_CLASSES = frozenset([BooleanProperty, IntegerProperty,
+                                      FloatProperty, TextProperty,
+                                      StringProperty])
+
+
 class GeoPtProperty(Property):
   """A Property whose value is a GeoPt."""
 
@@ -2541,6 +2623,8 @@ class Model(_NotEqualMixin):
 
   # Class variables updated by _fix_up_properties()
   _properties = None
+  _serialization_plan = None  # (properties dict, tuple of serializers)
+  _deserialization_plan = None  # (properties dict, {name: deserializer})
   _has_repeated = False
   _kind_map = {}  # Dict mapping {kind: Model subclass}
 
@@ -2767,8 +2851,14 @@ class Model(_NotEqualMixin):
       # TODO: Move the key stuff into ModelAdapter.entity_to_pb()?
       self._key_to_pb(pb)
 
-    for unused_name, prop in sorted(self._properties.iteritems()):
-      prop._serialize(self, pb)
+    plan = self._serialization_plan
+    if plan is not None and plan[0] is self._properties:
+      for serialize in plan[1]:
+        serialize(self, pb)
+    else:
+      # Dynamic properties (or no plan); use the generic path.
+      for unused_name, prop in sorted(self._properties.iteritems()):
+        prop._serialize(self, pb)
 
     return pb
 
@@ -2804,6 +2894,11 @@ class Model(_NotEqualMixin):
     if key is not None and (set_key or key.id() or key.parent()):
       ent._key = key
 
+    plan = cls._deserialization_plan
+    if plan is not None and plan[0] is ent._properties:
+      cls._from_pb_fast(pb, ent, plan[1])
+      return ent
+
     indexed_properties = pb.property_list()
     unindexed_properties = pb.raw_property_list()
     projection = []
@@ -2817,6 +2912,33 @@ class Model(_NotEqualMixin):
     ent._set_projection(projection)
     return ent
 
+  @staticmethod
+  def _from_pb_fast(pb, ent, deserializers):
+    """Internal helper for _from_pb() using a deserialization plan.
+
+    Names missing from the plan (dynamic properties, or values left
+    over from a schema change) fall back to _get_property_for().  The
+    projection is only set if a projected value is seen.
+    """
+    projection = None
+    for plist, indexed in ((pb.property_list(), True),
+                           (pb.raw_property_list(), False)):
+      for p in plist:
+        name = p.name()
+        if p.meaning() == entity_pb.Property.INDEX_VALUE:
+          if projection is None:
+            projection = []
+          projection.append(name)
+        deserialize = deserializers.get(name)
+        if deserialize is None:
+          ent._get_property_for(p, indexed)._deserialize(ent, p)
+        else:
+          deserialize(ent, p)
+    if projection is not None:
+      ent._set_projection(projection)
+    elif ent._projection:
+      ent._projection = ()
+
   def _set_projection(self, projection):
     self._projection = tuple(projection)
     by_prefix = {}
@@ -2922,6 +3044,8 @@ class Model(_NotEqualMixin):
                         'a Unicode string (%r); please encode using utf-8' %
                         (cls.__name__, kind))
     cls._properties = {}  # Map of {name: Property}
+    cls._serialization_plan = None
+    cls._deserialization_plan = None
     if cls.__module__ == __name__:  # Skip the classes in *this* file.
       return
     for name in set(dir(cls)):
@@ -2939,6 +3063,30 @@ class Model(_NotEqualMixin):
             cls._has_repeated = True
           cls._properties[attr._name] = attr
     cls._update_kind_map()
+    cls._update_serialization_plan()
+
+  @classmethod
+  def _update_serialization_plan(cls):
+    """Precompute how _to_pb() and _from_pb() handle this class.
+
+    The serialization plan pairs the class's properties dict with the
+    properties' serializers in name order; _to_pb() uses it only while
+    an entity still shares that dict, i.e. has no dynamic properties
+    of its own.  The deserialization plan maps property names to
+    deserializers the same way; it is left unset for classes with
+    structured properties, whose dotted names need _get_property_for().
+    """
+    props = cls._properties
+    cls._serialization_plan = (
+      props,
+      tuple(prop._get_serializer() for _, prop in sorted(props.iteritems())))
+    for prop in props.itervalues():
+      if isinstance(prop, StructuredProperty):
+        return
+    cls._deserialization_plan = (
+      props,
+      dict((name, prop._get_deserializer())
+           for name, prop in props.iteritems()))
 
   @classmethod
   def _update_kind_map(cls):
@@ -3452,7 +3600,57 @@ def get_multi_async(keys, **ctx_options):
   Returns:
     A list of futures.
   """
-  return [key.get_async(**ctx_options) for key in keys]
+  keys = list(keys)
+  if len(keys) <= 1 or _has_get_hooks(keys):
+    # Hooks expect each key's Future to complete on its own.
+    return [key.get_async(**ctx_options) for key in keys]
+  # Fetch all keys with a single Context.get_multi() call, and hand
+  # out a Future per key.
+  from . import tasklets
+  mfut = tasklets.get_context().get_multi(keys, **ctx_options)
+  futures = [tasklets.Future() for _ in keys]
+  mfut.add_immediate_callback(_set_multi_results, mfut, keys, futures,
+                              ctx_options)
+  return futures
+
+
+def _has_get_hooks(keys):
+  """Internal helper to tell whether any key's model class has get hooks."""
+  for kind in set(key.kind() for key in keys):
+    cls = Model._kind_map.get(kind)
+    if cls is not None and not (
+        cls._is_default_hook(Model._default_pre_get_hook,
+                             cls._pre_get_hook) and
+        cls._is_default_hook(Model._default_post_get_hook,
+                             cls._post_get_hook)):
+      return True
+  return False
+
+
+def _set_multi_results(mfut, keys, futures, ctx_options):
+  """Internal helper to pass the results of a multi-get to its Futures.
+
+  Each Future is completed by its own event loop callback.  If the
+  multi-get failed, every key is fetched again on its own, so that only
+  the Futures of the keys that fail get an exception.
+  """
+  from . import eventloop
+  if mfut.get_exception() is not None:
+    for key, fut in zip(keys, futures):
+      source = key.get_async(**ctx_options)
+      source.add_immediate_callback(_copy_result, fut, source)
+  else:
+    for fut, entity in zip(futures, mfut.get_result()):
+      eventloop.queue_call(None, fut.set_result, entity)
+
+
+def _copy_result(fut, source):
+  """Internal helper to pass the outcome of Future source on to fut."""
+  exc = source.get_exception()
+  if exc is not None:
+    fut.set_exception(exc, source.get_traceback())
+  else:
+    fut.set_result(source.get_result())
 
 
 def get_multi(keys, **ctx_options):
@@ -896,6 +896,92 @@ class ModelTests(test_utils.NDBTest):
     self.assertTrue(MyModel.a._has_value(m))
     self.assertTrue(MyModel.b._has_value(m))
 
+  def testSerializationPlan(self):
+    class MyModel(model.Model):
+      b = model.BooleanProperty()
+      i = model.IntegerProperty(default=42)
+      f = model.FloatProperty()
+      s = model.StringProperty()
+      t = model.TextProperty()
+      z = model.TextProperty(compressed=True)
+      r = model.IntegerProperty(repeated=True)
+      k = model.KeyProperty()
+    props, serializers = MyModel._serialization_plan
+    self.assertTrue(props is MyModel._properties)
+    # Specialized serializers are plain functions; the others are
+    # bound _serialize() methods.
+    specialized = [not hasattr(ser, 'im_self') for ser in serializers]
+    self.assertEqual(specialized,
+                     [True, True, True, False, False, True, True, False])
+
+    def generic_to_pb(ent):
+      pb = entity_pb.EntityProto()
+      ent._key_to_pb(pb)
+      for _, prop in sorted(ent._properties.iteritems()):
+        prop._serialize(ent, pb)
+      return pb
+
+    key = model.Key('MyModel', 1)
+    for kwds in [{},
+                 dict(b=True, f=1.5, s='abc', t=u'\u1234', z='z' * 100,
+                      r=[1, 2], k=key),
+                 dict(b=False, i=None, s=u'', f=None)]:
+      ent = MyModel(key=key, **kwds)
+      pb = ent._to_pb()
+      self.assertEqual(pb, generic_to_pb(MyModel(key=key, **kwds)))
+      self.assertEqual(MyModel._from_pb(pb), ent)
+
+    # An entity with dynamic properties uses the generic path.
+    class MyExpando(model.Expando):
+      a = model.IntegerProperty()
+    ent = MyExpando(a=1, b=2)
+    self.assertFalse(ent._properties is MyExpando._serialization_plan[0])
+    self.assertEqual(ent._to_pb(), generic_to_pb(ent))
+    self.assertEqual(MyExpando._from_pb(ent._to_pb()), ent)
+
+  def testDeserializationPlan(self):
+    class MyModel(model.Model):
+      i = model.IntegerProperty()
+      t = model.TextProperty()
+      z = model.TextProperty(compressed=True)
+      r = model.IntegerProperty(repeated=True)
+    props, deserializers = MyModel._deserialization_plan
+    self.assertTrue(props is MyModel._properties)
+    self.assertEqual(sorted(deserializers), ['i', 'r', 't', 'z'])
+
+    ent = MyModel(i=1, t=u'\u1234', z='z' * 100, r=[1, 2])
+    pb = ent._to_pb()
+    # Add a value no longer in the schema; it gets a fake property.
+    p = pb.add_raw_property()
+    p.set_name('gone')
+    p.set_multiple(False)
+    p.mutable_value().set_int64value(3)
+    ent2 = MyModel._from_pb(pb)
+    self.assertEqual(ent2._projection, ())
+    # The text is kept as a UTF-8 string until it is first read.
+    self.assertEqual(ent2._values['t'], model._BaseValue('\xe1\x88\xb4'))
+    self.assertEqual(ent2.t, u'\u1234')
+    self.assertEqual(ent2.z, 'z' * 100)
+    self.assertEqual(ent2.r, [1, 2])
+    self.assertEqual(ent2._properties['gone']._get_value(ent2), 3)
+
+    # Projected values set the projection.
+    pb = entity_pb.EntityProto()
+    p = pb.add_property()
+    p.set_name('i')
+    p.set_meaning(entity_pb.Property.INDEX_VALUE)
+    p.mutable_value().set_int64value(1)
+    ent3 = MyModel._from_pb(pb)
+    self.assertEqual(ent3._projection, ('i',))
+    self.assertEqual(ent3.i, 1)
+
+    # Classes with structured properties use the generic path.
+    class Outer(model.Model):
+      inner = model.StructuredProperty(MyModel)
+    self.assertEqual(Outer._deserialization_plan, None)
+    ent = Outer(inner=MyModel(i=1))
+    self.assertEqual(Outer._from_pb(ent._to_pb()), ent)
+
   def testComparingExplicitAndImplicitValue(self):
     class MyModel(model.Model):
       a = model.StringProperty(default='a')
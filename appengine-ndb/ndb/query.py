@@ -120,6 +120,10 @@ in a tasklet, properly yielding when appropriate:
   while (yield it.has_next_async()):
     emp = it.next()
     print emp.name, emp.age
+
+To process large result sets a batch at a time, use q.iter_batches()
+instead; its next() returns a list with the results of one batch, and
+the next batch is fetched while the current one is processed.
 """
 
 from __future__ import with_statement
@@ -127,6 +131,7 @@ del with_statement  # No need to export this.
 
 __author__ = 'guido@google.com (Guido van Rossum)'
 
+import collections
 import datetime
 import heapq
 import itertools
@@ -142,7 +147,8 @@ from . import context
 from . import tasklets
 from . import utils
 
-__all__ = ['Query', 'QueryOptions', 'Cursor', 'QueryIterator',
+__all__ = ['Query', 'QueryOptions', 'Cursor', 'MultiQueryCursor',
+           'QueryIterator', 'QueryBatchIterator',
            'RepeatedStructuredPropertyPredicate',
            'AND', 'OR', 'ConjunctionNode', 'DisjunctionNode',
            'FilterNode', 'PostFilterNode', 'FalseNode', 'Node',
@@ -1035,6 +1041,18 @@ class Query(object):
 
   __iter__ = iter
 
+  def iter_batches(self, **q_options):
+    """Construct an iterator over the query's result batches.
+
+    Args:
+      **q_options: All query options keyword arguments are supported.
+
+    Returns:
+      A QueryBatchIterator object.
+    """
+    self.bind()  #  Raises an exception if there are unbound parameters.
+    return QueryBatchIterator(self, **q_options)
+
   @utils.positional(2)
   def map(self, callback, pass_batch_into_callback=None,
           merge_future=None, **q_options):
@@ -1516,15 +1534,14 @@ class QueryIterator(object):
   def _extended_callback(self, batch, index, ent):
     if self._exhausted:
       raise RuntimeError('QueryIterator is already exhausted')
-    # TODO: Make _lookup a deque.
     if self._lookahead is None:
-      self._lookahead = []
+      self._lookahead = collections.deque()
     self._lookahead.append((batch, index))
     return ent
 
   def _consume_item(self):
     if self._lookahead:
-      self._batch, self._index = self._lookahead.pop(0)
+      self._batch, self._index = self._lookahead.popleft()
     else:
       self._batch = self._index = None
 
@@ -1651,6 +1668,121 @@ class QueryIterator(object):
       self._fut = None
 
 
+class QueryBatchIterator(object):
+  """An iterator over whole batches of query results.
+
+  For synchronous callers:
+
+    for accounts in Account.query().iter_batches(batch_size=500):
+      <use the list of accounts>
+
+  Async callers use this idiom:
+
+    it = Account.query().iter_batches(batch_size=500)
+    while (yield it.has_next_async()):
+      accounts = it.next()
+      <use the list of accounts>
+
+  Each it.next() returns the list of entities (or keys, when keys_only
+  is set) of one datastore batch.  The RPC for the next batch is sent
+  as soon as a batch arrives, so it runs while the caller processes
+  the current one.  Results don't go through a Future each, but they
+  do update the context cache like those of QueryIterator.
+
+  When produce_cursors is set, it.cursor_after() returns the cursor
+  after the last batch returned by it.next(); it can be used as
+  start_cursor to resume the scan later.  Before it.next() is called
+  for the first time, or if produce_cursors is not set, it raises an
+  exception.
+
+  Queries requiring in-memory merging of multiple queries (i.e.
+  queries using the IN, != or OR operators) are not supported.
+  """
+
+  _batch = None  # The last batch returned by next().
+
+  @utils.positional(2)
+  def __init__(self, query, **q_options):
+    """Constructor.  Takes a Query and query options.
+
+    This is normally called by Query.iter_batches().  It sends the RPC
+    for the first batch.
+    """
+    if query._needs_multi_query():
+      raise NotImplementedError('Query.iter_batches() does not support '
+                                'IN, != or OR filters.')
+    self._ctx = ctx = tasklets.get_context()
+    self._options = query._make_options(q_options)
+    self._rpc = query._get_query(ctx._conn).run_async(ctx._conn,
+                                                      self._options)
+    self._fut = None
+
+  @tasklets.tasklet
+  def _next_batch(self):
+    """Wait for the next non-empty batch and send the RPC for the one after.
+
+    The Future's result is a tuple (batch, results), or None at the end.
+    """
+    options = self._options
+    update_cache = self._ctx._update_cache_from_query_result
+    while self._rpc is not None:
+      batch = yield self._rpc
+      self._rpc = batch.next_batch_async(options)
+      if not batch.results:
+        continue
+      results = []
+      for result in batch.results:
+        result = update_cache(result, options)
+        if result is not None:
+          results.append(result)
+      raise tasklets.Return(batch, results)
+    raise tasklets.Return(None)
+
+  def cursor_after(self):
+    """Return the cursor after the last batch returned by next().
+
+    You must pass produce_cursors=True for this to work.
+
+    If there is no cursor or no batch has been returned yet, raise
+    BadArgumentError.
+    """
+    if self._batch is None:
+      raise datastore_errors.BadArgumentError('There is no cursor currently')
+    return self._batch.cursor(len(self._batch.results))
+
+  def __iter__(self):
+    """Iterator protocol: get the iterator for this iterator, i.e. self."""
+    return self
+
+  def has_next(self):
+    """Return whether a next batch is available."""
+    return self.has_next_async().get_result()
+
+  @tasklets.tasklet
+  def has_next_async(self):
+    """Return a Future whose result will say whether a next batch is available.
+
+    See the class docstring for the usage pattern.
+    """
+    if self._fut is None:
+      self._fut = self._next_batch()
+    item = yield self._fut
+    raise tasklets.Return(item is not None)
+
+  def next(self):
+    """Iterator protocol: get the next batch's results or StopIteration."""
+    if self._fut is None:
+      self._fut = self._next_batch()
+    try:
+      item = self._fut.get_result()
+    finally:
+      self._fut = None
+    if item is None:
+      raise StopIteration
+    self._batch, results = item
+    return results
+
+
 class _SubQueryIteratorState(object):
   """Helper class for _MultiQuery."""
 
@@ -1692,6 +1824,90 @@ class _SubQueryIteratorState(object):
     return self.orders._cmp(lhs_value_map, rhs_value_map)
 
 
+class MultiQueryCursor(Cursor):
+  """A cursor for a query using the IN, != or OR operators.
+
+  Such a query is run as several subqueries whose results are merged.
+  A MultiQueryCursor holds a cursor for each subquery, or None for a
+  subquery without further results.  It can be passed as start_cursor
+  or end_cursor to the same query, and converted to and from a websafe
+  string using to_websafe_string() and
+  MultiQueryCursor.from_websafe_string().
+
+  If the query's order includes a repeated property, an entity matched
+  by several subqueries may be returned again by a query resumed from a
+  MultiQueryCursor; the cursor does not record which entities were
+  already returned.  Ordering by the key and unrepeated properties only
+  avoids this.
+  """
+
+  _PREFIX = 'multi.'
+  _SEPARATOR = '.'  # Does not occur in websafe cursors.
+  _NONE = '~'  # Ditto.
+
+  def __init__(self, cursors):
+    super(MultiQueryCursor, self).__init__()
+    self._cursors = tuple(cursors)
+
+  @property
+  def cursors(self):
+    return self._cursors
+
+  def __repr__(self):
+    return '%s(%r)' % (self.__class__.__name__, list(self._cursors))
+
+  def __eq__(self, other):
+    if not isinstance(other, MultiQueryCursor):
+      return NotImplemented
+    return self._cursors == other._cursors
+
+  def __ne__(self, other):
+    eq = self.__eq__(other)
+    if eq is not NotImplemented:
+      eq = not eq
+    return eq
+
+  def __hash__(self):
+    return hash(self._cursors)
+
+  def to_websafe_string(self):
+    return self._PREFIX + self._SEPARATOR.join(
+      self._NONE if cursor is None else cursor.to_websafe_string()
+      for cursor in self._cursors)
+
+  urlsafe = to_websafe_string
+
+  @classmethod
+  def from_websafe_string(cls, websafe):
+    """Return the cursor for a websafe string.
+
+    For convenience this also accepts the websafe strings of plain
+    Cursors, returning a Cursor.
+    """
+    if not websafe.startswith(cls._PREFIX):
+      return Cursor.from_websafe_string(websafe)
+    parts = websafe[len(cls._PREFIX):].split(cls._SEPARATOR)
+    return cls([None if part == cls._NONE else
+                Cursor.from_websafe_string(part)
+                for part in parts])
+
+
+class _MultiQueryBatch(object):
+  """Helper class for _MultiQuery: a Batch producing MultiQueryCursors.
+
+  QueryIterator calls cursor(0) for the position before a result and
+  cursor(1) for the position after it.
+  """
+
+  def __init__(self, before, after, more_results):
+    self._positions = (before, after)  # Lists of (batch, index) or None.
+    self.more_results = more_results
+
+  def cursor(self, index):
+    return MultiQueryCursor([None if pos is None else pos[0].cursor(pos[1])
+                             for pos in self._positions[index]])
+
+
 class _MultiQuery(object):
   """Helper class to run queries involving !=, IN or OR operators."""
 
@@ -1706,6 +1922,10 @@ class _MultiQuery(object):
   # are identical except one has an ancestor and the other doesn't.
   # The HR datastore makes that a useful special case.
 
+  # How many subqueries of an unordered multi-query run ahead of the
+  # one whose results are being passed on.
+  _UNORDERED_LOOKAHEAD = 1
+
   def __init__(self, subqueries):
     if not isinstance(subqueries, list):
       raise TypeError('subqueries must be a list; received %r' % subqueries)
@@ -1741,6 +1961,55 @@ class _MultiQuery(object):
   def default_options(self):
     return self.__subqueries[0].default_options
 
+  def _get_subquery_options(self, options):
+    """Internal helper to return the options for each subquery.
+
+    A MultiQueryCursor passed as start_cursor or end_cursor is split
+    into the cursors of the subqueries.  A subquery that the start
+    cursor says is exhausted gets False instead of options.
+    """
+    count = len(self.__subqueries)
+    result = [options] * count
+    if options is None:
+      return result
+    for name in 'start_cursor', 'end_cursor':
+      cursor = getattr(options, name)
+      if not isinstance(cursor, MultiQueryCursor):
+        continue
+      if len(cursor.cursors) != count:
+        raise datastore_errors.BadArgumentError(
+          '%s does not belong to this query' % name)
+      for i, subcursor in enumerate(cursor.cursors):
+        if result[i] is False:
+          continue
+        if subcursor is None and name == 'start_cursor':
+          result[i] = False
+        else:
+          # For end_cursor, None clears the MultiQueryCursor.
+          result[i] = QueryOptions(config=result[i], **{name: subcursor})
+    return result
+
+  def _has_adjacent_duplicates(self):
+    """Internal helper to tell whether duplicates are merged together.
+
+    This is the case if the order includes the key and only unrepeated
+    properties, so that all copies of an entity compare equal.
+    """
+    if self.__orders is None:
+      return False
+    names = self.__orders._get_prop_names()
+    if _KEY not in names:
+      return False
+    modelclass = model.Model._kind_map.get(self.__subqueries[0].kind)
+    if modelclass is None:
+      return False
+    for name in names:
+      if name != _KEY:
+        prop = modelclass._properties.get(name)
+        if prop is None or prop._repeated:
+          return False
+    return True
+
   @tasklets.tasklet
   def run_to_queue(self, queue, conn, options=None):
     """Run this query, putting entities into the given queue."""
@@ -1749,11 +2018,13 @@ class _MultiQuery(object):
       offset = None
       limit = None
       keys_only = None
+      produce_cursors = None
     else:
       # Capture options we need to simulate.
       offset = options.offset
       limit = options.limit
       keys_only = options.keys_only
+      produce_cursors = options.produce_cursors
 
       # Cursors are supported for certain orders only.
       if (options.start_cursor or options.end_cursor or
@@ -1772,11 +2043,15 @@ class _MultiQuery(object):
     # We can set the limit we pass along to offset + limit though,
     # since that is the maximum number of results from a single
     # subquery we will ever have to consider.
+    # When producing cursors, each subquery is asked for one more result
+    # than that, so that one which runs out before the merge is done
+    # really is exhausted and can be recorded as None in the cursor.
     modifiers = {}
     if offset:
       modifiers['offset'] = None
-      if limit is not None:
-        modifiers['limit'] = min(_MAX_LIMIT, offset + limit)
+    if limit is not None and (offset or produce_cursors):
+      extra = 1 if produce_cursors else 0
+      modifiers['limit'] = min(_MAX_LIMIT, (offset or 0) + limit + extra)
     if keys_only and self.__orders is not None:
       modifiers['keys_only'] = None
     if modifiers:
@@ -1788,14 +2063,35 @@ class _MultiQuery(object):
     if limit is None:
       limit = _MAX_LIMIT
 
+    subqueries = self.__subqueries
+    pending = [(number, subq_options)
+               for number, subq_options
+               in enumerate(self._get_subquery_options(options))
+               if subq_options is not False]
+
+    def start(number, subq_options):
+      subq = subqueries[number]
+      dsquery = None
+      if self.__orders is not None:
+        dsquery = subq._get_query(conn)
+      subit = tasklets.SerialQueueFuture('_MultiQuery.run_to_queue')
+      subq.run_to_queue(subit, conn, options=subq_options, dsquery=dsquery)
+      return number, subit, dsquery
+
     if self.__orders is None:
-      # Run the subqueries sequentially; there is no order to keep.
+      # There is no order to keep; pass on the results of each subquery
+      # in turn.  Only a few subqueries are started ahead of the one
+      # being read, so that their first batches are fetched concurrently
+      # without every subquery buffering its results.  Once the limit is
+      # reached no more subqueries are started.
       keys_seen = set()
-      for subq in self.__subqueries:
-        if limit <= 0:
+      running = collections.deque()
+      while limit > 0:
+        while pending and len(running) <= self._UNORDERED_LOOKAHEAD:
+          running.append(start(*pending.pop(0)))
+        if not running:
           break
-        subit = tasklets.SerialQueueFuture('_MultiQuery.run_to_queue[ser]')
-        subq.run_to_queue(subit, conn, options=options)
+        unused_number, subit, unused_dsquery = running.popleft()
         while limit > 0:
           try:
             batch, index, result = yield subit.getq()
@@ -1815,28 +2111,28 @@ class _MultiQuery(object):
       queue.complete()
       return
 
+    # Start running all the subqueries, so their first batches are
+    # fetched concurrently; the merge needs the head of each of them.
+    todo = [start(*args) for args in pending]
+
     # This with-statement causes the adapter to set _orig_pb on all
     # entities it converts from protobuf.
     # TODO: Does this interact properly with the cache?
     with conn.adapter:
-      # Start running all the sub-queries.
-      todo = []  # List of (subit, dsquery) tuples.
-      for subq in self.__subqueries:
-        dsquery = subq._get_query(conn)
-        subit = tasklets.SerialQueueFuture('_MultiQuery.run_to_queue[par]')
-        subq.run_to_queue(subit, conn, options=options, dsquery=dsquery)
-        todo.append((subit, dsquery))
-
-      # Create a list of (first-entity, subquery-iterator) tuples.
+      # Create a list of (first-entity, subquery-iterator) states, and
+      # a list of each subquery's (batch, index) position.
       state = []  # List of _SubQueryIteratorState instances.
-      for subit, dsquery in todo:
+      frontier = [None] * len(subqueries)
+      for number, subit, dsquery in todo:
         try:
           thing = yield subit.getq()
         except EOFError:
           continue
         else:
-          state.append(_SubQueryIteratorState(thing, subit, dsquery,
-                                              self.__orders))
+          item = _SubQueryIteratorState(thing, subit, dsquery, self.__orders)
+          item.number = number
+          frontier[number] = (item.batch, item.index)
+          state.append(item)
 
       # Now turn it into a sorted heap.  The heapq module claims that
       # calling heapify() is more efficient than calling heappush() for
@@ -1845,40 +2141,60 @@ class _MultiQuery(object):
 
       # Repeatedly yield the lowest entity from the state vector,
       # filtering duplicates.  This is essentially a multi-way merge
-      # sort.  One would think it should be possible to filter
-      # duplicates simply by dropping other entities already in the
-      # state vector that are equal to the lowest entity, but because of
-      # the weird sorting of repeated properties, we have to explicitly
-      # keep a set of all keys, so we can remove later occurrences.
+      # sort.  If the order makes all copies of an entity equal, they
+      # come out of the heap one after another and it suffices to
+      # compare with the previous key.  Otherwise, because of the weird
+      # sorting of repeated properties, we have to explicitly keep a
+      # set of all keys, so we can remove later occurrences.  That set
+      # is not part of a MultiQueryCursor, so a query resumed from one
+      # may return an entity again that an earlier page already had.
       # Note that entities will still be sorted correctly, within the
       # constraints given by the sort order.
-      keys_seen = set()
+      keys_seen = None
+      if not self._has_adjacent_duplicates():
+        keys_seen = set()
+      last_key = None
+      # The subqueries' positions after the last entity handled.
+      position = list(frontier)
       while state and limit > 0:
         item = heapq.heappop(state)
-        batch = item.batch
-        index = item.index
         entity = item.entity
         key = entity._key
-        if key not in keys_seen:
-          keys_seen.add(key)
-          if offset > 0:
-            offset -= 1
-          else:
-            limit -= 1
-            if keys_only:
-              queue.putq((batch, index, key))
-            else:
-              queue.putq((batch, index, entity))
         subit = item.iterator
         try:
-          batch, index, entity = yield subit.getq()
+          item.batch, item.index, item.entity = yield subit.getq()
         except EOFError:
-          pass
+          frontier[item.number] = None
         else:
-          item.batch = batch
-          item.index = index
-          item.entity = entity
+          frontier[item.number] = (item.batch, item.index)
           heapq.heappush(state, item)
+        if produce_cursors:
+          before = position
+          position = list(frontier)
+          # Skip the copies of this entity waiting in other subqueries.
+          for other in state:
+            if other.entity._key == key:
+              position[other.number] = (other.batch, other.index + 1)
+        if keys_seen is None:
+          if key == last_key:
+            continue
+          last_key = key
+        elif key in keys_seen:
+          continue
+        else:
+          keys_seen.add(key)
+        if offset > 0:
+          offset -= 1
+          continue
+        limit -= 1
+        batch = index = None
+        if produce_cursors:
+          batch = _MultiQueryBatch(before, position, bool(state) and limit > 0)
+          index = 0
+        if keys_only:
+          queue.putq((batch, index, key))
+        else:
+          queue.putq((batch, index, entity))
       queue.complete()
 
   # Datastore API using the default context.
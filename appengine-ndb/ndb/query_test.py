@@ -788,6 +788,32 @@ class QueryTests(test_utils.NDBTest):
     self.assertEqual(cursors[3], cursors[4])
     # TODO: Assert that only one RPC call was made.
 
+  def testIterBatches(self):
+    q = query.Query(kind='Foo').order(Foo.name)
+    it = q.iter_batches(batch_size=2, produce_cursors=True)
+    self.assertRaises(datastore_errors.BadArgumentError, it.cursor_after)
+    self.assertEqual(it.next(), [self.jill, self.joe])
+    cursor = it.cursor_after()
+    self.assertEqual(it.next(), [self.moe])
+    self.assertRaises(StopIteration, it.next)
+    # Resume after the first batch.
+    self.assertEqual(list(q.iter_batches(start_cursor=cursor)), [[self.moe]])
+    self.assertEqual(list(q.iter_batches(keys_only=True)),
+                     [[self.jill.key, self.joe.key, self.moe.key]])
+    qq = query.Query(kind='Foo').filter(Foo.tags.IN(['jill', 'joe']))
+    self.assertRaises(NotImplementedError, qq.iter_batches)
+
+  def testIterBatchesAsync(self):
+    q = query.Query(kind='Foo').order(Foo.name)
+    @tasklets.synctasklet
+    def foo():
+      it = q.iter_batches(batch_size=2)
+      res = []
+      while (yield it.has_next_async()):
+        res.append(it.next())
+      self.assertEqual(res, [[self.jill, self.joe], [self.moe]])
+    foo()
+
   def create_index(self):
     ci = datastore_stub_util.datastore_pb.CompositeIndex()
     ci.set_app_id(os.environ['APPLICATION_ID'])
@@ -1014,6 +1040,22 @@ class QueryTests(test_utils.NDBTest):
     self.assertEqual(q.fetch(1, offset=1), expected[1:])
     self.assertEqual(q.fetch(10, keys_only=True), [e._key for e in expected])
 
+  def testMultiQueryUnorderedLimit(self):
+    started = []
+    orig_run_to_queue = query.Query.__dict__['run_to_queue']
+    def run_to_queue(q, *args, **kwds):
+      if 'dsquery' in kwds:  # Only count subqueries.
+        started.append(q)
+      return orig_run_to_queue(q, *args, **kwds)
+    query.Query.run_to_queue = run_to_queue
+    try:
+      q = Foo.query(Foo.tags.IN(['joe', 'jill', 'jack', 'hello']))
+      self.assertEqual(q.fetch(1), [self.joe])
+    finally:
+      query.Query.run_to_queue = orig_run_to_queue
+    # The subquery read and one ahead of it; the rest never start.
+    self.assertEqual(len(started), 1 + query._MultiQuery._UNORDERED_LOOKAHEAD)
+
   def testMultiQueryCount(self):
     q = Foo.query(Foo.tags.IN(['joe', 'jill'])).order(Foo.name)
     self.assertEqual(q.count(10), 2)
@@ -1054,6 +1096,46 @@ class QueryTests(test_utils.NDBTest):
     self.assertTrue(curs is None)
     self.assertFalse(more)
 
+  def testMultiQueryCursorsWithDuplicates(self):
+    q = Foo.query(query.OR(Foo.rate == 1, Foo.name == 'joe')).order(Foo.key)
+    self.assertTrue(q._maybe_multi_query()._has_adjacent_duplicates())
+    self.assertEqual(q.fetch(), [self.joe, self.moe])
+    res, curs, more = q.fetch_page(1)
+    self.assertEqual(res, [self.joe])
+    self.assertTrue(isinstance(curs, query.MultiQueryCursor))
+    self.assertTrue(more)
+    # The cursor survives a round trip through a websafe string.
+    websafe = curs.to_websafe_string()
+    self.assertEqual(query.MultiQueryCursor.from_websafe_string(websafe),
+                     curs)
+    curs = query.MultiQueryCursor.from_websafe_string(websafe)
+    # Joe's copy from the second subquery is not returned again.
+    res, curs, more = q.fetch_page(1, start_cursor=curs)
+    self.assertEqual(res, [self.moe])
+    self.assertFalse(more)
+    self.assertEqual(curs.cursors, (None, None))
+    self.assertEqual(q.fetch(start_cursor=curs), [])
+    wrong = query.MultiQueryCursor([None])
+    self.assertRaises(datastore_errors.BadArgumentError,
+                      q.fetch, start_cursor=wrong)
+
+  def testMultiQueryCursorAfterLimit(self):
+    class Bar(model.Model):
+      name = model.StringProperty()
+      rate = model.IntegerProperty()
+    a1 = Bar(id=1, rate=5)
+    a2 = Bar(id=2, rate=5)
+    b1 = Bar(id=3, name='b')
+    a3 = Bar(id=4, rate=5)
+    model.put_multi([a1, a2, b1, a3])
+    q = Bar.query(query.OR(Bar.rate == 5, Bar.name == 'b')).order(Bar.key)
+    it = q.iter(limit=2, produce_cursors=True)
+    self.assertEqual(list(it), [a1, a2])
+    # The first subquery stopped at the limit but is not exhausted.
+    curs = it.cursor_after()
+    self.assertTrue(curs.cursors[0] is not None)
+    self.assertEqual(q.fetch(start_cursor=curs), [b1, a3])
+
   def testMultiQueryWithAndWithoutAncestor(self):
     class Benjamin(model.Model):
       name = model.StringProperty()
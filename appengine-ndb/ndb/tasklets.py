@@ -79,10 +79,43 @@ __all__ = ['Return', 'tasklet', 'synctasklet', 'toplevel', 'sleep',
            'make_default_context', 'make_context',
            'Future', 'MultiFuture', 'QueueFuture', 'SerialQueueFuture',
            'ReducingFuture',
+           'TRACE_PRODUCTION', 'TRACE_DEBUG',
+           'get_tracing_level', 'set_tracing_level',
            ]
 
 _logging_debug = utils.logging_debug
 
+# Tracing levels for Futures and tasklets; see set_tracing_level().
+TRACE_PRODUCTION = 0  # Only keep code objects; format them when needed.
+TRACE_DEBUG = 1  # Record the creation stack and info strings eagerly.
+
+_tracing_level = TRACE_DEBUG if utils.DEBUG else TRACE_PRODUCTION
+
+# Frames from this file are skipped when looking for a Future's creator.
+_THIS_FILE = sys._getframe().f_code.co_filename
+
+
+def get_tracing_level():
+  """Return the current tracing level."""
+  return _tracing_level
+
+
+def set_tracing_level(level):
+  """Set how much tracing information Futures and tasklets record.
+
+  TRACE_DEBUG records the stack where each Future is created and
+  formats descriptive strings for tasklets and batched operations.
+  TRACE_PRODUCTION only keeps a reference to the code that created
+  each Future (and the tasklet's function), and formats these lazily
+  in repr() and dump(); this makes creating Futures much cheaper.
+  The default is TRACE_DEBUG if utils.DEBUG is set, and
+  TRACE_PRODUCTION otherwise.
+  """
+  global _tracing_level
+  if level not in (TRACE_PRODUCTION, TRACE_DEBUG):
+    raise ValueError('Invalid tracing level: %r' % (level,))
+  _tracing_level = level
+
 
 def _is_generator(obj):
   """Helper to test for a generator object.
@@ -190,12 +223,23 @@ class Future(object):
   # XXX Add docstrings to all methods.  Separate PEP 3148 API from RPC API.
 
   _geninfo = None  # Extra info about suspended generator.
+  _origin = None  # (code, lineno) of the creator, in production mode.
+  _tasklet_func = None  # The tasklet function, in production mode.
 
   def __init__(self, info=None):
     # TODO: Make done a method, to match PEP 3148?
     __ndb_debug__ = 'SKIP'  # Hide this frame from self._where
     self._info = info  # Info from the caller about this Future's purpose.
-    self._where = utils.get_stack()
+    if _tracing_level == TRACE_DEBUG:
+      self._where = utils.get_stack()
+    else:
+      self._where = ()
+      # Find the nearest caller outside this module, like __repr__ does.
+      frame = sys._getframe(1)
+      while frame is not None and frame.f_code.co_filename == _THIS_FILE:
+        frame = frame.f_back
+      if frame is not None:
+        self._origin = (frame.f_code, frame.f_lineno)
     self._context = None
     self._reset()
 
@@ -222,19 +266,32 @@ class Future(object):
     else:
       state = 'pending'
     line = '?'
-    for line in self._where:
+    for line in self._get_where():
       if 'tasklets.py' not in line:
         break
-    if self._info:
-      line += ' for %s' % self._info
+    info = self._get_info()
+    if info:
+      line += ' for %s' % info
     if self._geninfo:
       line += ' %s' % self._geninfo
     return '<%s %x created by %s; %s>' % (
       self.__class__.__name__, id(self), line, state)
 
+  def _get_where(self):
+    """Return the creation stack as a list of strings."""
+    if self._origin is not None:
+      return [utils.code_info(*self._origin)]
+    return self._where
+
+  def _get_info(self):
+    """Return the info string, formatting it if it was deferred."""
+    if self._info is None and self._tasklet_func is not None:
+      return 'tasklet %s' % utils.func_info(self._tasklet_func)
+    return self._info
+
   def dump(self):
     return '%s\nCreated by %s' % (self.dump_stack(),
-                                  '\n called by '.join(self._where))
+                                  '\n called by '.join(self._get_where()))
 
   def dump_stack(self):
     lines = []
@@ -347,7 +404,9 @@ class Future(object):
 
   def _help_tasklet_along(self, gen, val=None, exc=None, tb=None):
     # XXX Docstring
-    info = utils.gen_info(gen)
+    info = None
+    if _tracing_level == TRACE_DEBUG:
+      info = utils.gen_info(gen)
     __ndb_debug__ = info
     try:
       save_context = get_context()
@@ -379,6 +438,8 @@ class Future(object):
 
     except Exception, err:
       _, _, tb = sys.exc_info()
+      if info is None:
+        info = utils.gen_info(gen)
       if isinstance(err, _flow_exceptions):
         # Flow exceptions aren't logged except in "heavy debug" mode,
         # and then only at DEBUG level, without a traceback.
@@ -408,13 +469,15 @@ class Future(object):
           raise RuntimeError('Future has already completed yet next is %r' %
                              self._next)
         self._next = value
-        self._geninfo = utils.gen_info(gen)
+        if _tracing_level == TRACE_DEBUG:
+          self._geninfo = utils.gen_info(gen)
         _logging_debug('%s is now blocked waiting for %s', self, value)
         value.add_callback(self._on_future_completion, value, gen)
         return
       if isinstance(value, (tuple, list)):
         # Arrange for yield to return a list of results (not Futures).
-        info = 'multi-yield from %s' % utils.gen_info(gen)
+        if _tracing_level == TRACE_DEBUG:
+          info = 'multi-yield from %s' % utils.gen_info(gen)
         mfut = MultiFuture(info)
         try:
           for subfuture in value:
@@ -978,7 +1041,11 @@ def tasklet(func):
     # generator and turn it into a tasklet dynamically.  (Monocle has
     # this I believe.)
     # __ndb_debug__ = utils.func_info(func)
-    fut = Future('tasklet %s' % utils.func_info(func))
+    if _tracing_level == TRACE_DEBUG:
+      fut = Future('tasklet %s' % utils.func_info(func))
+    else:
+      fut = Future()
+      fut._tasklet_func = func
     fut._context = get_context()
     try:
       result = func(*args, **kwds)
@@ -85,6 +85,37 @@ class TaskletTests(test_utils.NDBTest):
       repr(f2))
     f2.check_success()
 
+  def testFuture_Repr_ProductionTracing(self):
+    prefix = r'<Future [\da-f]+ created by '
+    @tasklets.tasklet
+    def foo():
+      f1 = tasklets.Future()
+      self.assertEqual(f1._where, ())
+      self.assertTrue(re.match(prefix +
+                               r'foo\(tasklets_test.py:\d+\); pending>$',
+                               repr(f1)),
+                      repr(f1))
+      f1.set_result(None)
+      yield f1
+    self.assertEqual(tasklets.get_tracing_level(), tasklets.TRACE_DEBUG)
+    tasklets.set_tracing_level(tasklets.TRACE_PRODUCTION)
+    try:
+      f2 = foo()
+      self.assertEqual(f2._info, None)
+      self.assertTrue(
+        re.match(prefix +
+                 r'testFuture_Repr_ProductionTracing\(tasklets_test.py:\d+\) '
+                 r'for tasklet foo\(tasklets_test.py:\d+\); pending>$',
+                 repr(f2)),
+        repr(f2))
+      self.assertTrue(
+        re.search(r'Created by testFuture_Repr_ProductionTracing', f2.dump()),
+        f2.dump())
+      f2.check_success()
+    finally:
+      tasklets.set_tracing_level(tasklets.TRACE_DEBUG)
+    self.assertRaises(ValueError, tasklets.set_tracing_level, 42)
+
   def testFuture_Done_State(self):
     f = tasklets.Future()
     self.assertFalse(f.done())
@@ -2,6 +2,7 @@
 
 Run this using 'make x CUSTOM=putbench FLAGS=-n'.
 Use FLAGS=-o to get the corresponding profile for the old db package.
+Use FLAGS=-c to compare ndb with and without the cached serialization plan.
 """
 
 import cProfile
@@ -62,6 +63,26 @@ def put_new(people):
   keys = ndb.put_multi(people, use_cache=False, use_memcache=False)
 
 
+def compare_plans(n):
+  """Time _to_pb() and put_multi() with and without the serialization plan."""
+  plan = NewPerson._serialization_plan
+  try:
+    for label, p in [('generic', None), ('plan', plan)]:
+      NewPerson._serialization_plan = p
+      people = [NewPerson() for i in xrange(n)]
+      more_people = [NewPerson() for i in xrange(n)]
+      t0 = time.time()
+      for person in people:
+        person._to_pb()
+      t1 = time.time()
+      put_new(more_people)
+      t2 = time.time()
+      print '%-8s _to_pb: %.3f seconds; put_multi: %.3f seconds' % (
+        label, t1-t0, t2-t1)
+  finally:
+    NewPerson._serialization_plan = plan
+
+
 def timer(func, people):
   t0 = time.time()
   func(people)
@@ -76,6 +97,9 @@ def main(k=0):
     n = int(sys.argv[-1])
   except:
     n = N
+  if '-c' in sys.argv:
+    compare_plans(n)
+    return
   if '-o' in sys.argv and '-n' not in sys.argv:
     people = [OldPerson() for i in xrange(n)]
     func = put_old
@@ -83,7 +107,7 @@ def main(k=0):
     people = [NewPerson() for i in xrange(n)]
     func = put_new
   else:
-    sys.stderr.write('Usage: $0 (-o|-n)\n')
+    sys.stderr.write('Usage: $0 (-o|-n|-c)\n')
     sys.exit(2)
   prof = cProfile.Profile()
   prof = prof.runctx('timer(func, people)', globals(), locals())
@@ -38,14 +38,60 @@ apply_queue = 'apply-posts'
 cleanup_queue = 'cleanup-shard'
 notify_queue = 'notify-posts'
 pending_queue = 'pending-posts'
+pending_notify_queue = 'pending-notifications'
 email_digest_queue = 'email-digests'
 
+# How long a single apply task keeps draining the pending queue for a shard
+# before handing off to a continuation task.
+apply_time_budget_seconds = 5
+
+# Bounds on how many pending post tasks are applied in one Shard transaction.
+# The batch size doubles each time a lease comes back full. A transaction can
+# write at most 500 entities: one PostReference per post plus the Shard.
+apply_min_batch_size = 20
+apply_max_batch_size = 499
+
+# How many of a shard's most recently sequenced posts to keep in its hot
+# window cache, and for how long.
+hot_window_size = 200
+hot_window_cache_seconds = 24 * 60 * 60
+
+# Most shards whose hot windows are kept in instance memory.
+hot_window_instance_shards = 1000
+
+# Notifications enqueued for a shard within a window of this many seconds
+# share one fan-out task, which runs when the window closes.
+notify_window_seconds = 1
+
+# How long a notify task keeps sending a shard's pending notifications
+# before handing off to a follow-up task.
+notify_time_budget_seconds = 5
+
+# How long a shard's notify lock lasts without being renewed. It's renewed
+# before every wave of channel messages.
+notify_lock_seconds = 30
+
+# Most pending notification batches a notify task leases and coalesces at once.
+notify_max_batches = 100
+
+# How many channel messages the notify task has in flight at once.
+notify_wave_size = 50
+
+# Largest channel message to build when coalescing notifications. The
+# Channel API rejects messages over 32KB.
+channel_max_message_bytes = 32 * 1024
+
 # How long posts stay alive before being deleted. About 10 days.
 ephemeral_lifetime_seconds = 60 * 60 * 256
 
 # How long a user can be inactive (no heartbeat) before being logged out.
 user_max_inactive_seconds = 90
 
+# How long a shard's roster stays in memcache. The roster is updated in place
+# on each login, logout and heartbeat, so this only bounds drift from missed
+# updates.
+roster_cache_seconds = 10 * 60
+
 # How frequently the shard cleanup task should run.
 shard_cleanup_period_seconds = 60
 
@@ -42,9 +42,24 @@ class DeleteNdb(operation.Operation):
         context.mutation_pool.ndb_delete(self.entity)
 
 
+class DeleteNdbMulti(operation.Operation):
+    """Delete a list of entities from ndb via mutation_pool."""
+
+    def __init__(self, entities):
+        self.entities = entities
+
+    def __call__(self, context):
+        ndb_delete = context.mutation_pool.ndb_delete
+        for entity in self.entities:
+            ndb_delete(entity)
+
+
 class DeleteOldPostsMapper(object):
     """Mapper for deleting old posts."""
 
+    # Counter incremented for each deleted entity.
+    counter_name = 'deleted_post'
+
     def __init__(self):
         ctx = context.get()
         when = ctx.mapreduce_spec.mapper.params.get(
@@ -52,14 +67,37 @@ class DeleteOldPostsMapper(object):
         assert when
         self.before_datetime = datetime.datetime.utcfromtimestamp(when)
 
+    def is_old(self, entity):
+        return entity.post_time < self.before_datetime
+
     def map(self, entity):
-        if entity.post_time < self.before_datetime:
-            yield operation.counters.Increment('deleted_post')
+        if self.is_old(entity):
+            yield operation.counters.Increment(self.counter_name)
             yield DeleteNdb(entity)
 
+    def map_batch(self, entities):
+        """Batch mapper version of map(); see the batch_mapper parameter."""
+        old_entities = [e for e in entities if self.is_old(e)]
+        if old_entities:
+            yield operation.counters.Increment(
+                self.counter_name, len(old_entities))
+            yield DeleteNdbMulti(old_entities)
+
+
+class DeleteOldPostReferencesMapper(DeleteOldPostsMapper):
+    """Mapper for deleting the references, and stored JSON, of old posts."""
+
+    counter_name = 'deleted_post_reference'
+
+    def is_old(self, entity):
+        # References written before post times were stored on them are left
+        # alone; ListPostsHandler skips them once their Post is deleted.
+        return (entity.post_time is not None and
+                entity.post_time < self.before_datetime)
+
 
 class DeleteOldPostsPipeline(pipeline.Pipeline):
-    """Delete old posts that have expired."""
+    """Delete old posts, and their references, that have expired."""
 
     def run(self, lifetime_seconds=None):
         if lifetime_seconds is None:
@@ -74,9 +112,19 @@ class DeleteOldPostsPipeline(pipeline.Pipeline):
 
         yield mapreduce_pipeline.MapperPipeline(
             'Delete old posts',
-            'jobs.DeleteOldPostsMapper.map',
+            'jobs.DeleteOldPostsMapper.map_batch',
             'mapreduce.input_readers.DatastoreInputReader',
             params=dict(entity_kind='models.Post',
+                        batch_mapper=True,
+                        before_timestamp_seconds=before_timestamp_seconds),
+            shards=8)
+
+        yield mapreduce_pipeline.MapperPipeline(
+            'Delete old post references',
+            'jobs.DeleteOldPostReferencesMapper.map_batch',
+            'mapreduce.input_readers.DatastoreInputReader',
+            params=dict(entity_kind='models.PostReference',
+                        batch_mapper=True,
                         before_timestamp_seconds=before_timestamp_seconds),
             shards=8)
 
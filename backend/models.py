@@ -136,6 +136,15 @@ class PostReference(ndb.Model):
     # The key name of the Post that has this sequence number. Usually a UUID.
     post_id = ndb.TextProperty()
 
+    # The Post's JSON at this sequence number, from posts.serialize_posts().
+    # Unset on references written before it was stored, or if the Post was
+    # missing when it was sequenced.
+    json_fragment = ndb.TextProperty()
+
+    # When the Post was made, so expired posts can be skipped without
+    # loading them.
+    post_time = ndb.DateTimeProperty(indexed=False)
+
 
 class LoginRecord(ndb.Model):
     """Record of a user who is logged in.
@@ -19,6 +19,7 @@
 import datetime
 import json
 import logging
+import time
 
 from google.appengine.api import api_base_pb
 from google.appengine.api import apiproxy_stub_map
@@ -160,7 +161,8 @@ def insert_post(shard, **kwargs):
 def apply_posts(shard=None,
                 insertion_post_id=None,
                 lease_seconds=10,
-                max_tasks=20):
+                max_tasks=None,
+                time_budget_seconds=None):
     """Applies a set of pending posts to a shard.
 
     If shard is None then this function will apply mods for whatever is the
@@ -171,7 +173,19 @@ def apply_posts(shard=None,
     itself or it can confirm that the insertion_post_id has already been
     applied. insertion_post_id may be empty if the apply task is not associated
     with a particular post (such as cronjobs/cleanup tasks).
+
+    Pending tasks are applied in batches, one Shard transaction per batch,
+    until the pull queue is drained or time_budget_seconds have elapsed. The
+    lease for the next batch is issued while the current batch's transaction
+    is committing. max_tasks is the starting batch size; it doubles whenever
+    a lease comes back full, up to config.apply_max_batch_size.
     """
+    if max_tasks is None:
+        max_tasks = config.apply_min_batch_size
+    if time_budget_seconds is None:
+        time_budget_seconds = config.apply_time_budget_seconds
+    deadline = time.time() + time_budget_seconds
+
     # Do not use caching for NDB in this task queue worker.
     ctx = ndb.get_context()
     ctx.set_cache_policy(lambda x: False)
@@ -196,9 +210,128 @@ def apply_posts(shard=None,
     dirty_bit(shard, clear=True)
 
     # Find tasks pending for the current shard.
+    batch_size = max_tasks
     task_list.extend(
-        queue.lease_tasks_by_tag(lease_seconds, max_tasks, tag=str(shard)))
+        queue.lease_tasks_by_tag(lease_seconds, batch_size, tag=str(shard)))
+
+    futures = []
+    replica_shards = set()
+    publish_future = None
+    total_applied = 0
+    batch_count = 0
+    try:
+        while True:
+            # A full lease means the queue is backed up, so take bigger bites.
+            if len(task_list) >= batch_size:
+                batch_size = min(config.apply_max_batch_size, batch_size * 2)
+
+            # Pipeline the lease for the next batch with this batch's commit.
+            next_lease_rpc = None
+            if task_list and time.time() < deadline:
+                next_lease_rpc = queue.lease_tasks_by_tag_async(
+                    lease_seconds, batch_size, tag=str(shard))
+
+            # Replica tasks carry many post IDs each, so a lease may hold
+            # more posts than one transaction can write.
+            for sub_list in _split_tasks_by_posts(
+                    task_list, config.apply_max_batch_size):
+                shard_record, applied_count, publish_future, batch_futures = (
+                    _apply_batch(queue, shard, sub_list, insertion_post_id,
+                                 previous_publish_future=publish_future))
+                futures.append(publish_future)
+                futures.extend(batch_futures)
+                if shard_record.current_topic:
+                    replica_shards.add(shard_record.current_topic)
+
+                # Only the first batch needs to confirm the insertion post.
+                insertion_post_id = None
+                total_applied += applied_count
+                batch_count += 1
+
+            if next_lease_rpc is None:
+                break
+            task_list = next_lease_rpc.get_result()
+            if not task_list:
+                break
+    finally:
+        # Earlier batches have already committed, so their notifications and
+        # receipts must finish even when a later batch fails.
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            if future.get_exception() is not None:
+                logging.error('Pending work for shard=%r failed: %r',
+                              shard, future.get_exception())
+
+    logging.debug('Applied %d posts for shard=%r in %d batches',
+                  total_applied, shard, batch_count)
+
+    # Replicate posts to topic shards.
+    for replica_shard in replica_shards:
+        logging.debug('Replicating source shard=%r to replica shard=%r',
+                      shard, replica_shard)
+        futures.append(enqueue_apply_task(replica_shard))
+
+    # Always run one more apply task to clean up any posts that came in
+    # while this transaction was processing, or that were left behind when
+    # the time budget ran out.
+    if dirty_bit(shard, check=True) or time.time() >= deadline:
+        futures.append(enqueue_apply_task(shard))
+
+    # Wait on all pending futures in case they raise errors.
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
+
+    # For root shards, add shard cleanup task to check for user presence and
+    # cause notification of user logouts if the channel API did not detect the
+    # user closing the connection.
+    if not shard_record.root_shard:
+        presence.enqueue_cleanup_task(shard)
+
 
+def _split_tasks_by_posts(task_list, max_posts):
+    """Splits leased pending post tasks into batches of at most max_posts.
+
+    Args:
+        task_list: Leased pull tasks for a shard; may be empty.
+        max_posts: Most post IDs to put in one batch. A single task with
+            more post IDs than this still gets a batch to itself.
+
+    Returns:
+        List of task lists. Always has at least one entry, so an empty lease
+        still gets a batch.
+    """
+    batches = [[]]
+    post_count = 0
+    for task in task_list:
+        post_ids = task.extract_params().get('post_ids') or []
+        if not isinstance(post_ids, list):
+            post_ids = [post_ids]
+        if batches[-1] and post_count + len(post_ids) > max_posts:
+            batches.append([])
+            post_count = 0
+        batches[-1].append(task)
+        post_count += len(post_ids)
+    return batches
+
+
+def _apply_batch(queue, shard, task_list, insertion_post_id,
+                 previous_publish_future=None):
+    """Applies a single batch of leased pending post tasks to a shard.
+
+    Args:
+        queue: The pending posts taskqueue.Queue.
+        shard: Shard to apply the posts to.
+        task_list: Leased pull tasks for the shard; may be empty.
+        insertion_post_id: Optional post_id that must be confirmed as applied
+            if the batch turns out to have no work in it.
+        previous_publish_future: Optional. Publish future of the previous
+            batch, so batches are published in sequence order.
+
+    Returns:
+        Tuple (shard_record, applied_count, publish_future, futures) where
+        the futures must be waited on by the caller.
+    """
     receipt_key_list = []
     new_topic = None
     for task in task_list:
@@ -232,6 +365,9 @@ def apply_posts(shard=None,
         for k, r in zip(receipt_key_list, receipt_list)
         if r is None]
     unapplied_post_ids = [r.post_id for r in unapplied_receipts]
+    unapplied_posts = ndb.get_multi(
+        [ndb.Key(models.Post._get_kind(), post_id)
+         for post_id in unapplied_post_ids])
 
     # Double check if we think there should be work to apply but we didn't find
     # any. This will force the apply task to retry immediately if the post task
@@ -276,13 +412,20 @@ def apply_posts(shard=None,
             shard_record.sequence_number + len(unapplied_receipts)))
         shard_record.sequence_number += max(1, len(unapplied_receipts))
 
-        # Write post references that point at the newly sequenced posts.
+        # Write post references that point at the newly sequenced posts,
+        # along with each post's JSON so readers never have to re-encode it.
         to_put = [shard_record]
-        for receipt, sequence in zip(unapplied_receipts, new_sequence_numbers):
-            to_put.append(models.PostReference(
+        for receipt, post, sequence in zip(
+                unapplied_receipts, unapplied_posts, new_sequence_numbers):
+            ref = models.PostReference(
                 id=sequence,
                 parent=shard_record.key,
-                post_id=receipt.post_id))
+                post_id=receipt.post_id)
+            if post:
+                post.sequence = sequence
+                ref.json_fragment = serialize_posts(shard, [post])[0]
+                ref.post_time = post.post_time
+            to_put.append(ref)
             # Update the receipt entity here; it will be written outside this
             # transaction, since these receipts may span multiple entity
             # groups.
@@ -295,17 +438,18 @@ def apply_posts(shard=None,
 
         ndb.put_multi(to_put)
 
-        return shard_record, new_sequence_numbers
+        return shard_record, new_sequence_numbers, to_put[1:]
 
     # Have this only attempt a transaction a single time. If the transaction
     # fails the task queue will retry this task within 4 seconds. Because
     # apply tasks are always named by the current Shard.sequence_number we
     # can be reasonably sure that no other apply task for this shard will be
     # running concurrently when this fails.
-    shard_record, new_sequence_numbers = ndb.transaction(txn, retries=1)
-    replica_shard = shard_record.current_topic
+    shard_record, new_sequence_numbers, ref_list = ndb.transaction(
+        txn, retries=1)
 
-    logging.debug('Applied %d posts for shard=%r, sequence_numbers=%r',
+    logging.debug('Applied batch of %d posts for shard=%r, '
+                  'sequence_numbers=%r',
                   len(unapplied_receipts), shard, new_sequence_numbers)
 
     futures = []
@@ -313,32 +457,200 @@ def apply_posts(shard=None,
     # Save receipts for all the posts.
     futures.extend(ndb.put_multi_async(unapplied_receipts))
 
-    # Notify all logged in users of the new posts.
-    futures.append(notify_posts(
-        shard, unapplied_post_ids, sequence_numbers=new_sequence_numbers))
-
-    # Replicate posts to a topic shard.
-    if replica_shard:
-        logging.debug('Replicating source shard=%r to replica shard=%r',
-                      shard, replica_shard)
-        futures.append(enqueue_apply_task(replica_shard))
+    # Notify all logged in users of the new posts. This also covers sequence
+    # numbers that were used up without any posts, so the hot window stays
+    # contiguous.
+    last_sequence = shard_record.sequence_number - 1
+    first_sequence = last_sequence - max(1, len(unapplied_receipts)) + 1
+    publish_future = _publish_batch(
+        shard,
+        [(ref.sequence, ref.json_fragment, ref.post_time)
+         for ref in ref_list if ref.json_fragment],
+        first_sequence, last_sequence, previous_publish_future)
 
     # Success! Delete the tasks from this queue.
-    queue.delete_tasks(task_list)
+    if task_list:
+        queue.delete_tasks(task_list)
 
-    # Always run one more apply task to clean up any posts that came in
-    # while this transaction was processing.
-    if dirty_bit(shard, check=True):
-        futures.append(enqueue_apply_task(shard))
+    return shard_record, len(unapplied_receipts), publish_future, futures
 
-    # Wait on all pending futures in case they raise errors.
-    ndb.Future.wait_all(futures)
 
-    # For root shards, add shard cleanup task to check for user presence and
-    # cause notification of user logouts if the channel API did not detect the
-    # user closing the connection.
-    if not shard_record.root_shard:
-        presence.enqueue_cleanup_task(shard)
+@ndb.tasklet
+def _publish_batch(shard, fragment_list, first_sequence, last_sequence,
+                   previous_future=None):
+    """Notifies users of an applied batch and adds it to the hot window.
+
+    Args:
+        shard: Shard the batch was applied to.
+        fragment_list: Tuples (sequence, fragment, post_time) of the newly
+            sequenced posts, where each fragment comes from
+            serialize_posts().
+        first_sequence, last_sequence: Inclusive range of sequence numbers
+            used up by the batch.
+        previous_future: Optional. Future to wait on before publishing, so
+            batches are published in sequence order. Its failure is logged
+            by apply_posts() and doesn't stop this batch from publishing.
+    """
+    if previous_future is not None:
+        try:
+            yield previous_future
+        except Exception, e:
+            logging.debug('Publishing batch for shard=%r after earlier '
+                          'batch failed: %r', shard, e)
+
+    try:
+        update_hot_window(shard, first_sequence, last_sequence, fragment_list)
+    except Exception, e:
+        logging.warning('Could not update hot window for shard=%r: %r',
+                        shard, e)
+        _discard_hot_window(shard)
+
+    if fragment_list:
+        yield enqueue_notify_task(
+            shard, [fragment for _, fragment, _ in fragment_list])
+
+
+def get_hot_window_key(shard):
+    """Returns the memcache key of the hot window for the given shard."""
+    return 'hot-posts-v2-shard-%s' % shard
+
+
+def get_hot_window_head_key(shard):
+    """Returns the memcache key of the hot window's last sequence number."""
+    return 'hot-posts-v2-shard-%s-head' % shard
+
+
+# Copies of hot windows in instance memory, keyed by shard.
+_hot_window_cache = {}
+
+
+def update_hot_window(shard, first_sequence, last_sequence, post_list,
+                      retries=3):
+    """Appends a newly applied batch of posts to a shard's hot window.
+
+    The hot window is a tuple (first_sequence, last_sequence, post_list)
+    covering every sequence number in the inclusive range, where post_list
+    holds (sequence, fragment, post_time) tuples in ascending sequence
+    order. A
+    batch that doesn't directly follow the window starts a new window, so
+    the covered range never has holes.
+
+    Args:
+        shard: Shard the posts were applied to.
+        first_sequence, last_sequence: Inclusive range of sequence numbers
+            used up by the batch.
+        post_list: List of (sequence, fragment, post_time) tuples for the
+            posts in the batch, where each fragment comes from
+            serialize_posts().
+        retries: How many times to retry a failed compare-and-set.
+    """
+    window_key = get_hot_window_key(shard)
+    client = memcache.Client()
+    for i in xrange(retries):
+        old_window = client.gets(window_key)
+        if old_window and old_window[1] + 1 == first_sequence:
+            window_first = old_window[0]
+            window_post_list = old_window[2] + post_list
+        else:
+            window_first = first_sequence
+            window_post_list = list(post_list)
+
+        if len(window_post_list) > config.hot_window_size:
+            window_post_list = window_post_list[-config.hot_window_size:]
+            window_first = window_post_list[0][0]
+
+        window = (window_first, last_sequence, window_post_list)
+        if old_window is None:
+            success = client.add(
+                window_key, window, config.hot_window_cache_seconds)
+        else:
+            success = client.cas(
+                window_key, window, config.hot_window_cache_seconds)
+        if success:
+            break
+    else:
+        logging.debug('Could not update hot window for shard=%r', shard)
+        _discard_hot_window(shard)
+        return
+
+    memcache.set(get_hot_window_head_key(shard), window[1],
+                 config.hot_window_cache_seconds)
+    _set_instance_hot_window(shard, window)
+
+
+def _discard_hot_window(shard):
+    """Deletes a shard's hot window so reads fall back to the datastore."""
+    memcache.delete_multi(
+        [get_hot_window_key(shard), get_hot_window_head_key(shard)])
+    _hot_window_cache.pop(shard, None)
+
+
+def _set_instance_hot_window(shard, window):
+    """Saves a copy of a shard's hot window in instance memory."""
+    if (shard not in _hot_window_cache and
+            len(_hot_window_cache) >= config.hot_window_instance_shards):
+        _hot_window_cache.clear()
+    _hot_window_cache[shard] = window
+
+
+def get_hot_window(shard):
+    """Returns the hot window for a shard, or None if it is not cached.
+
+    The copy in instance memory is used when it's as new as the window in
+    memcache, which only requires fetching the window's last sequence number.
+    """
+    last_sequence = memcache.get(get_hot_window_head_key(shard))
+    if last_sequence is None:
+        return None
+
+    window = _hot_window_cache.get(shard)
+    if window and window[1] == last_sequence:
+        return window
+
+    window = memcache.get(get_hot_window_key(shard))
+    if window:
+        _set_instance_hot_window(shard, window)
+    return window
+
+
+def get_expire_time():
+    """Returns the post time before which posts have expired."""
+    return datetime.datetime.now() - datetime.timedelta(
+        seconds=config.ephemeral_lifetime_seconds)
+
+
+def get_hot_window_posts(shard, end, count):
+    """Returns serialized posts from a shard's hot window.
+
+    Matches the results of the PostReference query in ListPostsHandler: the
+    newest 'count' posts when end is zero, otherwise the newest 'count' posts
+    in the range [end - count, end]. Expired posts are left out, the same as
+    ListPostsHandler does.
+
+    Returns:
+        List of base.RawJson fragments in descending sequence order, or None
+        if the hot window does not cover the requested posts.
+    """
+    window = get_hot_window(shard)
+    if not window:
+        return None
+
+    window_first, window_last, window_post_list = window
+    if not end:
+        if len(window_post_list) < count and window_first > 1:
+            return None
+        found_list = window_post_list
+    else:
+        start = max(1, end - count)
+        if end > window_last or start < window_first:
+            return None
+        found_list = [
+            post for post in window_post_list if start <= post[0] <= end]
+
+    expire_time = get_expire_time()
+    return [base.RawJson(fragment)
+            for _, fragment, post_time in found_list[::-1][:count]
+            if post_time >= expire_time]
 
 
 def marshal_posts(shard, post_list):
@@ -359,6 +671,31 @@ def marshal_posts(shard, post_list):
     return out
 
 
+def serialize_posts(shard, post_list):
+    """Returns the canonical JSON fragment of each post in a list.
+
+    Fragments are cached on each Post entity for the shard and sequence
+    number they were serialized with, so a post is only encoded once no
+    matter how many responses and channel messages it's spliced into.
+    """
+    out = []
+    for post in post_list:
+        cache_key = (shard, getattr(post, 'sequence', None))
+        fragment_cache = getattr(post, 'json_fragments', None)
+        if fragment_cache is None:
+            fragment_cache = post.json_fragments = {}
+
+        fragment = fragment_cache.get(cache_key)
+        if fragment is None:
+            fragment = json.dumps(
+                marshal_posts(shard, [post])[0],
+                sort_keys=True,
+                separators=(',', ':'))
+            fragment_cache[cache_key] = fragment
+        out.append(fragment)
+    return out
+
+
 @ndb.tasklet
 def send_message_async(client_id, message):
     """Send a message to a channel asynchronously.
@@ -382,10 +719,69 @@ def send_message_async(client_id, message):
         raise channel._ToChannelError(e)
 
 
+@ndb.tasklet
+def enqueue_notify_task(shard, fragment_list):
+    """Enqueues a batch of marshaled posts to be sent to a shard's users.
+
+    Fragments are split across pending batches so each one fits in a single
+    channel message. A fragment that can never fit is dropped.
+
+    Args:
+        shard: Shard ID the posts belong to.
+        fragment_list: JSON object strings, one per marshaled post.
+    """
+    payload_list = _pack_fragments(
+        fragment_list, config.channel_max_message_bytes)
+    if not payload_list:
+        return
+
+    yield taskqueue.Queue(config.pending_notify_queue).add_async(
+        [taskqueue.Task(method='PULL', tag=str(shard), payload=payload)
+         for payload in payload_list])
+
+    # The pull tasks must exist before the fan-out task that sends them runs.
+    yield enqueue_fan_out_task(shard)
+
+
+@ndb.tasklet
+def enqueue_fan_out_task(shard, next_window=False):
+    """Enqueues the task that sends a shard's pending notifications.
+
+    There is one fan-out task per shard per window, named so every batch
+    enqueued in a window joins the same task, which runs once the window
+    has closed.
+
+    Args:
+        shard: Shard ID to send notifications for.
+        next_window: When True, enqueue the task of the window after the
+            current one. Used by a fan-out task that left batches behind,
+            since the current window's task may be the one running.
+    """
+    now = time.time()
+    window = int(now / config.notify_window_seconds)
+    if next_window:
+        window += 1
+    countdown = (window + 1) * config.notify_window_seconds - now
+    try:
+        yield taskqueue.Queue(config.notify_queue).add_async(
+            taskqueue.Task(
+                url='/work/notify_posts',
+                params=dict(shard=shard),
+                name='notify-%s-window-%d' % (shard, window),
+                countdown=countdown))
+    except (taskqueue.TombstonedTaskError,
+            taskqueue.TaskAlreadyExistsError):
+        logging.debug('Enqueued notify task for shard=%r but task already '
+                      'present for window=%d', shard, window)
+
+
 @ndb.tasklet
 def notify_posts(shard, post_list, sequence_numbers=None):
     """Notifies logged-in users of a set of new posts.
 
+    The posts are marshaled here and queued for the fan-out task, which
+    does the actual sending; see fan_out_posts().
+
     Args:
         shard: Shard ID to notify for.
         post_list: When the post_list is a list of strings, then it's assumed
@@ -410,32 +806,256 @@ def notify_posts(shard, post_list, sequence_numbers=None):
     for post, sequence in zip(post_list, sequence_numbers):
         post.sequence = sequence
 
-    posts_json = json.dumps({
-        'posts': marshal_posts(shard, post_list),
-    })
+    yield enqueue_notify_task(shard, serialize_posts(shard, post_list))
 
-    login_record_list = presence.get_present_users(shard)
-    rpc_list = []
-    for login_record in login_record_list:
-        logging.debug(
-            'Informing shard=%r, user=%r, nickname=%r about messages '
-            'with sequence_numbers=%r', shard, login_record.user_id,
-            login_record.nickname, sequence_numbers)
-        browser_token = presence.get_token(login_record.user_id)
-        rpc_list.append(send_message_async(browser_token, posts_json))
 
-    for rpc in rpc_list:
-        try:
-            yield rpc
-        except channel.Error, e:
-            # NOTE: When receiving an InvalidChannelKeyError the message may
-            # still be available the next time the user connects to the channel
-            # with that same application key due to buffering in the backends.
-            # The dev_appserver mimics this behavior, but it's not reliable in
-            # prod.
-            logging.warning('Could not send JSON message to user=%r with '
-                            'browser_token=%r. %s: %s', login_record.user_id,
-                            browser_token, e.__class__.__name__, str(e))
+# Wrapping for each channel message built from pending batches.
+_MESSAGE_PREFIX = '{"posts": ['
+_MESSAGE_SUFFIX = ']}'
+
+
+def _pack_fragments(fragment_list, max_bytes):
+    """Joins JSON fragments into as few strings as fit in a channel message.
+
+    Args:
+        fragment_list: JSON strings to join with commas, oldest first. Each
+            is kept whole.
+        max_bytes: Largest message, including its wrapping, to pack for.
+
+    Returns:
+        List of comma-joined strings. Fragments too large to fit in a
+        message on their own are logged and dropped.
+    """
+    max_size = max_bytes - len(_MESSAGE_PREFIX) - len(_MESSAGE_SUFFIX)
+    packed_list = []
+    current = []
+    current_size = 0
+    for fragment in fragment_list:
+        if not fragment:
+            continue
+        if len(fragment) > max_size:
+            logging.error('Dropping notification of %d bytes; larger than '
+                          'the %d byte channel message limit',
+                          len(fragment), max_bytes)
+            continue
+        added_size = len(fragment) + (1 if current else 0)
+        if current and current_size + added_size > max_size:
+            packed_list.append(','.join(current))
+            current = []
+            current_size = 0
+            added_size = len(fragment)
+        current.append(fragment)
+        current_size += added_size
+
+    if current:
+        packed_list.append(','.join(current))
+
+    return packed_list
+
+
+def pack_messages(payload_list, max_bytes=None):
+    """Coalesces notification payloads into as few channel messages as fit.
+
+    Each payload is kept whole. enqueue_notify_task() never builds a payload
+    larger than a message, but any that is gets dropped rather than sent.
+
+    Args:
+        payload_list: Payloads from enqueue_notify_task(), oldest first.
+        max_bytes: Optional. Largest message to build. Defaults to
+            config.channel_max_message_bytes.
+
+    Returns:
+        List of JSON message strings, each with a 'posts' list.
+    """
+    if max_bytes is None:
+        max_bytes = config.channel_max_message_bytes
+
+    return [_MESSAGE_PREFIX + packed + _MESSAGE_SUFFIX
+            for packed in _pack_fragments(payload_list, max_bytes)]
+
+
+@ndb.tasklet
+def send_waves_async(browser_token_list, message_list, wave_size=None,
+                     keep_going=None):
+    """Sends every message to every browser token in bounded waves.
+
+    Args:
+        browser_token_list: Channel client IDs to send to.
+        message_list: Pre-serialized messages to send to each client.
+        wave_size: Optional. Most messages in flight at once. Defaults to
+            config.notify_wave_size.
+        keep_going: Optional. Function called before each wave; when it
+            returns False the remaining waves are not sent.
+
+    Returns:
+        List of tuples (wave_size, latency_seconds, failure_count), one per
+        wave that was sent.
+    """
+    if wave_size is None:
+        wave_size = config.notify_wave_size
+
+    send_list = [(browser_token, message)
+                 for browser_token in browser_token_list
+                 for message in message_list]
+
+    wave_stats = []
+    for i in xrange(0, len(send_list), wave_size):
+        if keep_going is not None and not keep_going():
+            logging.warning('Stopped sending after %d of %d messages',
+                            i, len(send_list))
+            break
+        wave = send_list[i:i + wave_size]
+        start = time.time()
+        rpc_list = [send_message_async(browser_token, message)
+                    for browser_token, message in wave]
+
+        failures = 0
+        for (browser_token, _), rpc in zip(wave, rpc_list):
+            try:
+                yield rpc
+            except channel.Error, e:
+                # NOTE: When receiving an InvalidChannelKeyError the message
+                # may still be available the next time the user connects to
+                # the channel with that same application key due to buffering
+                # in the backends. The dev_appserver mimics this behavior, but
+                # it's not reliable in prod.
+                failures += 1
+                logging.warning('Could not send JSON message to '
+                                'browser_token=%r. %s: %s', browser_token,
+                                e.__class__.__name__, str(e))
+
+        wave_stats.append((len(wave), time.time() - start, failures))
+
+    raise ndb.Return(wave_stats)
+
+
+def get_notify_lock_key(shard):
+    """Returns the memcache key of the fan-out lock for the given shard."""
+    return 'notify-lock-shard-%s' % shard
+
+
+def _acquire_notify_lock(shard):
+    """Takes a shard's fan-out lock, returning its token or None if taken."""
+    token = models.human_uuid()
+    if memcache.add(get_notify_lock_key(shard), token,
+                    time=config.notify_lock_seconds):
+        return token
+    return None
+
+
+def _renew_notify_lock(shard, token):
+    """Extends a shard's fan-out lock, returning False if it was lost."""
+    lock_key = get_notify_lock_key(shard)
+    client = memcache.Client()
+    if client.gets(lock_key) != token:
+        return False
+    return client.cas(lock_key, token, time=config.notify_lock_seconds)
+
+
+def _release_notify_lock(shard, token):
+    """Releases a shard's fan-out lock if it's still held with token."""
+    lock_key = get_notify_lock_key(shard)
+    if memcache.get(lock_key) == token:
+        memcache.delete(lock_key)
+
+
+def fan_out_posts(shard, lease_seconds=10, max_batches=None,
+                  time_budget_seconds=None):
+    """Sends all pending post notifications for a shard to its users.
+
+    Pending batches enqueued by notify_posts() are coalesced into as few
+    channel messages as possible, serialized once, and sent to each present
+    user in waves of bounded concurrency. Batches are leased and sent until
+    none are left, or until time_budget_seconds have elapsed, in which case
+    a follow-up fan-out task is enqueued. Raises base.Error if another
+    fan-out is already running for the shard, so the calling task retries.
+
+    Batches are deleted as soon as they are leased, so a lease that expires
+    during a slow send can't make another fan-out send them again. Like a
+    failed send, a batch lost to a crash is only caught up on by users
+    through ListPostsHandler.
+
+    Args:
+        shard: Shard ID to send notifications for.
+        lease_seconds: How long to lease the pending batches.
+        max_batches: Optional. Most pending batches to coalesce at once.
+            Defaults to config.notify_max_batches.
+        time_budget_seconds: Optional. How long to keep leasing batches.
+            Defaults to config.notify_time_budget_seconds.
+
+    Returns:
+        List of tuples (wave_size, latency_seconds, failure_count), one per
+        wave that was sent.
+    """
+    if max_batches is None:
+        max_batches = config.notify_max_batches
+    if time_budget_seconds is None:
+        time_budget_seconds = config.notify_time_budget_seconds
+    deadline = time.time() + time_budget_seconds
+
+    # Only one fan-out per shard at a time, so batches are delivered in the
+    # order they were enqueued. The lock is renewed before every wave, so it
+    # only expires if this worker dies while holding it.
+    token = _acquire_notify_lock(shard)
+    if token is None:
+        raise base.Error('Notify already running for shard=%r; will retry' %
+                         shard)
+
+    def keep_going():
+        return _renew_notify_lock(shard, token)
+
+    queue = taskqueue.Queue(config.pending_notify_queue)
+    browser_token_list = None
+    wave_stats = []
+    batch_count = 0
+    message_count = 0
+    try:
+        while True:
+            task_list = queue.lease_tasks_by_tag(
+                lease_seconds, max_batches, tag=str(shard))
+            if not task_list:
+                break
+            queue.delete_tasks(task_list)
+            batch_count += len(task_list)
+
+            message_list = pack_messages([task.payload for task in task_list])
+            message_count += len(message_list)
+            if browser_token_list is None:
+                browser_token_list = [
+                    presence.get_token(login_record.user_id)
+                    for login_record in presence.get_present_users(shard)]
+
+            wave_stats.extend(send_waves_async(
+                browser_token_list, message_list,
+                keep_going=keep_going).get_result())
+
+            if len(task_list) < max_batches:
+                break
+            if not keep_going():
+                logging.warning('Lost notify lock for shard=%r', shard)
+                break
+            if time.time() >= deadline:
+                # More batches may be pending; leave them to a new task.
+                enqueue_fan_out_task(shard, next_window=True).get_result()
+                break
+    finally:
+        _release_notify_lock(shard, token)
+
+    if not batch_count:
+        logging.debug('No pending notifications for shard=%r', shard)
+        return []
+
+    for i, (wave_size, latency, failures) in enumerate(wave_stats):
+        logging.debug('Notify wave %d for shard=%r: sent=%d, '
+                      'latency_ms=%.1f, failures=%d',
+                      i, shard, wave_size, latency * 1000, failures)
+    logging.info('Notified shard=%r of %d batches in %d messages to %d users '
+                 'over %d waves with %d failures',
+                 shard, batch_count, message_count,
+                 len(browser_token_list), len(wave_stats),
+                 sum(failures for _, _, failures in wave_stats))
+
+    return wave_stats
 
 
 class ApplyWorker(base.BaseHandler):
@@ -450,6 +1070,14 @@ class ApplyWorker(base.BaseHandler):
         apply_posts()
 
 
+class NotifyWorker(base.BaseHandler):
+    """Fans out pending post notifications."""
+
+    def post(self):
+        shard = self.request.get('shard')
+        fan_out_posts(shard)
+
+
 class PostHandler(base.BaseRpcHandler):
     """Handles users making new posts."""
 
@@ -500,12 +1128,19 @@ class ListPostsHandler(base.BaseRpcHandler):
     """
 
     require_shard = True
+    raw_json = True
 
     def handle(self):
         start = self.get_required('start', int, 0)
         end = self.get_required('end', int, 0)
         count = self.get_required('count', int, 100)
 
+        if not start:
+            fragment_list = get_hot_window_posts(self.shard, end, count)
+            if fragment_list is not None:
+                self.json_response['posts'] = fragment_list
+                return
+
         query = models.PostReference.query()
 
         if not start and not end:
@@ -533,32 +1168,45 @@ class ListPostsHandler(base.BaseRpcHandler):
         query = query.order(-models.PostReference.key)
 
         ref_list = query.fetch(count)
-        post_kind = models.Post._get_kind()
+        expire_time = get_expire_time()
 
-        post_key_list = [ndb.Key(post_kind, ref.post_id) for ref in ref_list]
+        # References written before fragments were stored on them need their
+        # Posts loaded and serialized.
+        post_kind = models.Post._get_kind()
+        old_ref_list = [ref for ref in ref_list if ref.json_fragment is None]
+        post_key_list = [
+            ndb.Key(post_kind, ref.post_id) for ref in old_ref_list]
         post_list = ndb.get_multi(post_key_list)
-        adjusted_post_list = []
-        for post, ref in zip(post_list, ref_list):
+        old_fragments = {}
+        for post, ref in zip(post_list, old_ref_list):
             # PostReference entities may point to non-existent Post entities
             # once the cleanup job has run. Filter them out here. The client
             # side won't try to scan for posts previous to the last one that's
             # actually found, so this filtering is okay.
             if not post:
                 continue
-
-            # TODO(bslatkin): Drop post entities that are older than
-            # config.ephemeral_lifetime_seconds, in case the background job
-            # takes longer than expected to delete things.
-
             post.sequence = ref.sequence
-            adjusted_post_list.append(post)
+            old_fragments[ref.sequence] = serialize_posts(
+                self.shard, [post])[0]
+
+        fragment_list = []
+        for ref in ref_list:
+            if ref.json_fragment is None:
+                fragment = old_fragments.get(ref.sequence)
+            elif ref.post_time < expire_time:
+                # The cleanup job deletes this Post; don't wait for it.
+                fragment = None
+            else:
+                fragment = ref.json_fragment
+            if fragment:
+                fragment_list.append(base.RawJson(fragment))
 
-        self.json_response['posts'] = marshal_posts(
-            self.shard, adjusted_post_list)
+        self.json_response['posts'] = fragment_list
 
 
 ROUTES = [
     (r'/rpc/list_posts', ListPostsHandler),
     (r'/rpc/post', PostHandler),
     (r'/work/apply_posts', ApplyWorker),
+    (r'/work/notify_posts', NotifyWorker),
 ]
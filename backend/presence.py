@@ -16,6 +16,7 @@
 
 """User login and presence."""
 
+import collections
 import datetime
 import logging
 import os
@@ -34,12 +35,79 @@ import posts
 import send_email
 
 
+# Compact entry in the per-shard roster cache.
+RosterEntry = collections.namedtuple(
+    'RosterEntry', ['user_id', 'nickname', 'last_update_time'])
+
+
+def get_roster_key(shard):
+    """Returns the memcache key of the roster for the given shard."""
+    return 'roster-shard-%s' % shard
+
+
 def invalidate_user_cache(shard):
     """Invalidates the present user cache for the given shard."""
-    # Memcache keys from get_present_users()
-    memcache.delete_multi([
-        'users-shard-%s' % shard,
-        'users-shard-%s-stale' % shard])
+    memcache.delete(get_roster_key(shard))
+
+
+def update_roster(shard, user_id, nickname=None, remove=False, retries=3):
+    """Updates a single user's entry in a shard's cached roster in place.
+
+    The roster is a dictionary mapping user_id to a tuple of (user_id,
+    nickname, last_update_time). If the roster is not cached it's rebuilt
+    from LoginRecords with this change applied, since the query may not see
+    the user's latest LoginRecord yet. If the compare-and-set keeps failing
+    the roster is invalidated instead.
+
+    Args:
+        shard: Shard the user belongs to.
+        user_id: User to update.
+        nickname: Current nickname of the user.
+        remove: When True, remove the user from the roster instead of adding
+            or touching their entry.
+        retries: How many times to retry a failed compare-and-set.
+    """
+    roster_key = get_roster_key(shard)
+    client = memcache.Client()
+    for i in xrange(retries):
+        roster = client.gets(roster_key)
+        cached = roster is not None
+        if not cached:
+            roster = query_roster(shard)
+
+        if remove:
+            if roster.pop(user_id, None) is None and cached:
+                return
+        else:
+            roster[user_id] = (user_id, nickname, datetime.datetime.now())
+
+        # Drop anyone who hasn't heartbeated lately to bound the roster size.
+        roster = dict(
+            (u.user_id, tuple(u)) for u in only_active_roster(roster))
+
+        if cached:
+            if client.cas(roster_key, roster, config.roster_cache_seconds):
+                return
+        # Use add() so a roster rebuilt by a concurrent request isn't
+        # overwritten; the next pass applies this change to that one instead.
+        elif client.add(roster_key, roster, config.roster_cache_seconds):
+            return
+
+    logging.debug('Could not update roster for shard=%r, user_id=%r; '
+                  'invalidating', shard, user_id)
+    invalidate_user_cache(shard)
+
+
+def only_active_roster(roster):
+    """Returns RosterEntry items for users in a roster who are still active.
+    """
+    oldest_time = (
+        datetime.datetime.now() -
+        datetime.timedelta(seconds=config.user_max_inactive_seconds))
+    return [
+        RosterEntry(*entry)
+        for entry in roster.itervalues()
+        if entry[2] and entry[2] >= oldest_time]
 
 
 def marshal_users(user_list):
@@ -112,6 +180,22 @@ def maybe_update_token(login_record, force=False):
     return True
 
 
+def query_roster(shard, limit=1000):
+    """Builds a shard's roster from its online LoginRecords.
+
+    The query is eventually consistent, so it may miss users who have just
+    logged in or still include users who have just logged out.
+    """
+    query = models.LoginRecord.query()
+    query = query.filter(models.LoginRecord.shard_id == shard)
+    query = query.filter(models.LoginRecord.online == True)
+    query = query.order(-models.LoginRecord.last_update_time)
+    user_list = only_active_users(*query.fetch(limit))
+    return dict(
+        (u.user_id, (u.user_id, u.nickname, u.last_update_time))
+        for u in user_list)
+
+
 def get_present_users(shard, include_stale=False, limit=1000):
     """Returns a list of present users for a shard in descending log-in order.
 
@@ -119,32 +203,28 @@ def get_present_users(shard, include_stale=False, limit=1000):
     who have just recently joined. That's okay. It's like they joined the chat
     a little bit late. They will still be able to see previous Posts through
     historical queries.
+
+    Active users come from the roster cache as RosterEntry items; the query
+    only runs when the roster isn't cached. With include_stale, LoginRecords
+    are always queried directly, including users who are already logged out.
     """
-    shard_key = 'users-shard-%s' % shard
     if include_stale:
-        shard_key = '%s-stale' % shard_key
-
-    user_list = memcache.get(shard_key)
-    if user_list:
-        return user_list
-
-    query = models.LoginRecord.query()
-    query = query.filter(models.LoginRecord.shard_id == shard)
-
-    # When we don't care about stale users, select everyone in the query,
-    # including users we know are already logged out.
-    if not include_stale:
-        query = query.filter(models.LoginRecord.online == True)
-
-    query.order(-models.LoginRecord.last_update_time)
-    user_list = query.fetch(limit)
-
-    if not include_stale:
-        user_list = only_active_users(*user_list)
-
-    memcache.set(shard_key, user_list, config.user_max_inactive_seconds)
-
-    return user_list
+        query = models.LoginRecord.query()
+        query = query.filter(models.LoginRecord.shard_id == shard)
+        query = query.order(-models.LoginRecord.last_update_time)
+        return query.fetch(limit)
+
+    roster_key = get_roster_key(shard)
+    roster = memcache.get(roster_key)
+    if roster is None:
+        roster = query_roster(shard, limit=limit)
+        # Use add() so a roster that was already rebuilt and updated in place
+        # by a concurrent request isn't overwritten by this possibly stale one.
+        memcache.add(roster_key, roster, config.roster_cache_seconds)
+
+    user_list = only_active_roster(roster)
+    user_list.sort(key=lambda u: u.last_update_time, reverse=True)
+    return user_list[:limit]
 
 
 def user_logged_in(shard, user_id):
@@ -175,7 +255,7 @@ def user_logged_in(shard, user_id):
         logging.debug('Logged-in new user_id=%r to shard=%r',
                       login_record.user_id, shard)
 
-    invalidate_user_cache(shard)
+    update_roster(shard, login_record.user_id, login_record.nickname)
     return login_record.user_id
 
 
@@ -208,7 +288,7 @@ def user_logged_out(shard, user_id):
         user_id=user_id,
         body='%s has left' % login_record.nickname)
 
-    invalidate_user_cache(shard)
+    update_roster(shard, user_id, remove=True)
     logging.debug('Logged out user_id=%r from shard=%r', user_id, shard)
 
 
@@ -249,13 +329,15 @@ def change_presence(shard, user_id, nickname, accepted_terms,
         login.email_address = email_address or None
         login.put()
 
-        return last_nickname, user_connected, login.browser_token
+        return (last_nickname, login.nickname, user_connected,
+                login.browser_token)
 
-    last_nickname, user_connected, browser_token = ndb.transaction(txn)
+    last_nickname, current_nickname, user_connected, browser_token = (
+        ndb.transaction(txn))
 
-    # Invalidate the cache so the nickname will be updated next time
-    # someone requests the roster.
-    invalidate_user_cache(shard)
+    # Touch the user's roster entry so their heartbeat and any nickname
+    # change are visible the next time someone requests the roster.
+    update_roster(shard, user_id, current_nickname)
 
     message = None
     archive_type = None
@@ -16,15 +16,19 @@
 
 """Tests for the posts module."""
 
+import datetime
 import json
 import logging
 import os
 import unittest
 
+from google.appengine.api import memcache
 from google.appengine.ext import testbed
 
+import base
 import config
 import models
+import ndb
 import posts
 import presence
 import topics
@@ -104,6 +108,15 @@ class PostTaskTest(unittest.TestCase):
         ref_ids = [r.key.id() for r in ref_list]
         self.assertEquals([1, 2, 3, 4, 5], ref_ids)
 
+        # Each reference stores the post's JSON at its sequence number.
+        for ref in ref_list:
+            post = ndb.Key(models.Post._get_kind(), ref.post_id).get()
+            post.sequence = ref.sequence
+            self.assertEquals(
+                posts.marshal_posts(shard.shard_id, [post]),
+                [json.loads(ref.json_fragment)])
+            self.assertEquals(post.post_time, ref.post_time)
+
         receipt_list = list(models.Receipt.query())
         receipt_parents = [r.key.parent() for r in receipt_list]
         self.assertEquals(post_key_list, receipt_parents)
@@ -111,6 +124,196 @@ class PostTaskTest(unittest.TestCase):
         shard_after = shard.key.get()
         self.assertEquals(6, shard_after.sequence_number)
 
+    def testMultipleBatches(self):
+        """Tests draining pending posts across several batches."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        post_key_list = []
+        for i in xrange(12):
+            post_key_list.append(posts.insert_post(
+                shard.shard_id,
+                post_id='my-id-%02d' % i,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i))
+
+        posts.apply_posts(shard.shard_id, max_tasks=2)
+        ref_list = list(models.PostReference.query())
+        ref_ids = [r.key.id() for r in ref_list]
+        self.assertEquals(range(1, 13), ref_ids)
+
+        ref_post_ids = sorted(r.post_id for r in ref_list)
+        self.assertEquals([k.id() for k in post_key_list], ref_post_ids)
+
+        shard_after = shard.key.get()
+        self.assertEquals(13, shard_after.sequence_number)
+
+    def testManyPostsPerTask(self):
+        """Tests splitting a lease that holds more posts than one batch."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        post_id_list = []
+        for i in xrange(6):
+            post_key = posts.insert_post(
+                'other-shard',
+                post_id='my-id-%d' % i,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i)
+            post_id_list.append(post_key.id())
+        posts.enqueue_post_task(shard.shard_id, post_id_list[:3])
+        posts.enqueue_post_task(shard.shard_id, post_id_list[3:])
+
+        old_max = config.apply_max_batch_size
+        config.apply_max_batch_size = 4
+        try:
+            posts.apply_posts(shard.shard_id)
+        finally:
+            config.apply_max_batch_size = old_max
+
+        ref_list = list(models.PostReference.query(ancestor=shard.key))
+        self.assertEquals(range(1, 7), [r.key.id() for r in ref_list])
+        self.assertEquals(7, shard.key.get().sequence_number)
+
+    def testTimeBudget(self):
+        """Tests that an exhausted time budget stops after a single batch."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        for i in xrange(4):
+            posts.insert_post(
+                shard.shard_id,
+                post_id='my-id-%d' % i,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i)
+
+        posts.apply_posts(shard.shard_id, max_tasks=2, time_budget_seconds=0)
+        self.assertEquals(2, models.PostReference.query().count())
+
+        posts.apply_posts(shard.shard_id)
+        self.assertEquals(4, models.PostReference.query().count())
+
+    def testHotWindow(self):
+        """Tests serving recently applied posts from the hot window."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        self.assertEquals(
+            None, posts.get_hot_window_posts(shard.shard_id, 0, 3))
+
+        post_key_list = []
+        for i in xrange(5):
+            post_key_list.append(posts.insert_post(
+                shard.shard_id,
+                post_id='my-id-%d' % i,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i))
+            posts.apply_posts(shard.shard_id)
+
+        found_posts = [
+            json.loads(f)
+            for f in posts.get_hot_window_posts(shard.shard_id, 0, 3)]
+        self.assertEquals([5, 4, 3], [p['sequenceId'] for p in found_posts])
+        post_list = [k.get() for k in reversed(post_key_list[2:])]
+        for post, sequence in zip(post_list, [5, 4, 3]):
+            post.sequence = sequence
+        self.assertEquals(
+            posts.marshal_posts(shard.shard_id, post_list), found_posts)
+
+        found_posts = [
+            json.loads(f)
+            for f in posts.get_hot_window_posts(shard.shard_id, 3, 2)]
+        self.assertEquals([3, 2], [p['sequenceId'] for p in found_posts])
+
+        # Past the newest applied post.
+        self.assertEquals(
+            None, posts.get_hot_window_posts(shard.shard_id, 6, 2))
+
+        # Expired posts are left out.
+        old_lifetime = config.ephemeral_lifetime_seconds
+        config.ephemeral_lifetime_seconds = -1
+        try:
+            self.assertEquals(
+                [], posts.get_hot_window_posts(shard.shard_id, 0, 3))
+        finally:
+            config.ephemeral_lifetime_seconds = old_lifetime
+
+        # Window is missing its start; fall back to the datastore.
+        window = posts.get_hot_window(shard.shard_id)
+        posts.update_hot_window(shard.shard_id, 10, 10, [])
+        self.assertEquals(
+            None, posts.get_hot_window_posts(shard.shard_id, 0, 3))
+        self.assertEquals((10, 10, []), posts.get_hot_window(shard.shard_id))
+        self.assertNotEquals(window, posts.get_hot_window(shard.shard_id))
+
+    def testPublishAfterFailedNotify(self):
+        """Tests that a failed notify doesn't stop later batches publishing."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        for i in xrange(4):
+            posts.insert_post(
+                shard.shard_id,
+                post_id='my-id-%d' % i,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i)
+
+        notified = []
+
+        @ndb.tasklet
+        def enqueue_notify_task(shard, fragment_list):
+            notified.append(len(fragment_list))
+            if len(notified) == 1:
+                raise RuntimeError('Transient failure')
+
+        old_enqueue = posts.enqueue_notify_task
+        posts.enqueue_notify_task = enqueue_notify_task
+        try:
+            posts.apply_posts(shard.shard_id, max_tasks=2)
+        finally:
+            posts.enqueue_notify_task = old_enqueue
+
+        self.assertEquals([2, 2], notified)
+        found_posts = [
+            json.loads(f)
+            for f in posts.get_hot_window_posts(shard.shard_id, 0, 4)]
+        self.assertEquals(
+            [4, 3, 2, 1], [p['sequenceId'] for p in found_posts])
+
+    def testSerializePosts(self):
+        """Tests that post fragments match marshaling and are cached."""
+        post = models.Post(
+            id='my-id-1234',
+            archive_type=models.Post.CHAT,
+            nickname='My name',
+            user_id='abc',
+            body=u'Here is my message \u2603',
+            post_time=datetime.datetime(2013, 5, 1, 12, 30))
+        post.sequence = 7
+
+        fragment_list = posts.serialize_posts('my-shard-name', [post])
+        self.assertEquals(
+            posts.marshal_posts('my-shard-name', [post]),
+            [json.loads(f) for f in fragment_list])
+        self.assertTrue(
+            fragment_list[0] is
+            posts.serialize_posts('my-shard-name', [post])[0])
+
+        # A new sequence number gets a new fragment.
+        post.sequence = 8
+        found = json.loads(posts.serialize_posts('my-shard-name', [post])[0])
+        self.assertEquals(8, found['sequenceId'])
+
     def testReceiptExists(self):
         """Tests that post receipts prevent duplicate PostReferences."""
         shard = models.Shard(id='my-shard-name')
@@ -155,6 +358,7 @@ class PostTaskTest(unittest.TestCase):
 
         # This clears the presence Post from change_presence()
         posts.apply_posts(shard.shard_id)
+        posts.fan_out_posts(shard.shard_id)
         channel_stub.pop_first_message(browser_token)
 
         post_key = posts.insert_post(
@@ -164,6 +368,7 @@ class PostTaskTest(unittest.TestCase):
             user_id='abc',
             body='Here is my message')
 
+        posts.fan_out_posts(shard.shard_id)
         message = channel_stub.pop_first_message(browser_token)
         found_posts = json.loads(message)['posts']
         post = post_key.get()
@@ -172,6 +377,7 @@ class PostTaskTest(unittest.TestCase):
         self.assertEquals(None, expected_posts[0]['sequenceId'])
 
         posts.apply_posts(shard.shard_id)
+        posts.fan_out_posts(shard.shard_id)
         post = post_key.get()
         message = channel_stub.pop_first_message(browser_token)
         found_posts = json.loads(message)['posts']
@@ -181,6 +387,148 @@ class PostTaskTest(unittest.TestCase):
         expected_posts = posts.marshal_posts(shard.shard_id, [post])
         self.assertEquals(expected_posts, found_posts)
 
+    def testChannelMessageCoalesced(self):
+        """Tests that pending notifications are sent as one message."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        channel_stub = self.testbed.get_stub(testbed.CHANNEL_SERVICE_NAME)
+        user_id = 'my-user-id'
+        presence.user_logged_in(shard.shard_id, user_id)
+        _, browser_token = presence.change_presence(
+            shard.shard_id, user_id, 'name here', True, True, False)
+        posts.apply_posts(shard.shard_id)
+        posts.fan_out_posts(shard.shard_id)
+        channel_stub.connect_channel(browser_token)
+
+        post_key_list = []
+        for i in xrange(3):
+            post_key_list.append(posts.insert_post(
+                shard.shard_id,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i))
+
+        wave_stats = posts.fan_out_posts(shard.shard_id)
+        self.assertEquals([1], [size for size, _, _ in wave_stats])
+        self.assertEquals([0], [failures for _, _, failures in wave_stats])
+
+        message = channel_stub.pop_first_message(browser_token)
+        found_post_ids = [p['postId'] for p in json.loads(message)['posts']]
+        self.assertEquals([k.id() for k in post_key_list], found_post_ids)
+        self.assertEquals(None, channel_stub.pop_first_message(browser_token))
+
+        # Nothing left to send.
+        self.assertEquals([], posts.fan_out_posts(shard.shard_id))
+
+    def testFanOutBacklog(self):
+        """Tests draining more pending notifications than one lease holds."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+
+        channel_stub = self.testbed.get_stub(testbed.CHANNEL_SERVICE_NAME)
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        user_id = 'my-user-id'
+        presence.user_logged_in(shard.shard_id, user_id)
+        _, browser_token = presence.change_presence(
+            shard.shard_id, user_id, 'name here', True, True, False)
+        posts.apply_posts(shard.shard_id)
+        posts.fan_out_posts(shard.shard_id)
+        channel_stub.connect_channel(browser_token)
+
+        for i in xrange(3):
+            posts.insert_post(
+                shard.shard_id,
+                archive_type=models.Post.CHAT,
+                nickname='My name',
+                user_id='abc',
+                body='Here is my message %d' % i)
+
+        # Out of time after the first lease; a follow-up task is enqueued.
+        taskqueue_stub.FlushQueue(config.notify_queue)
+        wave_stats = posts.fan_out_posts(
+            shard.shard_id, max_batches=1, time_budget_seconds=0)
+        self.assertEquals(1, len(wave_stats))
+        self.assertEquals(1, len(taskqueue_stub.get_filtered_tasks(
+            queue_names=[config.notify_queue])))
+
+        # The rest is sent one lease at a time.
+        wave_stats = posts.fan_out_posts(shard.shard_id, max_batches=1)
+        self.assertEquals(2, len(wave_stats))
+        self.assertEquals([], posts.fan_out_posts(shard.shard_id))
+
+    def testPackMessages(self):
+        """Tests splitting pending payloads across size-bounded messages."""
+        payload_list = ['{"a": 1}', '{"b": 2},{"c": 3}', '', '{"d": 4}']
+        self.assertEquals(
+            ['{"posts": [{"a": 1},{"b": 2},{"c": 3},{"d": 4}]}'],
+            posts.pack_messages(payload_list))
+
+        message_list = posts.pack_messages(payload_list, max_bytes=30)
+        self.assertEquals(
+            ['{"posts": [{"a": 1}]}',
+             '{"posts": [{"b": 2},{"c": 3}]}',
+             '{"posts": [{"d": 4}]}'],
+            message_list)
+        found = []
+        for message in message_list:
+            found.extend(json.loads(message)['posts'])
+        self.assertEquals(
+            [{'a': 1}, {'b': 2}, {'c': 3}, {'d': 4}], found)
+
+    def testPackMessagesOversized(self):
+        """Tests that a payload too big for any message is not sent."""
+        payload_list = ['{"a": 1}', '{"big": "%s"}' % ('x' * 40), '{"d": 4}']
+        self.assertEquals(
+            ['{"posts": [{"a": 1},{"d": 4}]}'],
+            posts.pack_messages(payload_list, max_bytes=40))
+
+    def testEnqueueNotifyTask(self):
+        """Tests one fan-out task per window and size-bounded batches."""
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        old_window = config.notify_window_seconds
+        old_max = config.channel_max_message_bytes
+        config.notify_window_seconds = 10**10
+        config.channel_max_message_bytes = 40
+        try:
+            posts.enqueue_notify_task(
+                'my-shard-name',
+                ['{"a": 1}', '{"b": 2}', '{"c": 3}']).get_result()
+            posts.enqueue_notify_task(
+                'my-shard-name',
+                ['{"big": "%s"}' % ('x' * 40), '{"d": 4}']).get_result()
+        finally:
+            config.notify_window_seconds = old_window
+            config.channel_max_message_bytes = old_max
+
+        notify_tasks = taskqueue_stub.get_filtered_tasks(
+            queue_names=[config.notify_queue])
+        self.assertEquals(1, len(notify_tasks))
+
+        pending_tasks = taskqueue_stub.get_filtered_tasks(
+            queue_names=[config.pending_notify_queue])
+        self.assertEquals(
+            ['{"a": 1},{"b": 2}', '{"c": 3}', '{"d": 4}'],
+            sorted(task.payload for task in pending_tasks))
+
+    def testFanOutLocked(self):
+        """Tests that only one fan-out runs for a shard at a time."""
+        shard = models.Shard(id='my-shard-name')
+        shard.put()
+        posts.insert_post(
+            shard.shard_id,
+            archive_type=models.Post.CHAT,
+            nickname='My name',
+            user_id='abc',
+            body='Here is my message')
+
+        memcache.add('notify-lock-shard-my-shard-name', 1)
+        self.assertRaises(base.Error, posts.fan_out_posts, shard.shard_id)
+
+        memcache.delete('notify-lock-shard-my-shard-name')
+        self.assertEquals([], posts.fan_out_posts(shard.shard_id))
+
     def testReplicate(self):
         """Tests replicating a post to a topic shard."""
         shard = models.Shard(id='my-shard-name')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the presence module."""
+
+import datetime
+import logging
+import os
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import testbed
+
+import config
+import models
+import presence
+
+
+class RosterTest(unittest.TestCase):
+    """Tests for the incrementally maintained roster cache."""
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.DEBUG)
+        self.maxDiff = 10**10
+        root_path = os.getcwd()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_channel_stub()
+        self.testbed.init_datastore_v3_stub(
+            root_path=root_path,
+            use_sqlite=True,
+            require_indexes=True)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=root_path)
+
+        self.shard = 'my-shard-name'
+        models.Shard(id=self.shard).put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testColdMiss(self):
+        """Tests that the roster is built from a query when not cached."""
+        presence.change_presence(
+            self.shard, 'user-1', 'first', True, True, False, '')
+        presence.invalidate_user_cache(self.shard)
+
+        user_list = presence.get_present_users(self.shard)
+        self.assertEquals(['user-1'], [u.user_id for u in user_list])
+        self.assertEquals(['first'], [u.nickname for u in user_list])
+
+        roster = memcache.get(presence.get_roster_key(self.shard))
+        self.assertEquals(['user-1'], roster.keys())
+
+    def testColdMissOnJoin(self):
+        """Tests that a joining user is in a roster the query can't see yet."""
+        datastore_stub = self.testbed.get_stub(testbed.DATASTORE_SERVICE_NAME)
+        datastore_stub.SetConsistencyPolicy(
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=0))
+
+        presence.change_presence(
+            self.shard, 'user-1', 'first', True, True, False, '')
+        user_list = presence.get_present_users(self.shard)
+        self.assertEquals(['user-1'], [u.user_id for u in user_list])
+
+    def testUpdatedInPlace(self):
+        """Tests that logins, renames and logouts update the cached roster."""
+        presence.get_present_users(self.shard)
+        self.assertEquals(
+            {}, memcache.get(presence.get_roster_key(self.shard)))
+
+        presence.change_presence(
+            self.shard, 'user-1', 'first', True, True, False, '')
+        presence.change_presence(
+            self.shard, 'user-2', 'second', True, True, False, '')
+        user_list = presence.get_present_users(self.shard)
+        self.assertEquals(['user-2', 'user-1'], [u.user_id for u in user_list])
+
+        presence.change_presence(
+            self.shard, 'user-1', 'renamed', True, True, False, '')
+        user_list = presence.get_present_users(self.shard)
+        self.assertEquals(['renamed', 'second'], [u.nickname for u in user_list])
+
+        presence.user_logged_out(self.shard, 'user-2')
+        user_list = presence.get_present_users(self.shard)
+        self.assertEquals(['user-1'], [u.user_id for u in user_list])
+
+    def testStaleEntriesDropped(self):
+        """Tests that users who stopped heartbeating leave the roster."""
+        stale_time = datetime.datetime.now() - datetime.timedelta(
+            seconds=config.user_max_inactive_seconds + 1)
+        memcache.set(presence.get_roster_key(self.shard), {
+            'user-1': ('user-1', 'first', stale_time),
+        })
+
+        self.assertEquals([], presence.get_present_users(self.shard))
+
+        presence.update_roster(self.shard, 'user-2', 'second')
+        roster = memcache.get(presence.get_roster_key(self.shard))
+        self.assertEquals(['user-2'], roster.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of per-post serialization cost for list responses.
+
+Every request loads its entities fresh from the datastore, so nothing is
+cached on them. This compares, per request, encoding marshaled Posts, the
+fragments serialize_posts() builds on first use, and the fragments stored on
+each PostReference when the post was sequenced. Run it the same way as the
+tests:
+
+    ./run_tests.sh tests/serialize_bench.py
+"""
+
+import datetime
+import json
+import time
+
+import base
+import models
+import posts
+
+
+SHARD = 'my-shard-name'
+
+
+def make_posts(count):
+    """Returns a list of sequenced Post entities that were never stored."""
+    post_time = datetime.datetime(2013, 5, 1, 12, 30)
+    post_list = []
+    for i in xrange(count):
+        post = models.Post(
+            id='my-id-%d' % i,
+            archive_type=models.Post.CHAT,
+            nickname='My name',
+            user_id='abc',
+            body='Here is my message %d with a little more text in it' % i,
+            post_time=post_time + datetime.timedelta(seconds=i))
+        post.sequence = i + 1
+        post_list.append(post)
+    return post_list
+
+
+def make_refs(post_list):
+    """Returns a PostReference with a stored fragment for each post."""
+    shard_key = models.Shard(id=SHARD).key
+    return [
+        models.PostReference(
+            id=post.sequence,
+            parent=shard_key,
+            post_id=post.post_id,
+            json_fragment=fragment,
+            post_time=post.post_time)
+        for post, fragment in zip(
+            post_list, posts.serialize_posts(SHARD, post_list))]
+
+
+def encode_marshaled(post_list):
+    return json.dumps({'posts': posts.marshal_posts(SHARD, post_list)})
+
+
+def encode_fragments(post_list):
+    return base.dumps_json({'posts': [
+        base.RawJson(fragment)
+        for fragment in posts.serialize_posts(SHARD, post_list)]})
+
+
+def encode_stored(ref_list):
+    return base.dumps_json({'posts': [
+        base.RawJson(ref.json_fragment) for ref in ref_list]})
+
+
+def bench(func, input_list):
+    """Returns the average microseconds per post for a serializer.
+
+    Each input is only encoded once, the same as a fresh request.
+    """
+    start = time.time()
+    for value in input_list:
+        func(value)
+    elapsed = time.time() - start
+    return elapsed * 1e6 / (len(input_list) * len(input_list[0]))
+
+
+def main():
+    for count, repetitions in ((100, 200), (1000, 20)):
+        post_list = make_posts(count)
+        assert (json.loads(encode_marshaled(post_list)) ==
+                json.loads(encode_stored(make_refs(post_list))))
+
+        marshaled = bench(
+            encode_marshaled, [make_posts(count) for _ in xrange(repetitions)])
+        fragments = bench(
+            encode_fragments, [make_posts(count) for _ in xrange(repetitions)])
+        stored = bench(
+            encode_stored,
+            [make_refs(make_posts(count)) for _ in xrange(repetitions)])
+        print ('%4d posts: marshal+dumps %6.2f us/post, '
+               'fragments on first use %6.2f us/post, '
+               'stored fragments %6.2f us/post (%.1fx)' % (
+                   count, marshaled, fragments, stored, marshaled / stored))
+
+
+if __name__ == '__main__':
+    main()
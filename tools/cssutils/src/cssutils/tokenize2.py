@@ -74,10 +74,14 @@ class Tokenizer(object):
         return expanded
 
     def _compile_productions(self, expanded_productions):
-        """compile productions into callable match objects, order is kept"""
+        """compile productions into callable match objects, order is kept
+
+        The patterns are not anchored with ``^`` as ``match(text, pos)``
+        anchors them at ``pos`` already.
+        """
         compiled = []
         for key, value in expanded_productions:
-            compiled.append((key, re.compile('^(?:%s)' % value, re.U).match))
+            compiled.append((key, re.compile('(?:%s)' % value, re.U).match))
         return compiled
 
     def push(self, *tokens):
@@ -117,6 +121,10 @@ class Tokenizer(object):
             return normalize(self.unicodesub(_repl, value))
 
         line = col = 1
+        # index of the next character to tokenize, text itself is never
+        # sliced as that would copy the rest of the sheet for each token
+        pos = 0
+        end = len(text)
 
         # check for BOM first as it should only be max one at the start
         (BOM, matcher), productions = self.tokenmatches[0], self.tokenmatches[1:]
@@ -124,47 +132,47 @@ class Tokenizer(object):
         if match:
             found = match.group(0)
             yield (BOM, found, line, col)
-            text = text[len(found):]
+            pos = match.end()
 
         # check for @charset which is valid only at start of CSS
-        if text.startswith('@charset '):
+        if text.startswith('@charset ', pos):
             found = '@charset ' # production has trailing S!
             yield (CSSProductions.CHARSET_SYM, found, line, col)
-            text = text[len(found):]
+            pos += len(found)
             col += len(found)
 
-        while text:
+        while pos < end:
             # do pushed tokens before new ones
             for pushed in self._pushed:
                 yield pushed
 
             # speed test for most used CHARs, sadly . not possible :(
-            c = text[0]
+            c = text[pos]
             if c in u',:;{}>+[]':
                 yield ('CHAR', c, line, col)
                 col += 1
-                text = text[1:]
+                pos += 1
 
             else:
                 # check all other productions, at least CHAR must match
                 for name, matcher in productions:
 
                     # TODO: USE bad comment?
-                    if fullsheet and name == 'CHAR' and text.startswith(u'/*'):
+                    if fullsheet and name == 'CHAR' and text.startswith(u'/*', pos):
                         # before CHAR production test for incomplete comment
-                        possiblecomment = u'%s*/' % text
+                        possiblecomment = u'%s*/' % text[pos:]
                         match = self.commentmatcher(possiblecomment)
                         if match and self._doComments:
                             yield ('COMMENT', possiblecomment, line, col)
-                            text = None # ate all remaining text
+                            pos = end # ate all remaining text
                             break
 
-                    match = matcher(text) # if no match try next production
+                    match = matcher(text, pos) # if no match try next production
                     if match:
                         found = match.group(0) # needed later for line/col
                         if fullsheet:
                             # check if found may be completed into a full token
-                            if 'INVALID' == name and text == found:
+                            if 'INVALID' == name and match.end() == end:
                                 # complete INVALID to STRING with start char " or '
                                 name, found = 'STRING', '%s%s' % (found, found[0])
 
@@ -172,8 +180,8 @@ class Tokenizer(object):
                                  u'url(' == _normalize(found):
                                 # url( is a FUNCTION if incomplete sheet
                                 # FUNCTION production MUST BE after URI production
-                                for end in (u"')", u'")', u')'):
-                                    possibleuri = '%s%s' % (text, end)
+                                for uriend in (u"')", u'")', u')'):
+                                    possibleuri = '%s%s' % (text[pos:], uriend)
                                     match = self.urimatcher(possibleuri)
                                     if match:
                                         name, found = 'URI', match.group(0)
@@ -196,7 +204,8 @@ class Tokenizer(object):
                                     name = self._atkeywords[_normalize(found)]
                                 except KeyError, e:
                                     # might also be misplace @charset...
-                                    if '@charset' == found and u' ' == text[len(found):len(found)+1]:
+                                    after = pos + len(found)
+                                    if '@charset' == found and u' ' == text[after:after+1]:
                                         # @charset needs tailing S!
                                         name = CSSProductions.CHARSET_SYM
                                         found += u' '
@@ -209,7 +218,7 @@ class Tokenizer(object):
                                                 name != 'COMMENT'):
                             yield (name, value, line, col)
 
-                        text = text[len(found):]
+                        pos += len(found)
                         nls = found.count(self._linesep)
                         line += nls
                         if nls:
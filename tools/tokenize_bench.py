@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the cssutils tokenizer on a large stylesheet.
+
+Tokenizes frontend/css/compiled.css repeated 10 times, the kind of large
+combined CSS that generate_templates.py feeds to inline_css. Run it from
+this directory:
+
+python tokenize_bench.py [copies]
+"""
+
+import sys
+import time
+
+sys.path.insert(0, 'cssutils/src')
+
+from cssutils import tokenize2
+
+CSS_PATH = '../frontend/css/compiled.css'
+
+
+def main():
+    copies = 10
+    if len(sys.argv) > 1:
+        copies = int(sys.argv[1])
+
+    css = open(CSS_PATH).read().decode('utf-8')
+    text = css * copies
+    tokenizer = tokenize2.Tokenizer()
+
+    for size, sheet in (('1x', css), ('%dx' % copies, text)):
+        start = time.time()
+        count = 0
+        for token in tokenizer.tokenize(sheet, fullsheet=True):
+            count += 1
+        elapsed = time.time() - start
+        print '%4s: %8d bytes, %7d tokens in %.3f seconds (%.0f KB/s)' % (
+            size, len(sheet), count, elapsed, len(sheet) / 1024.0 / elapsed)
+
+
+if __name__ == '__main__':
+    main()